@@ -0,0 +1,228 @@
+# benchmarks/bench_pipeline.py
+"""
+End-to-end performance benchmark on synthetic corpora.
+
+For each corpus size this generates documents with scripts/generate_sample_corpus.py
+(timestamps spread over ten years, skewed towards recent dates), builds the
+indices, then measures in a fresh process: load time, RSS after load, and
+p50/p95/p99 latency of every pipeline stage as reported by the pipeline's own
+trace. Results are written as JSON so runs from different commits can be compared.
+
+  python benchmarks/bench_pipeline.py --sizes 10000 100000 --out bench.json
+
+With --build-workers 1 2 4 8 the index is also rebuilt with each process pool
+size, reporting build time, speedup and whether the output matches the
+serial build byte for byte.
+"""
+import argparse
+import filecmp
+import importlib.util
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+QUERY_WORDS = ['current', 'latest', 'CEO', 'ExampleCorp', 'revenue', 'quarterly', 'CloudSync', 'DataVault',
+               'partnership', 'TechCorp', 'acquired', 'stock', 'price', 'release', 'version', 'security',
+               'investment', 'research', 'conference', 'analytics', 'who', 'is', 'the', 'of']
+
+def make_queries(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(QUERY_WORDS) for _ in range(rng.randint(2, 6))) for _ in range(n)]
+
+def _generator():
+    spec = importlib.util.spec_from_file_location('generate_sample_corpus', ROOT/'scripts'/'generate_sample_corpus.py')
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+def generate_corpus(path: Path, n_docs: int, seed: int = 0, years: float = 10.0):
+    """Synthetic corpus; document age is exponential (mean two years) capped at `years`."""
+    gen = _generator()
+    random.seed(seed)
+    end = datetime(2025, 1, 1)
+    with path.open('w', encoding='utf-8') as f:
+        for i in range(n_docs):
+            age = min(random.expovariate(1 / 730.0), years * 365.0)
+            f.write(json.dumps(gen.generate_document(i, end - timedelta(days=age)), ensure_ascii=False) + '\n')
+
+def dir_bytes(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+
+def rss_mb() -> float:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def percentiles(samples) -> dict:
+    a = np.asarray(samples, dtype=float) * 1000.0
+    return {'p50': float(np.percentile(a, 50)), 'p95': float(np.percentile(a, 95)),
+            'p99': float(np.percentile(a, 99)), 'mean': float(a.mean())}
+
+def query_bench(index_dir: Path, n_queries: int, cfg_overrides: dict) -> dict:
+    """Runs in a fresh process so RSS reflects the loaded index only."""
+    from twe_rag.pipeline import TWERAGPipeline, PipelineConfig
+    rss0 = rss_mb()
+    s = time.perf_counter()
+    pipe = TWERAGPipeline(PipelineConfig(index_dir=str(index_dir), trace=True, **cfg_overrides))
+    load_s = time.perf_counter() - s
+    rss = rss_mb()
+    now = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    queries = make_queries(n_queries)
+    pipe.run(queries[0], now=now)  # warm-up
+    stages, counters = {}, {}
+    total, halted_at = [], {}
+    for q in queries:
+        s = time.perf_counter()
+        out = pipe.run(q, now=now)
+        total.append(time.perf_counter() - s)
+        trace = out['meta']['trace']
+        for k, v in trace['timings_ms'].items():
+            stages.setdefault(k, []).append(v / 1000.0)
+        for k, v in trace['counters'].items():
+            counters.setdefault(k, []).append(v)
+        halted_at[out['meta']['K']] = halted_at.get(out['meta']['K'], 0) + 1
+    latency = {k: percentiles(v) for k, v in stages.items()}
+    latency['total'] = percentiles(total)
+    res = {'load_s': load_s, 'rss_mb': rss, 'rss_delta_mb': rss - rss0, 'rss_after_queries_mb': rss_mb(),
+           'latency_ms': latency, 'counters_mean': {k: float(np.mean(v)) for k, v in counters.items()},
+           'final_stage_counts': {str(k): v for k, v in sorted(halted_at.items())}}
+    if pipe.cfg.dense_mode != 'exact':
+        # recall of the approximate retrieval against brute force (after RSS was taken)
+        from twe_rag.retrieval import HybridRetriever
+        exact, K = HybridRetriever(index_dir), max(pipe.cfg.K_stages)
+        hits = [len({c['idx'] for c in pipe.ret.retrieve(q, K=K)} & {c['idx'] for c in exact.retrieve(q, K=K)})
+                / max(min(K, len(exact.ids)), 1) for q in queries]
+        res['recall_at_k'] = {'k': K, 'mean': float(np.mean(hits)), 'min': float(np.min(hits))}
+    return res
+
+def same_tree(a: Path, b: Path) -> bool:
+    files = sorted(p.relative_to(a) for p in a.rglob('*') if p.is_file())
+    return files == sorted(p.relative_to(b) for p in b.rglob('*') if p.is_file()) and \
+        all(filecmp.cmp(a/f, b/f, shallow=False) for f in files)
+
+def build_scaling(corpus: Path, index_dir: Path, workers: list, build_kwargs: dict) -> list:
+    """Build time per process pool size, each output compared with the serial `index_dir`."""
+    from twe_rag.indexing import build_indices
+    rows, serial_s = [], None
+    for w in workers:
+        out = index_dir.with_name(index_dir.name + f'_w{w}')
+        shutil.rmtree(out, ignore_errors=True)
+        s = time.perf_counter()
+        build_indices(corpus, out, workers=w, **build_kwargs)
+        t = time.perf_counter() - s
+        serial_s = t if serial_s is None and w == 1 else serial_s
+        rows.append({'workers': w, 'build_s': t, 'identical': same_tree(index_dir, out)})
+        shutil.rmtree(out, ignore_errors=True)
+    for r in rows:
+        r['speedup'] = serial_s / r['build_s'] if serial_s else None
+    return rows
+
+def bench_size(n_docs: int, workdir: Path, n_queries: int, build_kwargs: dict, cfg_overrides: dict,
+               build_workers: list = ()) -> dict:
+    from twe_rag.indexing import build_indices
+    corpus = workdir/f'corpus_{n_docs}.jsonl'
+    index_dir = workdir/f'index_{n_docs}'
+    if not corpus.exists():
+        generate_corpus(corpus, n_docs)
+    shutil.rmtree(index_dir, ignore_errors=True)
+    s = time.perf_counter()
+    build_indices(corpus, index_dir, **build_kwargs)
+    build_s = time.perf_counter() - s
+    child = subprocess.run(
+        [sys.executable, __file__, '--query-bench', str(index_dir), '--queries', str(n_queries),
+         '--cfg', json.dumps(cfg_overrides)],
+        check=True, capture_output=True, text=True)
+    res = {'n_docs': n_docs, 'build_s': build_s, 'index_bytes': dir_bytes(index_dir),
+           'corpus_bytes': corpus.stat().st_size}
+    if build_workers:
+        res['build_scaling'] = build_scaling(corpus, index_dir, build_workers, build_kwargs)
+    res.update(json.loads(child.stdout.strip().splitlines()[-1]))
+    return res
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', '-C', str(ROOT), 'rev-parse', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sizes', type=int, nargs='+', default=[10000], help='corpus sizes, e.g. 10000 100000 1000000')
+    ap.add_argument('--queries', type=int, default=200)
+    ap.add_argument('--out', type=Path, default=Path('bench_results.json'))
+    ap.add_argument('--workdir', type=Path, default=None, help='keep corpora/indices here (default: temp dir)')
+    ap.add_argument('--graph', action='store_true', help='precompute the corpus graph, centrality_mode=precomputed')
+    ap.add_argument('--dense-mode', choices=['exact', 'ivf', 'maxscore', 'int8', 'pq'], default='exact',
+                    help='build the matching ANN/compressed embeddings and report recall@K against exact')
+    ap.add_argument('--build-workers', type=int, nargs='*', default=[],
+                    help='also time index builds with these process pool sizes, e.g. 1 2 4 8')
+    ap.add_argument('--query-bench', type=Path, default=None, help=argparse.SUPPRESS)
+    ap.add_argument('--cfg', type=str, default='{}', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.query_bench is not None:
+        print(json.dumps(query_bench(args.query_bench, args.queries, json.loads(args.cfg))))
+        sys.exit(0)
+
+    build_kwargs, cfg_overrides = {}, {}
+    if args.graph:
+        build_kwargs['graph_threshold'] = 0.05
+        cfg_overrides['centrality_mode'] = 'precomputed'
+    if args.dense_mode != 'exact':
+        cfg_overrides['dense_mode'] = args.dense_mode
+        if args.dense_mode in ('ivf', 'maxscore'):
+            build_kwargs['ann'] = True
+        else:
+            build_kwargs['quantize'] = args.dense_mode
+
+    tmp = None
+    workdir = args.workdir
+    if workdir is None:
+        tmp = tempfile.TemporaryDirectory()
+        workdir = Path(tmp.name)
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+        'config': {'queries': args.queries, 'build': build_kwargs, 'pipeline': cfg_overrides,
+                   'build_workers': args.build_workers},
+        'results': [],
+    }
+    for n in args.sizes:
+        print(f'[bench] N={n} ...', file=sys.stderr)
+        res = bench_size(n, workdir, args.queries, build_kwargs, cfg_overrides, args.build_workers)
+        report['results'].append(res)
+        lat = res['latency_ms']
+        print(f"[bench] N={n}: build {res['build_s']:.1f}s, index {res['index_bytes'] / 2**20:.1f} MiB, "
+              f"RSS {res['rss_mb']:.0f} MiB, total p50 {lat['total']['p50']:.1f}ms "
+              f"p99 {lat['total']['p99']:.1f}ms"
+              + (f", recall@{res['recall_at_k']['k']} {res['recall_at_k']['mean']:.3f}" if 'recall_at_k' in res else ''),
+              file=sys.stderr)
+        for r in res.get('build_scaling', []):
+            print(f"[bench] N={n}: build with {r['workers']} worker(s) {r['build_s']:.1f}s "
+                  f"(x{r['speedup']:.2f}){'' if r['identical'] else ' OUTPUT DIFFERS'}", file=sys.stderr)
+        args.out.write_text(json.dumps(report, indent=2), encoding='utf-8')
+    if tmp is not None:
+        tmp.cleanup()
+    print(f'Wrote {args.out}')
@@ -0,0 +1,96 @@
+# benchmarks/load_test.py
+"""
+Closed-loop load test for the HTTP query service (scripts/04_serve.py).
+
+Each of `--concurrency` clients keeps one keep-alive connection and sends
+queries back to back; reports throughput, latency percentiles and status codes.
+
+  python benchmarks/load_test.py --spawn --concurrency 32 --requests 2000
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from benchmarks.bench_pipeline import make_queries
+
+async def _request(reader, writer, host: str, query: str):
+    body = json.dumps({'query': query}).encode()
+    writer.write(f'POST /query HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+                 f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+    await reader.readexactly(length)
+    return status
+
+async def _client(host: str, port: int, queries, latencies, statuses):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for q in queries:
+            s = time.perf_counter()
+            status = await _request(reader, writer, host, q)
+            latencies.append(time.perf_counter() - s)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+async def load(host: str, port: int, concurrency: int, n_requests: int) -> dict:
+    queries = make_queries(n_requests, seed=1)
+    latencies, statuses = [], {}
+    s = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, queries[c::concurrency], latencies, statuses)
+                           for c in range(concurrency)))
+    wall = time.perf_counter() - s
+    ms = np.asarray(latencies) * 1000.0
+    return {'concurrency': concurrency, 'requests': n_requests, 'wall_s': wall,
+            'throughput_qps': n_requests / wall, 'statuses': {str(k): v for k, v in sorted(statuses.items())},
+            'latency_ms': {'p50': float(np.percentile(ms, 50)), 'p95': float(np.percentile(ms, 95)),
+                           'p99': float(np.percentile(ms, 99)), 'mean': float(ms.mean())}}
+
+async def _wait_ready(host: str, port: int, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f'server on {host}:{port} did not start')
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8000)
+    ap.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    ap.add_argument('--requests', type=int, default=1000)
+    ap.add_argument('--spawn', action='store_true', help='start scripts/04_serve.py for the duration of the test')
+    ap.add_argument('--serve-args', default='', help='extra arguments for the spawned server')
+    args = ap.parse_args()
+
+    proc = None
+    if args.spawn:
+        proc = subprocess.Popen([sys.executable, str(ROOT/'scripts'/'04_serve.py'), '--host', args.host,
+                                 '--port', str(args.port), *args.serve_args.split()])
+    try:
+        asyncio.run(_wait_ready(args.host, args.port))
+        for c in args.concurrency:
+            print(json.dumps(asyncio.run(load(args.host, args.port, c, args.requests))), flush=True)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
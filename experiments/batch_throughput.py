@@ -0,0 +1,42 @@
+# experiments/batch_throughput.py
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from twe_rag.pipeline import TWERAGPipeline, PipelineConfig
+
+WORDS = ['current', 'latest', 'CEO', 'ExampleCorp', 'revenue', 'quarterly', 'CloudSync', 'DataVault',
+         'partnership', 'TechCorp', 'acquired', 'stock', 'price', 'release', 'version', 'security',
+         'investment', 'research', 'conference', 'analytics', 'who', 'is', 'the', 'of']
+
+def make_queries(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))) for _ in range(n)]
+
+def qps(fn, n: int) -> float:
+    t = time.perf_counter()
+    fn()
+    return n / (time.perf_counter() - t)
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n', type=int, default=500, help='number of queries')
+    ap.add_argument('--batch-size', type=int, default=256)
+    args = ap.parse_args()
+
+    pipe = TWERAGPipeline(PipelineConfig())
+    queries = make_queries(args.n)
+    K = max(pipe.cfg.K_stages)
+    ret = pipe.ret
+
+    r_loop = qps(lambda: [ret.retrieve(q, K=K) for q in queries], args.n)
+    r_batch = qps(lambda: ret.retrieve_batch(queries, K=K, batch_size=args.batch_size), args.n)
+    p_loop = qps(lambda: [pipe.run(q) for q in queries], args.n)
+    p_batch = qps(lambda: pipe.run_batch(queries), args.n)
+
+    print(f'{args.n} queries, N={len(ret.ids)} docs, K={K}')
+    print(f'{"stage":<12}{"loop q/s":>12}{"batch q/s":>12}{"speedup":>10}')
+    print(f'{"retrieve":<12}{r_loop:>12.1f}{r_batch:>12.1f}{r_batch / r_loop:>9.2f}x')
+    print(f'{"pipeline":<12}{p_loop:>12.1f}{p_batch:>12.1f}{p_batch / p_loop:>9.2f}x')
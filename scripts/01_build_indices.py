@@ -1,57 +1,53 @@
 # scripts/01_build_indices.py
-import json, argparse
+import argparse
 from pathlib import Path
-from tqdm import tqdm
-from joblib import dump
-from dateutil.parser import isoparse
-
-import numpy as np
-from rank_bm25 import BM25Okapi
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.decomposition import TruncatedSVD
 
 import sys
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from twe_rag.text_utils import tokenize
-
-DATA = Path('data/corpus.jsonl')
-IDX = Path('index')
+from twe_rag.indexing import build_indices, DATA, IDX
+from twe_rag.streaming import build_indices_streaming
 
 if __name__ == '__main__':
     ap = argparse.ArgumentParser()
     ap.add_argument('--svd-dim', type=int, default=128)
+    ap.add_argument('--dense-float64', action='store_true',
+                    help='store embeddings as float64 (bit-exact scores of earlier builds)')
+    ap.add_argument('--graph', action='store_true',
+                    help='precompute the corpus-wide evidence graph (centrality_mode=precomputed)')
+    ap.add_argument('--graph-threshold', type=float, default=0.05)
+    ap.add_argument('--graph-mode', choices=['exact', 'minhash'], default='exact',
+                    help='all-pairs sparse product, or exact Jaccard of LSH candidate pairs only')
+    ap.add_argument('--allow-bad-timestamps', action='store_true',
+                    help='index docs with unparseable timestamps (no decay credit) instead of failing')
+    ap.add_argument('--shards', type=int, default=1,
+                    help='also split BM25 postings into this many shards (PipelineConfig.sharded)')
+    ap.add_argument('--time-partitions', choices=['month', 'year'], default=None,
+                    help='order rows by timestamp and record per-period partitions (date filters, time_pruning)')
+    ap.add_argument('--ann', action='store_true',
+                    help="also train an IVF index over the embeddings (PipelineConfig.dense_mode='ivf' or 'maxscore')")
+    ap.add_argument('--ann-lists', type=int, default=None, help='IVF lists (default about 4*sqrt(N))')
+    ap.add_argument('--quantize', choices=['int8', 'pq'], default=None,
+                    help='also store compressed embeddings (PipelineConfig.dense_mode of the same name)')
+    ap.add_argument('--pq-m', type=int, default=32, help='PQ sub-quantizers (bytes per document)')
+    ap.add_argument('--streaming', action='store_true',
+                    help='build in chunked passes over the corpus (postings, rows on disk; no --graph/--time-partitions)')
+    ap.add_argument('--memory-mb', type=float, default=1024,
+                    help='chunk size of --streaming: about MB/16 of raw text per chunk (not a memory limit)')
+    ap.add_argument('--workers', type=int, default=1,
+                    help='parse/tokenize/count in this many processes (output identical to 1)')
     args = ap.parse_args()
 
-    IDX.mkdir(parents=True, exist_ok=True)
-
-    docs, ids, times, tokenized = [], [], [], []
-    with DATA.open('r', encoding='utf-8') as f:
-        for line in f:
-            if not line.strip():
-                continue
-            obj = json.loads(line)
-            # validate timestamp parses
-            _ = isoparse(obj['timestamp'])
-            ids.append(obj['id'])
-            times.append(obj['timestamp'])
-            text = obj['text']
-            docs.append(text)
-            tokenized.append(tokenize(text))
-
-    # BM25
-    bm25 = BM25Okapi(tokenized)
-    dump(bm25, IDX/'bm25.joblib')
-
-    # TF-IDF + SVD (dense-ish, 128D)
-    tfidf = TfidfVectorizer(max_features=50000)
-    X = tfidf.fit_transform(docs)
-    svd = TruncatedSVD(n_components=args.svd_dim, random_state=42)
-    Xs = svd.fit_transform(X)  # (N, d)
-
-    dump(tfidf, IDX/'tfidf.joblib')
-    dump(svd, IDX/'svd.joblib')
-    np.save(IDX/'tfidf_svd.npy', Xs)
-
-    meta = { 'ids': ids, 'timestamps': times }
-    (IDX/'meta.json').write_text(json.dumps(meta), encoding='utf-8')
-    print(f'Indexed {len(ids)} docs; SVD dim={args.svd_dim}')
+    build, extra = build_indices, {'workers': args.workers}
+    if args.streaming:
+        if args.workers > 1:
+            ap.error('--workers applies to in-memory builds only')
+        build, extra = build_indices_streaming, {'memory_mb': args.memory_mb}
+    n = build(DATA, IDX, svd_dim=args.svd_dim,
+              dense_dtype='float64' if args.dense_float64 else 'float32',
+              graph_threshold=args.graph_threshold if args.graph else None, graph_mode=args.graph_mode,
+              allow_bad_timestamps=args.allow_bad_timestamps,
+              shards=args.shards,
+              time_partition=args.time_partitions,
+              ann=args.ann, ann_lists=args.ann_lists,
+              quantize=args.quantize, pq_m=args.pq_m, **extra)
+    print(f'Indexed {n} docs; SVD dim={args.svd_dim}')
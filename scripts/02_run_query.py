@@ -15,6 +15,8 @@ if __name__ == '__main__':
     ap.add_argument('--base-delta', type=float, default=2.5, help='Time decay weight (higher = stronger recency)')
     ap.add_argument('--min-tau', type=float, default=90.0, help='Min tau in days for recency queries')
     ap.add_argument('--max-tau', type=float, default=730.0, help='Max tau in days for historical queries')
+    ap.add_argument('--stage-predictor', action='store_true',
+                    help='start at the predicted stage (scripts/08_train_stage_predictor.py)')
     args = ap.parse_args()
 
     pipe = TWERAGPipeline(PipelineConfig(
@@ -24,7 +26,8 @@ if __name__ == '__main__':
         K_stages=args.stages,
         base_delta=args.base_delta,
         min_tau=args.min_tau,
-        max_tau=args.max_tau
+        max_tau=args.max_tau,
+        stage_predictor=args.stage_predictor
     ))
     out = pipe.run(args.q)
     print(json.dumps(out, ensure_ascii=False, indent=2))
@@ -0,0 +1,25 @@
+# scripts/04_serve.py
+import argparse
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from twe_rag.pipeline import TWERAGPipeline, PipelineConfig
+from twe_rag.server import serve
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Serve POST /query over HTTP with request micro-batching')
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8000)
+    ap.add_argument('--index-dir', default='index')
+    ap.add_argument('--max-batch', type=int, default=64, help='max queries per batched retrieval')
+    ap.add_argument('--batch-window-ms', type=float, default=2.0, help='time to wait for requests to coalesce')
+    ap.add_argument('--max-inflight', type=int, default=512, help='reject with 503 beyond this many requests')
+    ap.add_argument('--queue-timeout', type=float, default=2.0, help='seconds queued before a 504')
+    ap.add_argument('--workers', type=int, default=1, help='batches executed concurrently')
+    ap.add_argument('--cache-size', type=int, default=0, help='query cache entries (0 disables)')
+    args = ap.parse_args()
+
+    pipe = TWERAGPipeline(PipelineConfig(index_dir=args.index_dir, cache_size=args.cache_size))
+    print(f'Serving on http://{args.host}:{args.port}/query', flush=True)
+    serve(pipe, args.host, args.port, max_batch=args.max_batch, batch_window_ms=args.batch_window_ms,
+          max_inflight=args.max_inflight, queue_timeout_s=args.queue_timeout, workers=args.workers)
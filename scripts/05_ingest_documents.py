@@ -0,0 +1,27 @@
+# scripts/05_ingest_documents.py
+import argparse, json
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from twe_rag.retrieval import IDX
+from twe_rag.segments import ingest_documents, delete_documents, drift_report
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Add or delete documents without rebuilding the index')
+    ap.add_argument('--jsonl', type=Path, help='new documents ({"id","timestamp","text"} per line); '
+                                                'existing ids are replaced')
+    ap.add_argument('--delete', nargs='+', default=[], help='document ids to delete')
+    ap.add_argument('--index-dir', type=Path, default=IDX)
+    ap.add_argument('--allow-bad-timestamps', action='store_true')
+    args = ap.parse_args()
+
+    if args.jsonl:
+        n = ingest_documents(args.jsonl, args.index_dir, allow_bad_timestamps=args.allow_bad_timestamps)
+        print(f'Ingested {n} docs into a delta segment')
+    if args.delete:
+        n = delete_documents(args.delete, args.index_dir)
+        print(f'Deleted {n} of {len(args.delete)} docs')
+    report = drift_report(args.index_dir)
+    print(json.dumps(report, indent=2))
+    if report['refit_recommended']:
+        print('Refit recommended: python scripts/06_compact_index.py')
@@ -0,0 +1,31 @@
+# scripts/06_compact_index.py
+import argparse, json
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from twe_rag.retrieval import IDX
+from twe_rag.index_format import recover_index
+from twe_rag.segments import compact_index, drift_report
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Merge delta segments and deletions with a full TF-IDF/SVD refit')
+    ap.add_argument('--index-dir', type=Path, default=IDX)
+    ap.add_argument('--if-needed', action='store_true', help='only compact when the drift report recommends it')
+    ap.add_argument('--allow-bad-timestamps', action='store_true',
+                    help='keep documents with unparseable timestamps (indexed without decay credit)')
+    ap.add_argument('--recover', action='store_true',
+                    help='only re-link an index left missing by an interrupted compaction to its newest version')
+    args = ap.parse_args()
+
+    if args.recover:
+        print('Recovered' if recover_index(args.index_dir) else 'Nothing to recover:', args.index_dir)
+        sys.exit(0)
+
+    if args.if_needed:
+        report = drift_report(args.index_dir)
+        if not report['refit_recommended']:
+            print('No refit needed:', json.dumps({k: report[k] for k in ('delta_fraction', 'oov_rate', 'retention')}))
+            sys.exit(0)
+        print('Refit:', '; '.join(report['reasons']))
+    n = compact_index(args.index_dir, allow_bad_timestamps=args.allow_bad_timestamps)
+    print(f'Compacted {args.index_dir}: {n} docs')
@@ -0,0 +1,30 @@
+# scripts/07_ann_recall.py
+import argparse
+from pathlib import Path
+
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import numpy as np
+
+from twe_rag.evals import ann_recall_report
+from twe_rag.io_utils import open_corpus_store
+from twe_rag.retrieval import IDX
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Recall@K of the IVF dense index against brute force')
+    ap.add_argument('--queries', type=Path, default=None, help='one query per line (default: sampled documents)')
+    ap.add_argument('--sample', type=int, default=200, help='documents whose first words serve as queries')
+    ap.add_argument('--k', type=int, default=100)
+    ap.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    args = ap.parse_args()
+
+    if args.queries is not None:
+        queries = [l.strip() for l in args.queries.open(encoding='utf-8') if l.strip()]
+    else:
+        store = open_corpus_store(IDX)
+        n = len(store)
+        rows = np.unique(np.linspace(0, n - 1, min(args.sample, n)).astype(np.int64))
+        queries = [' '.join(store.get_text(int(r)).split()[:12]) for r in rows]
+    print(f"{'nprobe':>7} {'dense@K':>8} {'hybrid@K':>9} {'scored':>7} {'ms/q':>7}")
+    for r in ann_recall_report(IDX, queries, K=args.k, nprobes=args.nprobe):
+        print(f"{r['nprobe']:>7} {r['dense_recall']:8.3f} {r['hybrid_recall']:9.3f} {r['scored']:7.1%} {r['ms']:7.2f}")
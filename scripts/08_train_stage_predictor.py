@@ -0,0 +1,61 @@
+# scripts/08_train_stage_predictor.py
+import argparse
+import json
+from pathlib import Path
+
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import numpy as np
+
+from twe_rag.budget import StagePredictor
+from twe_rag.evals import stage_selection_report
+from twe_rag.io_utils import open_corpus_store
+from twe_rag.pipeline import TWERAGPipeline, PipelineConfig
+from twe_rag.retrieval import IDX
+
+def load_queries(path: Path):
+    if path.suffix == '.jsonl':
+        return [json.loads(l)['question'] for l in path.open(encoding='utf-8') if l.strip()]
+    return [l.strip() for l in path.open(encoding='utf-8') if l.strip()]
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Fit the stage predictor (PipelineConfig.stage_predictor) '
+                                             'from logged ladder decisions')
+    ap.add_argument('--queries', type=Path, default=None,
+                    help="one query per line, or QA .jsonl with a 'question' field (default: sampled documents)")
+    ap.add_argument('--sample', type=int, default=2000, help='documents whose first words serve as queries')
+    ap.add_argument('--log', type=Path, default=None,
+                    help="JSONL of {'query', 'meta'} pipeline outputs: read if it exists and no --queries, "
+                         "else written from the ladder runs")
+    ap.add_argument('--stages', type=int, nargs='+', default=[30, 60, 100])
+    ap.add_argument('--eval-fraction', type=float, default=0.25, help='last share of queries held out for the report')
+    ap.add_argument('--threshold', type=float, default=0.9, help='skip a stage at this predicted chance of passing it')
+    ap.add_argument('--max-depth', type=int, default=1, help='tree depth (1 = decision stump)')
+    ap.add_argument('--min-leaf', type=int, default=50)
+    args = ap.parse_args()
+
+    cfg = PipelineConfig(index_dir=str(IDX), K_stages=args.stages, log_stage_features=True)
+    if args.log is not None and args.log.exists() and args.queries is None:
+        log = [json.loads(l) for l in args.log.open(encoding='utf-8') if l.strip()]
+    else:
+        if args.queries is not None:
+            queries = load_queries(args.queries)
+        else:
+            store = open_corpus_store(IDX)
+            rows = np.unique(np.linspace(0, len(store) - 1, min(args.sample, len(store))).astype(np.int64))
+            queries = [' '.join(store.get_text(int(r)).split()[:12]) for r in rows]
+        log = [{'query': o['query'], 'meta': o['meta']} for o in TWERAGPipeline(cfg).run_batch(queries)]
+        if args.log is not None:
+            with args.log.open('w', encoding='utf-8') as f:
+                f.writelines(json.dumps(e, ensure_ascii=False) + '\n' for e in log)
+    n_train = len(log) - int(len(log) * args.eval_fraction)
+    train, held_out = log[:n_train], log[n_train:]
+    pred = StagePredictor.fit(args.stages, [e['meta']['features'] for e in train], [e['meta']['K'] for e in train],
+                              threshold=args.threshold, max_depth=args.max_depth, min_samples_leaf=args.min_leaf)
+    pred.save(IDX/'stage_predictor.json')
+    ends = {K: sum(e['meta']['K'] == K for e in train) for K in args.stages}
+    print(f"Trained on {len(train)} queries, ladder ended at {ends}; wrote {IDX/'stage_predictor.json'}")
+    if held_out:
+        r = stage_selection_report(cfg, [e['query'] for e in held_out])
+        print(f"Held out {r['n']} queries: candidates/query {r['ladder_candidates']:.1f} -> "
+              f"{r['predicted_candidates']:.1f}, top-10 changed {r['changed']:.1%}")
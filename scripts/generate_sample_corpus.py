@@ -6,7 +6,6 @@ from datetime import datetime, timedelta
 import random
 
 OUT_DIR = Path('data/raw_texts')
-OUT_DIR.mkdir(parents=True, exist_ok=True)
 
 # Sample topics and content templates
 TOPICS = {
@@ -98,6 +97,7 @@ Looking ahead, ExampleCorp plans to continue expanding its product portfolio and
     }
 
 if __name__ == '__main__':
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
     # Generate 50+ documents spanning 2019-2024
     start_date = datetime(2019, 1, 1)
     docs = []
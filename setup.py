@@ -127,53 +127,17 @@ print(f"Wrote {len(docs)} docs to {corpus_path}")
 print("\n[3/3] Building indices...")
 sys.path.insert(0, str(Path(__file__).parent))
 
-from dateutil.parser import isoparse
-import numpy as np
-from rank_bm25 import BM25Okapi
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.decomposition import TruncatedSVD
-from joblib import dump
-from twe_rag.text_utils import tokenize
+from twe_rag.indexing import build_indices
 
 IDX = Path('index')
-IDX.mkdir(parents=True, exist_ok=True)
-
-ids, times, texts, tokenized = [], [], [], []
-with corpus_path.open('r', encoding='utf-8') as f:
-    for line in f:
-        if not line.strip():
-            continue
-        obj = json.loads(line)
-        ids.append(obj['id'])
-        times.append(obj['timestamp'])
-        texts.append(obj['text'])
-        tokenized.append(tokenize(obj['text']))
-
-# BM25
-bm25 = BM25Okapi(tokenized)
-dump(bm25, IDX/'bm25.joblib')
-print("  ✓ Built BM25 index")
-
-# TF-IDF + SVD
-tfidf = TfidfVectorizer(max_features=50000)
-X = tfidf.fit_transform(texts)
-svd = TruncatedSVD(n_components=128, random_state=42)
-Xs = svd.fit_transform(X)
-
-dump(tfidf, IDX/'tfidf.joblib')
-dump(svd, IDX/'svd.joblib')
-np.save(IDX/'tfidf_svd.npy', Xs)
-print("  ✓ Built TF-IDF and SVD indices")
-
-# Metadata
-meta = {'ids': ids, 'timestamps': times}
-(IDX/'meta.json').write_text(json.dumps(meta), encoding='utf-8')
+n_docs = build_indices(corpus_path, IDX, svd_dim=128)
+print("  ✓ Built BM25 postings, TF-IDF and SVD indices")
 print("  ✓ Saved metadata")
 
 print(f"\n{'=' * 60}")
 print("Setup Complete!")
 print(f"{'=' * 60}")
-print(f"\nIndexed {len(ids)} documents with 128D dense vectors")
+print(f"\nIndexed {n_docs} documents with 128D dense vectors")
 print("\nNext steps:")
 print("  1. Run a query:")
 print('     python scripts/02_run_query.py --q "Who is the current CEO?"')
@@ -0,0 +1,59 @@
+import json
+import numpy as np
+from twe_rag.ann import IVFIndex
+from twe_rag.indexing import build_indices
+from twe_rag.retrieval import HybridRetriever, top_k
+
+def test_ivf_lists_partition_rows_and_full_probe_is_exact():
+    rng = np.random.default_rng(0)
+    dv = rng.normal(size=(300, 8)).astype(np.float32)
+    dv /= np.linalg.norm(dv, axis=1, keepdims=True)
+    ivf = IVFIndex.build(dv, n_lists=10)
+    assert sorted(ivf.rows.tolist()) == list(range(300))
+    assert np.array_equal(IVFIndex.build(dv, n_lists=10).rows, ivf.rows)  # deterministic
+    qv = dv[7]
+    rows, scores = ivf.search(dv, qv, nprobe=1)
+    assert 7 in rows.tolist()  # a row's own list is the nearest one
+    rows, scores = ivf.search(dv, qv, nprobe=10)
+    assert rows.tolist() == list(range(300)) and np.array_equal(scores, dv @ qv)
+
+def test_ivf_retrieval_with_all_lists_matches_exact(tmp_path):
+    words = 'ExampleCorp CloudSync DataVault revenue quarterly CEO release partnership security stock'.split()
+    rng = np.random.default_rng(1)
+    docs = [{'id': f'd{i}', 'timestamp': '2024-01-01', 'text': ' '.join(rng.choice(words, 10))} for i in range(60)]
+    (tmp_path/'c.jsonl').write_text(''.join(json.dumps(d) + '\n' for d in docs), encoding='utf-8')
+    build_indices(tmp_path/'c.jsonl', tmp_path/'index', svd_dim=4, ann=True, ann_lists=5)
+    exact = HybridRetriever(tmp_path/'index')
+    ivf = HybridRetriever(tmp_path/'index', dense_mode='ivf', nprobe=5)
+    for q in ['ExampleCorp CEO', 'quarterly revenue release']:
+        want = exact.retrieve(q, K=10)
+        got = ivf.retrieve(q, K=10)
+        assert [c['idx'] for c in got] == [c['idx'] for c in want]
+        assert np.allclose([c['combo'] for c in got], [c['combo'] for c in want])
+        assert [c['idx'] for c in ivf.retrieve_batch([q], K=10)[0]] == [c['idx'] for c in want]
+
+def test_maxscore_equals_exhaustive_candidate_set_normalization(tmp_path):
+    words = ('ExampleCorp CloudSync DataVault revenue quarterly CEO release partnership security stock '
+             'AIAssist merger lawsuit dividend outage hiring patent').split()
+    rng = np.random.default_rng(2)
+    docs = [{'id': f'd{i}', 'timestamp': '2024-01-01', 'text': ' '.join(rng.choice(words, 8))} for i in range(200)]
+    (tmp_path/'c.jsonl').write_text(''.join(json.dumps(d) + '\n' for d in docs), encoding='utf-8')
+    build_indices(tmp_path/'c.jsonl', tmp_path/'index', svd_dim=8, ann=True, ann_lists=12)
+    ret = HybridRetriever(tmp_path/'index', dense_mode='maxscore', nprobe=1)
+    for q in ['ExampleCorp CEO', 'quarterly dividend', 'patent lawsuit outage', 'unknownword']:
+        qv = ret._dense_embed(q).astype(ret.dv.dtype)
+        dense = ret.dv @ qv
+        bound = ret.ann.upper_bounds(qv)
+        for l in range(ret.ann.n_lists):
+            rows = ret.ann.rows[ret.ann.ptr[l]:ret.ann.ptr[l + 1]]
+            assert len(rows) == 0 or dense[rows].max() <= bound[l]
+        # exhaustive: every document scored, normalized over term matches + the nprobe nearest lists
+        bm25 = ret.bm25.get_scores(q.lower().split())
+        cand = np.union1d(np.flatnonzero(bm25), ret.ann.probe(qv, 1))
+        b = (bm25 - bm25[cand].min()) / (bm25[cand].ptp() + 1e-9)
+        d = (dense - dense[cand].min()) / (dense[cand].ptp() + 1e-9)
+        for K in [1, 10, 30, 60, 100]:
+            got = ret.retrieve(q, K=K)
+            want = top_k(b + d, K)
+            assert [c['idx'] for c in got] == want.tolist()
+            assert np.allclose([c['combo'] for c in got], (b + d)[want])
@@ -4,3 +4,35 @@ def test_halt_simple():
     bh = BudgetHalting(margin_thresh=0.1, agree_thresh=0.0)
     dec = bh.decide([0.9, 0.2], ["a b c", "a b d"])
     assert dec.halt
+
+def test_shingle_agreement_matches_string_sets():
+    from twe_rag.text_utils import shingle_hashes, shingles, tokenize
+    texts = ["ExampleCorp names Cara Singh CEO today", "ExampleCorp names Cara Singh CEO",
+             "DataVault outage hits customers", "", "Cara Singh CEO of ExampleCorp"]
+    sets = [shingles(tokenize(t), n=3) for t in texts]
+    want = []
+    for i in range(5):
+        for j in range(i + 1, 5):
+            a, b = sets[i], sets[j]
+            want.append(len(a & b) / (len(a | b) + 1e-9) if a and b else 0.0)
+    bh = BudgetHalting()
+    assert abs(bh.shingle_agreement([shingle_hashes(tokenize(t), n=3) for t in texts]) - sum(want) / len(want)) < 1e-12
+
+def test_stage_predictor_matches_sklearn_and_roundtrips(tmp_path):
+    import numpy as np
+    from sklearn.tree import DecisionTreeClassifier
+    from twe_rag.budget import StagePredictor
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(400, 3))
+    end = np.where(X[:, 0] < 0, 30, np.where(X[:, 1] < 0.5, 60, 100))
+    feats = [dict(zip('abc', x)) for x in X.tolist()]
+    pred = StagePredictor.fit([30, 60, 100], feats, end.tolist(), threshold=0.9, max_depth=3, min_samples_leaf=5)
+    pred.save(tmp_path/'p.json')
+    pred = StagePredictor.load(tmp_path/'p.json')
+    want = DecisionTreeClassifier(max_depth=3, min_samples_leaf=5, random_state=0).fit(X, end > 30).predict_proba(X)[:, 1]
+    assert np.allclose([pred.proba(f)[0] for f in feats], want)
+    assert pred.start({'a': -1.0, 'b': 0.0, 'c': 0.0}) == 0
+    assert pred.start({'a': 1.0, 'b': 0.0, 'c': 0.0}) == 1
+    assert pred.start({'a': 1.0, 'b': 2.0, 'c': 0.0}) == 2
+    # a boundary the log never crosses is a constant
+    assert StagePredictor.fit([30, 60], feats, [30] * len(feats)).start(feats[0]) == 0
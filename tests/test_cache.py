@@ -0,0 +1,27 @@
+import numpy as np
+from twe_rag.cache import QueryCache, CacheEntry, normalize_query
+
+def _entry(k=10):
+    z = np.zeros(k)
+    return CacheEntry(idx=np.arange(k), bm25=z, dense=z, combo=z)
+
+def test_lru_eviction_and_byte_bound():
+    assert normalize_query('  Who is  the CEO?') == normalize_query('who is the ceo?')
+    c = QueryCache(max_entries=2)
+    c.put('a', _entry()); c.put('b', _entry())
+    assert c.get('a') is not None  # 'b' is now least recently used
+    c.put('c', _entry())
+    assert c.get('b') is None and c.get('c') is not None
+    s = c.stats()
+    assert s['entries'] == 2 and s['evictions'] == 1 and s['hits'] == 2 and s['misses'] == 1
+
+    e = _entry()
+    c = QueryCache(max_entries=100, max_bytes=3 * e.nbytes)
+    for i in range(5):
+        c.put(i, _entry())
+    assert len(c) == 3 and c.bytes <= c.max_bytes
+    # growing an entry re-accounts its size
+    e = c.get(4)
+    e.central[10] = np.zeros(10)
+    c.put(4, e)
+    assert c.bytes == sum(c.get(k).nbytes for k in (3, 4)) and len(c) == 2
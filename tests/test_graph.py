@@ -11,3 +11,109 @@ def test_degree_centrality():
     assert len(c) == 3
     # First two texts should have some similarity, third might be isolated
     assert c[0] >= 0 or c[1] >= 0  # At least one should have connections
+
+def test_extend_matches_fresh_build():
+    texts = [
+        "alpha beta gamma delta epsilon zeta eta theta",
+        "alpha beta gamma delta epsilon iota kappa lambda",
+        "zeta eta theta iota kappa lambda mu nu xi",
+        "alpha beta gamma delta mu nu xi omicron",
+        "iota kappa lambda mu nu xi pi rho",
+    ]
+    eg = EvidenceGraph(texts[:2])
+    eg.extend(texts[2:])
+    fresh = EvidenceGraph(texts)
+    assert (eg.degree_centrality() == fresh.degree_centrality()).all()
+    assert (eg.pagerank() == fresh.pagerank()).all()
+
+def test_minhash_edge_recall():
+    import numpy as np
+    rng = np.random.default_rng(0)
+    vocab = [f"w{i}" for i in range(400)]
+    bases = [list(rng.choice(vocab, 60)) for _ in range(20)]
+    texts = []
+    for k in range(200):
+        words = list(bases[k % 20])
+        for _ in range(rng.integers(0, 40)):
+            words[rng.integers(0, 60)] = rng.choice(vocab)
+        texts.append(' '.join(words))
+    exact = EvidenceGraph(texts)
+    approx = EvidenceGraph(texts, mode='minhash', lsh_threshold=0.05)
+    E = set(zip(*exact.edges(0.05)[:2]))
+    A = set(zip(*approx.edges(0.05)[:2]))
+    recall = len(E & A) / len(E)
+    assert recall >= 0.85, f"minhash edge recall vs exact: {recall:.3f} ({len(A)} approx / {len(E)} exact edges)"
+    # far fewer pairs compared than the exact all-pairs graph
+    assert len(approx.edges(0.0)[0]) < 0.1 * len(texts) * (len(texts) - 1) / 2
+
+def test_sparse_centrality_matches_networkx():
+    import numpy as np
+    import pytest
+    nx = pytest.importorskip('networkx')
+    texts = [
+        "alpha beta gamma delta epsilon zeta eta theta",
+        "alpha beta gamma delta epsilon iota kappa lambda",
+        "zeta eta theta iota kappa lambda mu nu xi",
+        "alpha beta gamma delta mu nu xi omicron",
+        "unrelated words only here",
+    ]
+    eg = EvidenceGraph(texts)
+    G = eg.to_networkx(0.05)
+    deg = np.array([d for _, d in G.degree(weight='weight')])
+    assert np.array_equal(eg.degree_centrality(0.05), (deg - deg.min()) / (deg.ptp() + 1e-9))
+    pr = nx.pagerank(G, weight='weight')
+    vec = np.array([pr[i] for i in range(len(texts))])
+    assert np.allclose(eg.pagerank(0.05), (vec - vec.min()) / (vec.ptp() + 1e-9), atol=1e-12)
+
+def test_corpus_graph_subgraph_matches_query_graph(tmp_path):
+    import numpy as np
+    from twe_rag.graph import CorpusGraph, degree_from_adjacency
+    from twe_rag.text_utils import tokenize, shingle_hashes
+    texts = [
+        "alpha beta gamma delta epsilon zeta eta theta",
+        "alpha beta gamma delta epsilon iota kappa lambda",
+        "zeta eta theta iota kappa lambda mu nu xi",
+        "alpha beta gamma delta mu nu xi omicron",
+        "iota kappa lambda mu nu xi pi rho",
+    ]
+    CorpusGraph.build([shingle_hashes(tokenize(t)) for t in texts]).save(tmp_path/'graph')
+    cg = CorpusGraph.load(tmp_path/'graph')
+    idx = np.array([4, 1, 3, 0])
+    sub = EvidenceGraph([texts[i] for i in idx])
+    for thr in (0.05, 0.2):
+        assert np.array_equal(degree_from_adjacency(cg.subgraph(idx, thr)), sub.degree_centrality(thr))
+
+def test_corpus_graph_minhash_and_size_guard():
+    import numpy as np
+    import pytest
+    from twe_rag.graph import CorpusGraph
+    from twe_rag.text_utils import tokenize, shingle_hashes
+    rng = np.random.default_rng(0)
+    vocab = [f'w{i}' for i in range(400)]
+    base = [rng.choice(vocab, 30) for _ in range(100)]
+    texts = []
+    for k in range(500):
+        t = base[k % 100].copy()
+        t[rng.integers(0, 30, size=rng.integers(0, 10))] = rng.choice(vocab)
+        texts.append(' '.join(t))
+    hashes = [shingle_hashes(tokenize(t)) for t in texts] + [np.zeros(0, dtype=np.uint64)]
+    exact = CorpusGraph.build(hashes, 0.05)
+    approx = CorpusGraph.build(hashes, 0.05, mode='minhash')
+    i, j = approx.W.nonzero()
+    # LSH only drops pairs: every kept edge carries its exact weight
+    assert np.array_equal(np.asarray(exact.W[i, j]).ravel(), np.asarray(approx.W[i, j]).ravel())
+    assert approx.W.nnz >= 0.95 * exact.W.nnz
+    for mode in ('exact', 'minhash'):
+        with pytest.raises(ValueError, match='max_pairs'):
+            CorpusGraph.build(hashes, 0.05, mode=mode, max_pairs=1000)
+
+def test_from_hashes_matches_texts():
+    from twe_rag.text_utils import shingle_hashes, tokenize
+    texts = [
+        "alpha beta gamma delta epsilon zeta eta theta",
+        "alpha beta gamma delta epsilon iota kappa lambda",
+        "zeta eta theta iota kappa lambda mu nu xi",
+    ]
+    eg = EvidenceGraph.from_hashes([shingle_hashes(tokenize(t), n=3) for t in texts])
+    assert eg.n_docs == 3
+    assert (eg.adjacency() != EvidenceGraph(texts).adjacency()).nnz == 0
@@ -0,0 +1,62 @@
+import json
+import numpy as np
+import pytest
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+from twe_rag.index_format import QueryEncoder, SVDModel, TfidfModel, read_manifest, verify_index
+from twe_rag.indexing import build_indices
+from twe_rag.text_utils import tfidf_tokenize
+
+def test_models_match_sklearn(tmp_path):
+    rng = np.random.default_rng(0)
+    words = [f'w{i}' for i in range(50)]
+    docs = [' '.join(rng.choice(words, 15)) for _ in range(40)]
+    tfidf = TfidfVectorizer(max_features=30).fit(docs)
+    svd = TruncatedSVD(n_components=5, random_state=42).fit(tfidf.transform(docs))
+    TfidfModel.from_vectorizer(tfidf).save(tmp_path/'tfidf')
+    SVDModel.from_svd(svd).save(tmp_path/'svd')
+    t, s = TfidfModel.load(tmp_path/'tfidf'), SVDModel.load(tmp_path/'svd')
+    queries = docs[:5] + ['w1 w1 unknown', 'nothing known', '']
+    assert (t.transform(queries) != tfidf.transform(queries)).nnz == 0
+    assert np.array_equal(s.transform(t.transform(queries)), svd.transform(tfidf.transform(queries)))
+
+    # query path: term table rows summed and normalized, no sparse TF-IDF vector
+    want = normalize(svd.transform(tfidf.transform(queries)))
+    assert np.allclose(QueryEncoder.build(t, s).embed_batch(queries), want, rtol=0, atol=1e-12)
+
+def test_tfidf_tokenize_matches_sklearn_analyzer():
+    analyze = TfidfVectorizer().build_analyzer()
+    for text in ['Who is the CEO of ExampleCorp?', 'a b c_d 2024-09-10', 'Café déjà vu — ÜNÏCODE', '']:
+        assert tfidf_tokenize(text) == analyze(text)
+
+def test_manifest_verify_and_legacy(tmp_path):
+    docs = [{'id': f'd{i}', 'timestamp': '2024-01-01', 'text': f'ExampleCorp report {i} revenue'} for i in range(8)]
+    (tmp_path/'c.jsonl').write_text(''.join(json.dumps(d) + '\n' for d in docs), encoding='utf-8')
+    build_indices(tmp_path/'c.jsonl', tmp_path/'index', svd_dim=2)
+    assert read_manifest(tmp_path/'index')['n_docs'] == 8
+    assert verify_index(tmp_path/'index') == []
+    idf = tmp_path/'index'/'tfidf'/'idf.npy'
+    raw = bytearray(idf.read_bytes())
+    raw[-1] ^= 1
+    idf.write_bytes(bytes(raw))
+    assert verify_index(tmp_path/'index') == ['tfidf/idf.npy']
+
+    (tmp_path/'old').mkdir()
+    (tmp_path/'old'/'meta.json').write_text('{}', encoding='utf-8')
+    with pytest.raises(FileNotFoundError, match='earlier version'):
+        read_manifest(tmp_path/'old')
+
+def test_query_path_does_not_import_sklearn(tmp_path):
+    import subprocess
+    import sys
+    docs = [{'id': f'd{i}', 'timestamp': '2024-01-01', 'text': f'ExampleCorp report {i} revenue'} for i in range(8)]
+    (tmp_path/'c.jsonl').write_text(''.join(json.dumps(d) + '\n' for d in docs), encoding='utf-8')
+    build_indices(tmp_path/'c.jsonl', tmp_path/'index', svd_dim=2)
+    code = ("import sys\n"
+            "from twe_rag.pipeline import TWERAGPipeline, PipelineConfig\n"
+            f"out = TWERAGPipeline(PipelineConfig(index_dir={str(tmp_path/'index')!r})).run('ExampleCorp revenue')\n"
+            "assert out['results']\n"
+            "print(sorted(m for m in sys.modules if m.split('.')[0] in ('sklearn', 'joblib')))\n")
+    res = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert res.stdout.strip() == '[]'
@@ -0,0 +1,45 @@
+import filecmp
+import json
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from twe_rag.indexing import _count_range, _tfidf_from_counts, build_indices, corpus_ranges
+
+def _corpus(path, n=120):
+    rng = np.random.default_rng(3)
+    words = [f'w{i}' for i in range(300)] + 'ExampleCorp CloudSync CEO revenue'.split()
+    with path.open('w', encoding='utf-8') as f:
+        for i in range(n):
+            ts = 'bad' if i == 7 else f'20{10 + i % 14}-0{1 + i % 9}-15T00:00:00Z'
+            f.write(json.dumps({'id': f'd{i}', 'timestamp': ts, 'text': ' '.join(rng.choice(words, 15))}) + '\n')
+            if i % 50 == 0:
+                f.write('\n')
+
+def test_corpus_ranges_are_line_aligned(tmp_path):
+    _corpus(tmp_path/'c.jsonl')
+    data = (tmp_path/'c.jsonl').read_bytes()
+    ranges = corpus_ranges(tmp_path/'c.jsonl', 7)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    assert all(data[lo - 1:lo] == b'\n' for lo, _ in ranges[1:])
+
+def test_parallel_build_is_byte_identical(tmp_path):
+    _corpus(tmp_path/'c.jsonl')
+    kwargs = {'svd_dim': 8, 'allow_bad_timestamps': True, 'time_partition': 'year', 'graph_threshold': 0.05}
+    build_indices(tmp_path/'c.jsonl', tmp_path/'serial', **kwargs)
+    build_indices(tmp_path/'c.jsonl', tmp_path/'parallel', workers=3, **kwargs)
+    files = sorted(p.relative_to(tmp_path/'serial') for p in (tmp_path/'serial').rglob('*') if p.is_file())
+    assert files == sorted(p.relative_to(tmp_path/'parallel') for p in (tmp_path/'parallel').rglob('*') if p.is_file())
+    assert all(filecmp.cmp(tmp_path/'serial'/f, tmp_path/'parallel'/f, shallow=False) for f in files)
+
+def test_tfidf_from_counts_matches_vectorizer(tmp_path):
+    _corpus(tmp_path/'c.jsonl')
+    parts = [_count_range((str(tmp_path/'c.jsonl'), lo, hi, False)) for lo, hi in corpus_ranges(tmp_path/'c.jsonl', 3)]
+    docs = [d for p in parts for d in p['docs']]
+    order = np.argsort([len(d) for d in docs], kind='stable')  # rows renumbered, as with time partitions
+    for max_features in (None, 100):  # all 304 terms, or pruned to the most frequent
+        want = TfidfVectorizer(max_features=max_features)
+        X = want.fit_transform([docs[i] for i in order])
+        tfidf, got = _tfidf_from_counts([p['tfidf'] for p in parts], order, len(docs), max_features)
+        assert tfidf.terms.tolist() == sorted(want.vocabulary_) and np.array_equal(tfidf.idf, want.idf_)
+        assert np.array_equal(got.indptr, X.indptr) and np.array_equal(got.indices, X.indices)
+        assert np.array_equal(got.data, X.data)
@@ -0,0 +1,14 @@
+import numpy as np
+from twe_rag.io_utils import CorpusStore, write_corpus_store
+from twe_rag.text_utils import shingle_hashes, tokenize
+
+def test_corpus_store_roundtrip(tmp_path):
+    texts = ['ExampleCorp names Cara Singh CEO', '', 'Café déjà vu — ünïcode']
+    stamps = ['2024-09-10', '2019-01-15T08:30:00+00:00', '2022-06-01']
+    write_corpus_store(tmp_path/'corpus', texts, stamps)
+    store = CorpusStore(tmp_path/'corpus')
+    assert len(store) == 3
+    assert [store.get_text(i) for i in range(3)] == texts
+    assert [store.get_timestamp(i) for i in range(3)] == stamps
+    for i, t in enumerate(texts):
+        assert np.array_equal(store.get_shingles(i), shingle_hashes(tokenize(t), n=3))
@@ -1,12 +1,93 @@
+import json
 import pytest
+from datetime import datetime, timezone
 from pathlib import Path
+import numpy as np
+from twe_rag.indexing import build_indices
 from twe_rag.pipeline import TWERAGPipeline, PipelineConfig
 
+QUERIES = ['current CEO of ExampleCorp', 'quarterly revenue release', 'CloudSync security partnership',
+           'DataVault stock', 'latest ExampleCorp CloudSync release', 'unknownword']
+
+def _index(tmp_path, n=150, seed=4):
+    words = 'ExampleCorp CloudSync DataVault revenue quarterly CEO release partnership security stock'.split()
+    rng = np.random.default_rng(seed)
+    docs = [{'id': f'd{i}', 'timestamp': f'20{14 + i % 10}-0{1 + i % 9}-01', 'text': ' '.join(rng.choice(words, 12))}
+            for i in range(n)]
+    (tmp_path/'c.jsonl').write_text(''.join(json.dumps(d) + '\n' for d in docs), encoding='utf-8')
+    build_indices(tmp_path/'c.jsonl', tmp_path/'index', svd_dim=4)
+    return str(tmp_path/'index')
+
 def test_pipeline_runs():
     # This test will only pass if the corpus and indices are built
-    if not Path('data/corpus.jsonl').exists() or not Path('index/bm25.joblib').exists():
+    if not Path('data/corpus.jsonl').exists() or not Path('index/bm25/params.json').exists():
         pytest.skip("Corpus or indices not built yet")
 
     pipe = TWERAGPipeline(PipelineConfig())
     out = pipe.run('current CEO of ExampleCorp')
     assert 'results' in out and 'meta' in out
+
+def test_cached_run_matches_uncached():
+    if not Path('data/corpus.jsonl').exists() or not Path('index/bm25/params.json').exists():
+        pytest.skip("Corpus or indices not built yet")
+    from datetime import datetime, timezone
+    pipe = TWERAGPipeline(PipelineConfig())
+    cached = TWERAGPipeline(PipelineConfig(cache_size=10))
+    for year in (2024, 2030):
+        now = datetime(year, 1, 1, tzinfo=timezone.utc)
+        for _ in range(2):
+            assert cached.run('current CEO of ExampleCorp', now=now) == pipe.run('current CEO of ExampleCorp', now=now)
+    assert cached.cache.stats()['hits'] == 3
+
+def test_incremental_ladder_matches_per_stage_retrieval(tmp_path):
+    index_dir = _index(tmp_path)
+    now = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    seen = set()
+    for stages in ([10, 20, 40], [30, 60, 100]):
+        inc = TWERAGPipeline(PipelineConfig(index_dir=index_dir, K_stages=stages, incremental=True))
+        per_stage = TWERAGPipeline(PipelineConfig(index_dir=index_dir, K_stages=stages, incremental=False))
+        for q in QUERIES:
+            a, b = inc.run(q, now=now), per_stage.run(q, now=now)
+            assert a == b
+            seen.add((a['meta']['K'], a['meta']['halted']))
+    assert len(seen) > 1  # both halted and later or full-ladder answers are covered
+
+def test_batches_match_single_queries(tmp_path):
+    from twe_rag.retrieval import HybridRetriever
+    index_dir = _index(tmp_path)
+    now = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    pipe = TWERAGPipeline(PipelineConfig(index_dir=index_dir, K_stages=[10, 20, 40]))
+    assert pipe.run_batch(QUERIES, now=now) == [pipe.run(q, now=now) for q in QUERIES]
+    per_stage = TWERAGPipeline(PipelineConfig(index_dir=index_dir, K_stages=[10, 20, 40], incremental=False))
+    per_stage.ret.retrieve_batch = None  # every stage retrieves on its own, as in run
+    assert per_stage.run_batch(QUERIES, now=now) == [per_stage.run(q, now=now) for q in QUERIES]
+    ret = HybridRetriever(Path(index_dir))
+    for K in (1, 10, 150):
+        assert ret.retrieve_batch(QUERIES, K=K) == [ret.retrieve(q, K=K) for q in QUERIES]
+
+def test_stage_predictor_skips_stages_without_changing_late_queries(tmp_path):
+    from twe_rag.budget import StagePredictor
+    words = 'ExampleCorp CloudSync DataVault revenue quarterly CEO release partnership security stock'.split()
+    rng = np.random.default_rng(3)
+    docs = [{'id': f'd{i}', 'timestamp': f'20{14 + i % 10}-01-01', 'text': ' '.join(rng.choice(words, 12))}
+            for i in range(150)]
+    (tmp_path/'c.jsonl').write_text(''.join(json.dumps(d) + '\n' for d in docs), encoding='utf-8')
+    build_indices(tmp_path/'c.jsonl', tmp_path/'index', svd_dim=4)
+    cfg = dict(index_dir=str(tmp_path/'index'), K_stages=[10, 20, 40], trace=True)
+    queries = ['ExampleCorp CEO', 'current quarterly revenue', 'security release', 'DataVault stock partnership']
+    assert 'features' not in TWERAGPipeline(PipelineConfig(**cfg)).run(queries[0])['meta']
+    ladder = TWERAGPipeline(PipelineConfig(log_stage_features=True, **cfg)).run_batch(queries)
+    with pytest.raises(FileNotFoundError, match='08_train_stage_predictor'):
+        TWERAGPipeline(PipelineConfig(stage_predictor=True, **cfg))
+    # trained on a log where every query runs the whole ladder: always start at K=40
+    log = [o['meta'] for o in ladder]
+    StagePredictor.fit([10, 20, 40], [m['features'] for m in log], [40] * len(log)).save(
+        tmp_path/'index'/'stage_predictor.json')
+    with pytest.raises(ValueError, match='retrain'):
+        TWERAGPipeline(PipelineConfig(stage_predictor=True, **{**cfg, 'K_stages': [10, 40]}))
+    jumped = TWERAGPipeline(PipelineConfig(stage_predictor=True, **cfg)).run_batch(queries)
+    for a, b in zip(ladder, jumped):
+        assert b['meta']['trace']['counters']['stages_skipped'] == 2
+        assert b['meta']['trace']['counters']['candidates_processed'] == 40
+        if a['meta']['K'] == 40:
+            assert [r['id'] for r in a['results']] == [r['id'] for r in b['results']]
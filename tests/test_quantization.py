@@ -0,0 +1,34 @@
+import json
+import numpy as np
+from twe_rag.indexing import build_indices
+from twe_rag.quantization import Int8Embeddings, PQEmbeddings, save_quantized, load_quantized
+from twe_rag.retrieval import HybridRetriever
+
+def _unit(n, d, seed=0):
+    dv = np.random.default_rng(seed).normal(size=(n, d)).astype(np.float32)
+    return dv / np.linalg.norm(dv, axis=1, keepdims=True)
+
+def test_int8_and_pq_scores_approximate_dot_products(tmp_path):
+    dv = _unit(500, 16)
+    qv = dv[3]
+    q8 = Int8Embeddings.build(dv)
+    assert q8.codes.dtype == np.int8 and np.abs(q8.scores(qv) - dv @ qv).max() < 0.02
+    pq = PQEmbeddings.build(dv, m=4)
+    assert pq.codes.shape == (4, 500) and np.corrcoef(pq.scores(qv), dv @ qv)[0, 1] > 0.8
+    save_quantized(pq, tmp_path/'quant')
+    assert np.array_equal(load_quantized(tmp_path/'quant').scores(qv), pq.scores(qv))
+
+def test_quantized_retrieval_rescores_exactly(tmp_path):
+    words = 'ExampleCorp CloudSync DataVault revenue quarterly CEO release partnership security stock'.split()
+    rng = np.random.default_rng(1)
+    docs = [{'id': f'd{i}', 'timestamp': '2024-01-01', 'text': ' '.join(rng.choice(words, 10))} for i in range(60)]
+    (tmp_path/'c.jsonl').write_text(''.join(json.dumps(d) + '\n' for d in docs), encoding='utf-8')
+    build_indices(tmp_path/'c.jsonl', tmp_path/'index', svd_dim=4, quantize='int8')
+    exact = HybridRetriever(tmp_path/'index')
+    # candidates covering the corpus get exact dense scores: same ranking as brute force
+    q8 = HybridRetriever(tmp_path/'index', dense_mode='int8', rescore=6)
+    for q in ['ExampleCorp CEO', 'quarterly revenue release']:
+        want = exact.retrieve(q, K=10)
+        got = q8.retrieve(q, K=10)
+        assert [c['idx'] for c in got] == [c['idx'] for c in want]
+        assert np.allclose([c['combo'] for c in got], [c['combo'] for c in want], atol=1e-6)
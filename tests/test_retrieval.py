@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from twe_rag.retrieval import BM25Index
+from twe_rag.text_utils import tokenize
+
+TEXTS = [
+    "ExampleCorp appoints Alice Newton as CEO",
+    "ExampleCorp names Bob Ortega CEO replacing Alice Newton",
+    "ExampleCorp names Cara Singh as the new CEO of ExampleCorp",
+    "CloudSync version 2.1 released by ExampleCorp",
+    "quarterly revenue up 12 percent",
+]
+
+def test_bm25_matches_rank_bm25(tmp_path):
+    rank_bm25 = pytest.importorskip('rank_bm25')
+    tokenized = [tokenize(t) for t in TEXTS]
+    ref = rank_bm25.BM25Okapi(tokenized)
+    idx = BM25Index.from_tokenized(tokenized)
+    idx.save(tmp_path/'bm25')
+    loaded = BM25Index.load(tmp_path/'bm25')
+    # repeated terms, negative-idf terms ("examplecorp") and OOV terms
+    for q in ['current CEO of ExampleCorp', 'ceo ceo newton', 'revenue', 'unknownword', '']:
+        q_tok = tokenize(q)
+        assert np.array_equal(idx.get_scores(q_tok), ref.get_scores(q_tok))
+        assert np.array_equal(loaded.get_scores(q_tok), ref.get_scores(q_tok))
+
+def test_top_k_ties_are_prefix_stable():
+    from twe_rag.retrieval import top_k
+    scores = np.array([0.5, 1.0, 0.5, 0.0, 0.5, 1.0, 0.5])
+    assert top_k(scores, 4).tolist() == [1, 5, 0, 2]
+    for k in range(1, 8):
+        assert top_k(scores, k).tolist() == top_k(scores, 7)[:k].tolist()
+    assert len(top_k(scores, 100)) == 7
+
+def test_top_k_rows_matches_top_k():
+    from twe_rag.retrieval import top_k, top_k_rows
+    rng = np.random.default_rng(0)
+    scores = rng.integers(0, 4, size=(6, 50)).astype(float)  # many ties
+    for k in (1, 7, 50, 80):
+        rows = top_k_rows(scores, k)
+        for r in range(len(scores)):
+            assert rows[r].tolist() == top_k(scores[r], k).tolist()
+
+def test_bm25_shard_scores_equal_corpus_slice():
+    corpus = [tokenize(t) for t in [
+        'the quick brown fox', 'jumps over the lazy dog', 'the fox and the dog',
+        'quick quick fox', 'lazy afternoon', 'brown dog barks', 'a b c', 'fox']]
+    bm25 = BM25Index.from_tokenized(corpus)
+    for lo, hi in [(0, 3), (3, 6), (6, 8)]:
+        shard = bm25.shard(lo, hi)
+        for q in (['the', 'fox'], ['lazy', 'dog', 'missing'], ['quick']):
+            assert np.array_equal(shard.get_scores(q), bm25.get_scores(q)[lo:hi])
+            assert np.array_equal(bm25.get_scores(q, lo, hi), bm25.get_scores(q)[lo:hi])
+
+def test_time_partitions_window_and_pruning(tmp_path):
+    import json
+    from datetime import datetime, timezone
+    from twe_rag.indexing import build_indices
+    from twe_rag.retrieval import HybridRetriever, top_k
+    from twe_rag.time_decay import TimeDecay
+    months = ['2023-11', '2024-03', '2022-06', '2024-01', 'not a date']
+    docs = [{'id': f'd{i}', 'timestamp': f'{months[i % 5]}-{1 + i % 27:02d}', 'text': TEXTS[i % 5] + f' item{i}'}
+            for i in range(40)]
+    (tmp_path/'c.jsonl').write_text(''.join(json.dumps(d) + '\n' for d in docs), encoding='utf-8')
+    build_indices(tmp_path/'c.jsonl', tmp_path/'index', svd_dim=4, allow_bad_timestamps=True, time_partition='month')
+    ret = HybridRetriever(tmp_path/'index')
+    assert [p['key'] for p in ret.partitions] == ['2022-06', '2023-11', '2024-01', '2024-03', 'unknown']
+
+    lo, hi = ret.time_window(datetime(2024, 1, 1), datetime(2024, 3, 1))
+    assert {ret.times[i][:7] for i in range(lo, hi)} == {'2024-01'}
+    got = ret.retrieve('ExampleCorp CEO', K=5, since=datetime(2024, 1, 1), until=datetime(2024, 3, 1))
+    assert got and all(lo <= c['idx'] < hi for c in got)
+
+    # without pruning the ranking is that of the full corpus plus decay
+    now, td = datetime(2024, 4, 1, tzinfo=timezone.utc), TimeDecay()
+    decay = lambda ep: td.decay_batch(ep, now, 90.0)
+    full = ret.retrieve('ExampleCorp CEO', K=40)
+    final = np.zeros(40)
+    for c in full:
+        final[c['idx']] = c['combo'] + 2.5 * decay(ret.epochs[[c['idx']]])[0]
+    recent = ret.retrieve_recent('ExampleCorp CEO', decay, K=40, delta=2.5)
+    assert [c['idx'] for c in recent] == top_k(final, 40).tolist()
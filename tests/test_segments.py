@@ -0,0 +1,65 @@
+import json
+import random
+import numpy as np
+import pytest
+from twe_rag.index_format import index_versions, read_manifest, recover_index
+from twe_rag.indexing import build_indices
+from twe_rag.retrieval import HybridRetriever, BM25Index
+from twe_rag.segments import ingest_documents, delete_documents, drift_report, compact_index
+from twe_rag.text_utils import tokenize
+
+WORDS = 'ExampleCorp CloudSync DataVault revenue quarterly CEO release partnership security stock price'.split()
+
+def _docs(lo, hi, seed=0):
+    rng = random.Random(seed)
+    return [{'id': f'doc_{i:03d}', 'timestamp': f'2024-01-{1 + i % 28:02d}',
+             'text': ' '.join(rng.choice(WORDS) for _ in range(12))} for i in range(lo, hi)]
+
+def _write(path, docs):
+    path.write_text(''.join(json.dumps(d) + '\n' for d in docs), encoding='utf-8')
+    return path
+
+def test_ingest_delete_and_compact(tmp_path):
+    index = tmp_path/'index'
+    build_indices(_write(tmp_path/'base.jsonl', _docs(0, 40)), index, svd_dim=4)
+    update = dict(_docs(3, 4)[0], text='DataVault security release')
+    ingest_documents(_write(tmp_path/'new.jsonl', _docs(40, 55, seed=1) + [update]), index)
+    assert delete_documents(['doc_010', 'doc_045', 'missing'], index) == 2
+
+    live = [d for d in _docs(0, 40) + _docs(40, 55, seed=1) if d['id'] not in ('doc_003', 'doc_010', 'doc_045')]
+    live.append(update)
+    ret = HybridRetriever(index)
+    assert ret.ids == [d['id'] for d in live]
+    ref = BM25Index.from_tokenized([tokenize(d['text']) for d in live])
+    for q in (['datavault', 'security'], ['ceo', 'revenue', 'unknown']):
+        assert np.allclose(ret.bm25.get_scores(q), ref.get_scores(q), rtol=1e-12, atol=0)
+    assert len(ret.dv) == len(live)
+
+    report = drift_report(index)
+    assert report['delta_docs'] == 16 and report['deleted_docs'] == 3 and report['refit_recommended']
+
+    assert compact_index(index) == len(live)
+    ret = HybridRetriever(index)
+    assert ret.ids == [d['id'] for d in live] and ret.live_rows is None
+    assert index.is_symlink() and [p.name for p in index_versions(index)] == ['index.v2']
+
+    # a crash between the renames of a first publish leaves no index/ link: opening reports it,
+    # recovery (explicit, or the next compaction) re-links the newest version
+    index.unlink()
+    with pytest.raises(FileNotFoundError, match='--recover'):
+        HybridRetriever(index)
+    assert not index.exists() and not index.is_symlink()
+    assert recover_index(index) and read_manifest(index)['n_docs'] == len(live)
+    index.unlink()
+    assert compact_index(index) == len(live)
+    assert [p.name for p in index_versions(index)] == ['index.v3'] and HybridRetriever(index).ids == ret.ids
+
+def test_compact_keeps_timestamp_check(tmp_path):
+    index = tmp_path/'index'
+    docs = _docs(0, 20)
+    docs[5]['timestamp'] = 'not a date'
+    build_indices(_write(tmp_path/'base.jsonl', docs), index, svd_dim=4, allow_bad_timestamps=True)
+    with pytest.raises(ValueError, match='unparseable timestamp'):
+        compact_index(index)
+    assert not index.is_symlink() and read_manifest(index)['n_docs'] == 20
+    assert compact_index(index, allow_bad_timestamps=True) == 20
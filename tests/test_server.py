@@ -0,0 +1,76 @@
+import asyncio
+from twe_rag.server import MAX_BODY_BYTES, QueryService, QueryServer
+
+class _EchoPipeline:
+    cache = None
+
+    def __init__(self):
+        self.batches = []
+
+    def run_batch(self, queries, now=None, since=None, until=None):
+        self.batches.append(list(queries))
+        return [{'query': q, 'meta': {}, 'results': []} for q in queries]
+
+def test_requests_are_coalesced_and_bounded():
+    pipe = _EchoPipeline()
+
+    async def go():
+        service = QueryService(pipe, batch_window_ms=20, max_inflight=4)
+        await service.start()
+        server = QueryServer(service)
+        calls = [server.handle('POST', '/query', f'{{"query": "q{i}"}}'.encode()) for i in range(6)]
+        out = await asyncio.gather(*calls)
+        bad = await server.handle('POST', '/query', b'{}')
+        await service.stop()
+        return out, bad
+
+    out, bad = asyncio.run(go())
+    assert [s for s, _, _ in out] == [200] * 4 + [503] * 2
+    assert pipe.batches == [['q0', 'q1', 'q2', 'q3']]
+    assert bad[0] == 400
+
+def test_oversized_body_is_rejected():
+    async def go():
+        service = QueryService(_EchoPipeline())
+        await service.start()
+        server = await asyncio.start_server(QueryServer(service)._connection, '127.0.0.1', 0)
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        writer.write(f'POST /query HTTP/1.1\r\nContent-Length: {MAX_BODY_BYTES + 1}\r\n\r\n'.encode())
+        await writer.drain()
+        reply = await reader.read()
+        writer.close()
+        server.close()
+        await service.stop()
+        return reply
+
+    assert asyncio.run(go()).startswith(b'HTTP/1.1 413 Payload Too Large')
+
+def test_concurrent_batches_match_serial_run(tmp_path):
+    import json
+    from datetime import datetime, timezone
+    import numpy as np
+    from twe_rag.indexing import build_indices
+    from twe_rag.pipeline import TWERAGPipeline, PipelineConfig
+
+    words = 'ExampleCorp CloudSync DataVault revenue quarterly CEO release partnership security stock'.split()
+    rng = np.random.default_rng(7)
+    docs = [{'id': f'd{i}', 'timestamp': f'20{14 + i % 10}-0{1 + i % 9}-01', 'text': ' '.join(rng.choice(words, 12))}
+            for i in range(3000)]
+    (tmp_path/'c.jsonl').write_text(''.join(json.dumps(d) + '\n' for d in docs), encoding='utf-8')
+    build_indices(tmp_path/'c.jsonl', tmp_path/'index', svd_dim=8, ann=True, ann_lists=16)
+    queries = [' '.join(rng.choice(words, 3)) for _ in range(48)]
+    now = datetime(2024, 6, 1, tzinfo=timezone.utc)
+
+    for mode in ('exact', 'maxscore'):
+        pipe = TWERAGPipeline(PipelineConfig(index_dir=str(tmp_path/'index'), dense_mode=mode, K_stages=[10, 20]))
+        serial = pipe.run_batch(queries, now=now)
+
+        async def go():
+            service = QueryService(pipe, max_batch=4, batch_window_ms=0, workers=4)
+            await service.start()
+            out = await asyncio.gather(*(service.submit(q, now) for q in queries))
+            await service.stop()
+            return out, service.counts['batches']
+
+        out, batches = asyncio.run(go())
+        assert batches > 1 and out == serial, mode
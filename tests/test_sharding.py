@@ -0,0 +1,39 @@
+import json
+from datetime import datetime, timezone
+import numpy as np
+from twe_rag.indexing import build_indices
+from twe_rag.pipeline import TWERAGPipeline, PipelineConfig
+from twe_rag.retrieval import HybridRetriever
+from twe_rag.sharding import ShardedRetriever
+
+QUERIES = ['current CEO of ExampleCorp', 'quarterly revenue release', 'CloudSync security partnership',
+           'DataVault stock', 'unknownword']
+
+def test_sharded_matches_unsharded(tmp_path):
+    words = 'ExampleCorp CloudSync DataVault revenue quarterly CEO release partnership security stock'.split()
+    rng = np.random.default_rng(3)
+    docs = [{'id': f'd{i}', 'timestamp': f'20{14 + i % 10}-0{1 + i % 9}-01', 'text': ' '.join(rng.choice(words, 12))}
+            for i in range(200)]
+    (tmp_path/'c.jsonl').write_text(''.join(json.dumps(d) + '\n' for d in docs), encoding='utf-8')
+    index = tmp_path/'index'
+    build_indices(tmp_path/'c.jsonl', index, svd_dim=4, shards=3)
+
+    ret, sharded = HybridRetriever(index), ShardedRetriever(index)
+    try:
+        for q in QUERIES:
+            assert sharded.retrieve(q, K=20) == ret.retrieve(q, K=20), q
+        # batches score with one GEMM per shard instead of one over all rows: same ranking, scores up to rounding
+        for a, b in zip(sharded.retrieve_batch(QUERIES, K=20), ret.retrieve_batch(QUERIES, K=20)):
+            assert [r['idx'] for r in a] == [r['idx'] for r in b]
+            assert np.allclose([r['combo'] for r in a], [r['combo'] for r in b], rtol=0, atol=1e-6)
+    finally:
+        sharded.close()
+
+    now = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    cfg = dict(index_dir=str(index), K_stages=[10, 20, 40])
+    pipe, sharded_pipe = TWERAGPipeline(PipelineConfig(**cfg)), TWERAGPipeline(PipelineConfig(sharded=True, **cfg))
+    try:
+        for q in QUERIES:
+            assert sharded_pipe.run(q, now=now) == pipe.run(q, now=now), q
+    finally:
+        sharded_pipe.ret.close()
@@ -0,0 +1,46 @@
+import json
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from twe_rag.indexing import build_indices
+from twe_rag.retrieval import HybridRetriever
+from twe_rag.index_format import TfidfModel
+from twe_rag.streaming import build_indices_streaming
+
+def test_tfidf_from_counts_matches_fit():
+    rng = np.random.default_rng(0)
+    words = [f'w{i}' for i in range(40)]
+    docs = [' '.join(rng.choice(words, 12, p=np.arange(40, 0, -1) / 820)) for _ in range(30)]
+    want = TfidfVectorizer(max_features=15).fit(docs)
+    X = TfidfVectorizer().fit(docs)
+    analyze = X.build_analyzer()
+    terms = sorted(X.vocabulary_)
+    tf = np.zeros(len(terms), dtype=np.int64)
+    df = np.zeros(len(terms), dtype=np.int64)
+    for d in docs:
+        toks = analyze(d)
+        for t in set(toks):
+            df[terms.index(t)] += 1
+        for t in toks:
+            tf[terms.index(t)] += 1
+    got = TfidfModel.from_counts(terms, tf, df, len(docs), max_features=15)
+    assert got.terms.tolist() == sorted(want.vocabulary_) and np.array_equal(got.idf, want.idf_)
+    assert (got.transform(docs) != want.transform(docs)).nnz == 0
+
+def test_streaming_build_matches_in_memory(tmp_path):
+    words = 'ExampleCorp CloudSync DataVault revenue quarterly CEO release partnership security stock'.split()
+    rng = np.random.default_rng(1)
+    docs = [{'id': f'd{i}', 'timestamp': f'2024-01-{1 + i % 28:02d}', 'text': ' '.join(rng.choice(words, 10))}
+            for i in range(60)]
+    (tmp_path/'c.jsonl').write_text(''.join(json.dumps(d) + '\n' for d in docs), encoding='utf-8')
+    build_indices(tmp_path/'c.jsonl', tmp_path/'mem', svd_dim=4)
+    # ~1 KB chunks: several chunks per pass
+    build_indices_streaming(tmp_path/'c.jsonl', tmp_path/'stream', svd_dim=4, memory_mb=0.015, progress=False)
+    for f in ['terms', 'indptr', 'doc_ids', 'tfs', 'doc_len', 'idf', 'norm']:
+        assert np.array_equal(np.load(tmp_path/'mem'/'bm25'/f'{f}.npy'), np.load(tmp_path/'stream'/'bm25'/f'{f}.npy'))
+    for f in ['terms', 'idf']:
+        assert np.array_equal(np.load(tmp_path/'mem'/'tfidf'/f'{f}.npy'), np.load(tmp_path/'stream'/'tfidf'/f'{f}.npy'))
+    a, b = np.load(tmp_path/'mem'/'tfidf_svd.npy'), np.load(tmp_path/'stream'/'tfidf_svd.npy')
+    assert np.abs((a * b).sum(axis=1)).min() > 0.999
+    r = HybridRetriever(tmp_path/'stream')
+    assert r.ids == [d['id'] for d in docs]
+    assert r.retrieve('ExampleCorp CEO', K=5)
@@ -8,3 +8,16 @@ def test_decay_monotonic():
     older = (now - timedelta(days=365)).isoformat()
     p = td.params_for_query('latest news')
     assert td.decay_value(newer, now, p.tau_days) > td.decay_value(older, now, p.tau_days)
+
+def test_decay_batch_matches_decay_value():
+    import numpy as np
+    from twe_rag.time_decay import parse_epochs
+    td = TimeDecay()
+    now = datetime(2025, 1, 1, 12, tzinfo=timezone.utc)
+    stamps = ['2024-12-01', '2019-01-15T08:30:00+02:00', 'not a date', '2022-06-01T00:00:00']
+    epochs, bad = parse_epochs(stamps)
+    assert bad == [2]
+    out = td.decay_batch(epochs, now, 90.0, idx=np.array([3, 0, 1, 2]))
+    ref = [td.decay_value(stamps[i], now, 90.0) for i in (3, 0, 1)]
+    assert np.allclose(out[:3], ref, rtol=1e-12, atol=0)
+    assert out[3] == 0.0
@@ -0,0 +1,27 @@
+from twe_rag.tracing import Trace, NULL_TRACE, HistogramSink
+
+def test_trace_and_histogram_sink():
+    t = Trace()
+    with t.stage('bm25'):
+        pass
+    t.add_time('graph', 0.003)
+    t.incr('stages_executed')
+    t.incr('stages_executed')
+    d = t.as_dict()
+    assert d['counters'] == {'stages_executed': 2}
+    assert abs(d['timings_ms']['graph'] - 3.0) < 1e-9
+
+    with NULL_TRACE.stage('bm25'):
+        NULL_TRACE.incr('stages_executed')
+
+    sink = HistogramSink()
+    for _ in range(3):
+        sink(d)
+    snap = sink.snapshot()
+    assert snap['queries'] == 3 and snap['counters']['stages_executed'] == 6
+    assert snap['stages']['graph']['count'] == 3
+    assert sink.percentile('graph', 50) == 0.005
+    text = sink.prometheus_text()
+    assert 'twe_rag_stage_seconds_bucket{stage="graph",le="0.0025"} 0' in text
+    assert 'twe_rag_stage_seconds_bucket{stage="graph",le="+Inf"} 3' in text
+    assert 'twe_rag_stages_executed_total 6' in text
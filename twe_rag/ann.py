@@ -0,0 +1,143 @@
+# twe_rag/ann.py
+"""
+Approximate dense search: an inverted-file (IVF) index over the unit-normalized
+TF-IDF+SVD embeddings.
+
+A spherical k-means coarse quantizer splits the rows into `n_lists` lists; a
+query scores only the rows of the `nprobe` lists whose centroids are closest
+to it. Scores of the probed rows are exact cosines against the retriever's
+embedding matrix, so only recall is approximate.
+
+Each list also stores its angular radius (largest angle between a row and the
+centroid), which bounds the score of every row in it from above; see
+`HybridRetriever` dense_mode='maxscore'.
+"""
+import json
+import math
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+
+def default_lists(n_docs: int) -> int:
+    return max(1, min(n_docs, int(round(4 * math.sqrt(n_docs)))))
+
+def _assign(X: np.ndarray, C: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    """Nearest (highest cosine) centroid of every row."""
+    out = np.empty(len(X), dtype=np.int64)
+    for s in range(0, len(X), chunk):
+        out[s:s+chunk] = np.argmax(X[s:s+chunk] @ C.T, axis=1)
+    return out
+
+def spherical_kmeans(X: np.ndarray, k: int, n_iter: int = 20, seed: int = 42) -> np.ndarray:
+    """(k, d) unit-norm centroids by Lloyd iterations on cosine similarity; deterministic for a seed."""
+    rng = np.random.default_rng(seed)
+    C = X[np.sort(rng.choice(len(X), size=k, replace=False))].astype(np.float32)
+    for _ in range(n_iter):
+        assign = _assign(X, C)
+        order = np.argsort(assign, kind='stable')
+        counts = np.bincount(assign, minlength=k)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        full = np.flatnonzero(counts)
+        sums = np.zeros_like(C)
+        sums[full] = np.add.reduceat(X[order].astype(np.float32), starts[full], axis=0)
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            # restart empty lists from random rows
+            sums[empty] = X[rng.choice(len(X), size=len(empty), replace=False)]
+        C = sums / (np.linalg.norm(sums, axis=1, keepdims=True) + 1e-9)
+    return C
+
+def _radius(X: np.ndarray, C: np.ndarray, assign: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    """Largest angle (radians) between a row and its centroid, per list; 0 for empty lists."""
+    lowest = np.ones(len(C))
+    for s in range(0, len(X), chunk):
+        a = assign[s:s+chunk]
+        np.minimum.at(lowest, a, np.einsum('ij,ij->i', X[s:s+chunk].astype(np.float64), C[a].astype(np.float64)))
+    return np.arccos(np.clip(lowest, -1.0, 1.0))
+
+class IVFIndex:
+    """List l holds rows[ptr[l]:ptr[l+1]] (ascending) assigned to centroids[l].
+
+    radius[l] is the largest angle between a row of list l and its centroid
+    (None for indices built without it).
+    """
+
+    def __init__(self, centroids: np.ndarray, ptr: np.ndarray, rows: np.ndarray, radius: np.ndarray = None):
+        self.centroids = centroids
+        self.ptr = ptr
+        self.rows = rows
+        self.radius = radius
+        self.n_lists = len(centroids)
+        self.n_docs = len(rows)
+
+    @classmethod
+    def build(cls, dv: np.ndarray, n_lists: int = None, n_iter: int = 10, max_train: int = 64,
+              seed: int = 42) -> 'IVFIndex':
+        """Train on at most `max_train` rows per list, then assign every row."""
+        n_lists = default_lists(len(dv)) if n_lists is None else n_lists
+        if not 1 <= n_lists <= len(dv):
+            raise ValueError(f"Need 1 <= ann lists <= {len(dv)} documents, got {n_lists}")
+        rng = np.random.default_rng(seed)
+        train = dv
+        if len(dv) > max_train * n_lists:
+            train = dv[np.sort(rng.choice(len(dv), size=max_train * n_lists, replace=False))]
+        C = spherical_kmeans(np.asarray(train, dtype=np.float32), n_lists, n_iter=n_iter, seed=seed)
+        X = np.asarray(dv, dtype=np.float32)
+        assign = _assign(X, C)
+        rows = np.argsort(assign, kind='stable')
+        ptr = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=n_lists), out=ptr[1:])
+        return cls(C, ptr, rows, _radius(X, C, assign))
+
+    def probe(self, qv: np.ndarray, nprobe: int, farthest: bool = False) -> np.ndarray:
+        """Rows of the `nprobe` lists nearest to `qv` (or farthest from it), in list order."""
+        sims = self.centroids @ qv.astype(np.float32)
+        if not farthest:
+            sims = -sims
+        nprobe = min(nprobe, self.n_lists)
+        lists = np.argpartition(sims, nprobe - 1)[:nprobe] if nprobe < self.n_lists else np.arange(self.n_lists)
+        return np.concatenate([self.rows[self.ptr[l]:self.ptr[l + 1]] for l in np.sort(lists)])
+
+    def search(self, dv: np.ndarray, qv: np.ndarray, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, exact dense scores) of every row in the probed lists, rows ascending."""
+        rows = np.sort(self.probe(qv, nprobe))
+        return rows, dv[rows] @ qv
+
+    def min_score(self, dv: np.ndarray, qv: np.ndarray, nprobe: int) -> float:
+        """Estimate of the lowest dense score in the corpus, from the `nprobe` farthest lists."""
+        rows = self.probe(qv, nprobe, farthest=True)
+        return float((dv[rows] @ qv).min())
+
+    def upper_bounds(self, qv: np.ndarray) -> np.ndarray:
+        """(n_lists,) bound on qv . x over the unit rows x of each list.
+
+        A row is within radius[l] of centroid l, so its angle to `qv` is at
+        least angle(qv, centroid) - radius[l]. The slack (1e-3 rad, 1e-5)
+        covers float32 rounding of the embeddings, centroids and scores, which
+        arccos amplifies near zero angles.
+        """
+        cos = self.centroids.astype(np.float64) @ qv.astype(np.float64)
+        norm = float(np.linalg.norm(qv))
+        theta = np.arccos(np.clip(cos / norm, -1.0, 1.0)) if norm > 0 else np.full(self.n_lists, np.pi / 2)
+        return norm * np.cos(np.maximum(theta - self.radius - 1e-3, 0.0)) + 1e-5
+
+    def list_rows(self, lists: np.ndarray) -> np.ndarray:
+        """Rows of these lists, ascending."""
+        if not len(lists):
+            return np.zeros(0, dtype=self.rows.dtype)
+        return np.sort(np.concatenate([self.rows[self.ptr[l]:self.ptr[l + 1]] for l in lists]))
+
+    def save(self, path: Path):
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path/'centroids.npy', self.centroids)
+        np.save(path/'ptr.npy', self.ptr)
+        np.save(path/'rows.npy', self.rows)
+        np.save(path/'radius.npy', self.radius)
+        (path/'params.json').write_text(json.dumps({'n_lists': self.n_lists, 'n_docs': self.n_docs}),
+                                        encoding='utf-8')
+
+    @classmethod
+    def load(cls, path: Path) -> 'IVFIndex':
+        radius = np.load(path/'radius.npy') if (path/'radius.npy').exists() else None
+        return cls(np.load(path/'centroids.npy'), np.load(path/'ptr.npy'), np.load(path/'rows.npy'), radius)
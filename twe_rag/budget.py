@@ -1,8 +1,11 @@
 # twe_rag/budget.py
+import json
 from dataclasses import dataclass
-from typing import List
+from pathlib import Path
+from typing import Dict, List
 import numpy as np
-from twe_rag.text_utils import tokenize, shingles
+from twe_rag.graph import hash_jaccard
+from twe_rag.text_utils import tokenize, shingle_hashes
 
 @dataclass
 class HaltDecision:
@@ -16,27 +19,114 @@ class BudgetHalting:
         self.agree_k = agree_k
 
     def agreement(self, texts: List[str]) -> float:
-        k = min(self.agree_k, len(texts))
+        return self.shingle_agreement([shingle_hashes(tokenize(t), n=3) for t in texts[:self.agree_k]])
+
+    def shingle_agreement(self, hashes: List[np.ndarray]) -> float:
+        """Mean pairwise 3-gram Jaccard of the top `agree_k` documents, from their sorted shingle hashes."""
+        k = min(self.agree_k, len(hashes))
         if k < 2:
             return 0.0
-        sets = [shingles(tokenize(t), n=3) for t in texts[:k]]
-        sims = []
-        for i in range(k):
-            for j in range(i+1, k):
-                a, b = sets[i], sets[j]
-                if not a or not b:
-                    sims.append(0.0); continue
-                inter = len(a & b)
-                union = len(a | b) + 1e-9
-                sims.append(inter/union)
-        return float(np.mean(sims)) if sims else 0.0
-
-    def decide(self, top_scores: List[float], top_texts: List[str]) -> HaltDecision:
+        return float(np.mean([hash_jaccard(hashes[i], hashes[j]) for i in range(k) for j in range(i + 1, k)]))
+
+    def decide(self, top_scores: List[float], top_texts: List[str] = None,
+               top_shingles: List[np.ndarray] = None) -> HaltDecision:
+        """Halt on a clear score margin and enough agreement among the top documents.
+
+        Agreement is computed from `top_shingles` (stored hashes) when given, else from `top_texts`.
+        """
         if len(top_scores) < 2:
             return HaltDecision(halt=True, reason='single candidate')
         s = (np.array(top_scores) - min(top_scores)) / (max(top_scores) - min(top_scores) + 1e-9)
         margin = float(s[0] - s[1])
-        agree = self.agreement(top_texts)
+        agree = self.shingle_agreement(top_shingles) if top_shingles is not None else self.agreement(top_texts)
         if margin >= self.margin_thresh and agree >= self.agree_thresh:
             return HaltDecision(halt=True, reason=f'margin={margin:.3f}, agree={agree:.3f}')
         return HaltDecision(halt=False, reason=f'margin={margin:.3f}, agree={agree:.3f}')
+
+def stage_features(combo: np.ndarray, bm25: np.ndarray, dense: np.ndarray, decay: np.ndarray, delta: float,
+                   K_stages: List[int], query_len: int, idf_mass: float, recency_need: float) -> Dict[str, float]:
+    """Signals known before the graph stage, from the max-K candidates in retrieval order.
+
+    margin@K is the halting margin of the top 5 by combo + delta * decay among
+    the first K candidates, i.e. `decide`'s margin without centrality.
+    """
+    def gap(s, k):
+        return float(s[0] - s[min(k, len(s)) - 1]) if len(s) else 0.0
+    f = {'gap_top2': gap(combo, 2), 'gap_top5': gap(combo, 5), 'bm25_gap': gap(bm25, 5),
+         'dense_gap': gap(dense, 5), 'query_len': float(query_len), 'idf_mass': float(idf_mass),
+         'recency_need': float(recency_need)}
+    S = combo + delta * decay
+    for K in K_stages:
+        top = -np.sort(-S[:K])[:5]
+        f[f'margin@{K}'] = float((top[0] - top[1]) / (top[0] - top[-1] + 1e-9)) if len(top) > 1 else 1.0
+    return f
+
+class StagePredictor:
+    """Ladder stage a query is expected to end at, from `stage_features`.
+
+    Tree j (a decision stump by default, deeper trees on request) estimates the chance
+    that the ladder runs past stage j; `start` skips every stage whose tree,
+    and those of all earlier stages, reach `threshold`. Skipped stages cost
+    nothing, so a start at or before the stage the ladder would end at gives
+    the same ranking; only a start beyond it changes the results.
+    """
+
+    def __init__(self, K_stages: List[int], features: List[str], trees: List[Dict], threshold: float = 0.9):
+        self.K_stages = list(K_stages)
+        self.features = list(features)
+        self.trees = [{k: np.asarray(v) for k, v in t.items()} for t in trees]
+        self.threshold = threshold
+
+    @classmethod
+    def fit(cls, K_stages: List[int], features: List[Dict[str, float]], end_K: List[int], threshold: float = 0.9,
+            max_depth: int = 1, min_samples_leaf: int = 50) -> 'StagePredictor':
+        """Fit from logged decisions: each query's `stage_features` and the stage K it ended at."""
+        from sklearn.tree import DecisionTreeClassifier
+        names = list(features[0]) if features else []
+        X = np.array([[f[n] for n in names] for f in features], dtype=np.float64).reshape(len(features), len(names))
+        end = np.array([K_stages.index(K) for K in end_K])
+        trees = []
+        for j in range(len(K_stages) - 1):
+            y = end > j
+            if y.all() or not y.any():
+                trees.append({'feature': [-1], 'threshold': [0.0], 'left': [-1], 'right': [-1],
+                              'prob': [float(y.mean()) if len(y) else 0.0]})
+                continue
+            t = DecisionTreeClassifier(max_depth=max_depth, min_samples_leaf=min_samples_leaf,
+                                       random_state=0).fit(X, y).tree_
+            value = t.value[:, 0, :]
+            trees.append({'feature': t.feature.tolist(), 'threshold': t.threshold.tolist(),
+                          'left': t.children_left.tolist(), 'right': t.children_right.tolist(),
+                          'prob': (value[:, 1] / value.sum(axis=1)).tolist()})
+        return cls(K_stages, names, trees, threshold)
+
+    def proba(self, features: Dict[str, float]) -> np.ndarray:
+        """(len(K_stages) - 1,) chance of running past each stage but the last."""
+        # the trees split float32 features, as scikit-learn fits them
+        x = np.array([features[n] for n in self.features], dtype=np.float32)
+        out = []
+        for t in self.trees:
+            node = 0
+            while t['left'][node] != -1:
+                node = t['left'][node] if x[t['feature'][node]] <= t['threshold'][node] else t['right'][node]
+            out.append(float(t['prob'][node]))
+        return np.array(out)
+
+    def start(self, features: Dict[str, float]) -> int:
+        """Index into K_stages of the first stage to run."""
+        j = 0
+        for p in self.proba(features):
+            if p < self.threshold:
+                break
+            j += 1
+        return j
+
+    def save(self, path: Path):
+        path.write_text(json.dumps({'K_stages': self.K_stages, 'features': self.features, 'threshold': self.threshold,
+                                    'trees': [{k: v.tolist() for k, v in t.items()} for t in self.trees]}),
+                        encoding='utf-8')
+
+    @classmethod
+    def load(cls, path: Path) -> 'StagePredictor':
+        p = json.loads(path.read_text(encoding='utf-8'))
+        return cls(p['K_stages'], p['features'], p['trees'], p['threshold'])
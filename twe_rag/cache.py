@@ -0,0 +1,89 @@
+# twe_rag/cache.py
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, Optional
+
+import numpy as np
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive cache key (both tokenizers lowercase)."""
+    return ' '.join(query.lower().split())
+
+@dataclass
+class CacheEntry:
+    """Decay-free state of one query: the max-K retrieval and per-stage centrality.
+
+    Decay and halting depend on `now`, so they are re-applied on every hit.
+    """
+    idx: np.ndarray                      # (K,) corpus rows, retrieval order
+    bm25: np.ndarray                     # (K,) normalized BM25 partials
+    dense: np.ndarray                    # (K,) normalized dense partials
+    combo: np.ndarray                    # (K,) retrieval score
+    central: Dict[int, np.ndarray] = field(default_factory=dict)  # stage K -> (K,) centrality
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.idx, self.bm25, self.dense, self.combo, *self.central.values()]
+        # rough per-object overhead on top of the array buffers
+        return sum(a.nbytes for a in arrays) + 112 * len(arrays) + 256
+
+class QueryCache:
+    """Thread-safe LRU of `CacheEntry`, bounded by entry count and by bytes."""
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 2**20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: 'OrderedDict[Hashable, CacheEntry]' = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Hashable, entry: CacheEntry):
+        """Insert or re-account `entry` (call again after it grows)."""
+        size = entry.nbytes
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        with self._lock:
+            self.bytes += size - self._sizes.get(key, 0)
+            self._sizes[key] = size
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+                old, _ = self._data.popitem(last=False)
+                self.bytes -= self._sizes.pop(old)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
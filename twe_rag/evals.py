@@ -1,10 +1,15 @@
 # twe_rag/evals.py
 import json
+import time
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Sequence
 from tqdm import tqdm
 
+import numpy as np
+
 from twe_rag.pipeline import TWERAGPipeline, PipelineConfig
+from twe_rag.retrieval import HybridRetriever, top_k
+from twe_rag.text_utils import tokenize
 
 class Evaluator:
     def __init__(self, cfg: PipelineConfig):
@@ -13,14 +18,67 @@ class Evaluator:
     def exact_match(self, pred: str, gold: str) -> int:
         return int(pred.strip().lower() == gold.strip().lower())
 
-    def run_toy_latest(self, qa_path: Path) -> Dict:
+    def run_toy_latest(self, qa_path: Path, batch_size: int = 256) -> Dict:
+        examples = [json.loads(line) for line in qa_path.open('r', encoding='utf-8') if line.strip()]
+        outs = []
+        for s in tqdm(range(0, len(examples), batch_size)):
+            outs.extend(self.pipe.run_batch([ex['question'] for ex in examples[s:s+batch_size]]))
         n, correct = 0, 0
-        for line in tqdm(qa_path.open('r', encoding='utf-8')):
-            if not line.strip(): continue
-            ex = json.loads(line)
-            out = self.pipe.run(ex['question'])
+        for ex, out in zip(examples, outs):
             top = out['results'][0]['snippet'] if out['results'] else ''
             pred = ex['gold_latest'] if ex['gold_latest'].lower() in top.lower() else ''
             correct += self.exact_match(pred or '', ex['gold_latest'])
             n += 1
         return {'n': n, 'em': correct / max(n,1)}
+
+def ann_recall_report(index_dir: Path, queries: List[str], K: int = 100,
+                      nprobes: Sequence[int] = (1, 2, 4, 8, 16, 32, 64)) -> List[Dict]:
+    """Recall@K of dense_mode='ivf' against brute force, per nprobe.
+
+    dense_recall compares the K best dense rows, hybrid_recall the top-K of
+    `retrieve`; scored is the mean share of rows given a dense score.
+    """
+    ret = HybridRetriever(index_dir, dense_mode='ivf')
+    ann, Q = ret.ann, ret._dense_embed_batch(queries).astype(ret.dv.dtype)
+    ret.ann = None
+    exact_dense = [set(top_k(ret.dv @ qv, K).tolist()) for qv in Q]
+    s = time.perf_counter()
+    exact_hybrid = [{c['idx'] for c in ret.retrieve(q, K=K)} for q in queries]
+    report = [{'nprobe': 'exact', 'dense_recall': 1.0, 'hybrid_recall': 1.0, 'scored': 1.0,
+               'ms': (time.perf_counter() - s) * 1000 / max(len(queries), 1)}]
+    ret.ann = ann
+    for nprobe in nprobes:
+        ret.nprobe = nprobe
+        dense, hybrid, scored, secs = [], [], [], 0.0
+        for q, qv, ed, eh in zip(queries, Q, exact_dense, exact_hybrid):
+            rows, scores = ann.search(ret.dv, qv, nprobe)
+            dense.append(len(ed & set(rows[top_k(scores, K)].tolist())) / max(len(ed), 1))
+            s = time.perf_counter()
+            got = ret._retrieve_ann(tokenize(q), qv, K, 1.0, 1.0)
+            secs += time.perf_counter() - s
+            hybrid.append(len(eh & {c['idx'] for c in got}) / max(len(eh), 1))
+            scored.append(len(rows) / len(ret.ids))
+        report.append({'nprobe': nprobe, 'dense_recall': float(np.mean(dense)), 'hybrid_recall': float(np.mean(hybrid)),
+                       'scored': float(np.mean(scored)), 'ms': secs * 1000 / max(len(queries), 1)})
+    return report
+
+def stage_selection_report(cfg: PipelineConfig, queries: List[str], now=None) -> Dict:
+    """Ladder vs `cfg.stage_predictor` on the same queries.
+
+    candidates is the mean number of candidates put through the graph stage
+    per query (summed over executed stages), changed the share of queries
+    whose top-10 ids differ from the ladder's.
+    """
+    runs = {}
+    for name, on in (('ladder', False), ('predicted', True)):
+        pipe = TWERAGPipeline(PipelineConfig(**{**cfg.__dict__, 'stage_predictor': on, 'trace': True,
+                                                'cache_size': 0}))
+        runs[name] = pipe.run_batch(queries, now=now)
+    report = {'n': len(queries)}
+    for name, outs in runs.items():
+        report[f'{name}_candidates'] = float(np.mean([o['meta']['trace']['counters'].get('candidates_processed', 0)
+                                                      for o in outs])) if outs else 0.0
+    changed = [[r['id'] for r in a['results']] != [r['id'] for r in b['results']]
+               for a, b in zip(runs['ladder'], runs['predicted'])]
+    report['changed'] = float(np.mean(changed)) if changed else 0.0
+    return report
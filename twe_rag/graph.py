@@ -1,50 +1,351 @@
 # twe_rag/graph.py
-from typing import List, Dict
+import json
+from functools import lru_cache
+from typing import List, Tuple
 import numpy as np
-import networkx as nx
+import scipy.sparse as sp
 
-from twe_rag.text_utils import tokenize, shingles
+from twe_rag.text_utils import tokenize, shingle_hashes, _splitmix64
+
+_MAX_HASH = np.uint64(0xFFFFFFFFFFFFFFFF)
+# pairs CorpusGraph.build may compare before it refuses
+GRAPH_MAX_PAIRS = 50_000_000
+
+@lru_cache(maxsize=None)
+def lsh_params(threshold: float, num_perm: int, fp_weight: float = 0.3, fn_weight: float = 0.7):
+    """(bands, rows) minimizing weighted false-positive/negative area of the LSH S-curve."""
+    best, best_err = (num_perm, 1), float('inf')
+    lo, hi = np.linspace(0.0, threshold, 100), np.linspace(threshold, 1.0, 100)
+    for b in range(1, num_perm + 1):
+        for r in range(1, num_perm // b + 1):
+            fp = np.trapz(1 - (1 - lo**r)**b, lo)
+            fn = np.trapz((1 - hi**r)**b, hi)
+            err = fp_weight*fp + fn_weight*fn
+            if err < best_err:
+                best, best_err = (b, r), err
+    return best
+
+def shingle_matrix(hashes: List[np.ndarray]) -> sp.csr_matrix:
+    """Binary doc x shingle CSR matrix from per-document sorted shingle hashes."""
+    sizes = np.array([len(h) for h in hashes], dtype=np.int64)
+    indptr = np.zeros(len(hashes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=indptr[1:])
+    flat = np.concatenate(hashes) if len(hashes) else np.zeros(0, dtype=np.uint64)
+    cols, inv = np.unique(flat, return_inverse=True)
+    data = np.ones(len(flat), dtype=np.int32)
+    return sp.csr_matrix((data, inv.ravel(), indptr), shape=(len(hashes), len(cols)))
+
+def hash_jaccard(a: np.ndarray, b: np.ndarray) -> float:
+    """Jaccard of two sorted unique shingle hash arrays (0 when either is empty)."""
+    if not len(a) or not len(b):
+        return 0.0
+    inter = int(np.count_nonzero(b[np.minimum(np.searchsorted(b, a), len(b) - 1)] == a))
+    return inter / (len(a) + len(b) - inter + 1e-9)
+
+def degree_from_adjacency(W: sp.csr_matrix) -> np.ndarray:
+    """Weighted degree, 0..1 normalized."""
+    n = W.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=float)
+    # csr matvec sums each row in ascending column order
+    deg = W @ np.ones(n)
+    return (deg - deg.min()) / (deg.ptp() + 1e-9)
+
+def pagerank_from_adjacency(W: sp.csr_matrix, alpha: float = 0.85, max_iter: int = 100,
+                            tol: float = 1e-6) -> np.ndarray:
+    """Weighted PageRank by power iteration (same update as networkx.pagerank), 0..1 normalized."""
+    n = W.shape[0]
+    if W.nnz == 0:
+        return np.zeros(n, dtype=float)
+    S = np.asarray(W.sum(axis=1)).ravel()
+    S[S != 0] = 1.0 / S[S != 0]
+    A = sp.diags(S, format='csr') @ W
+    p = np.repeat(1.0 / n, n)
+    is_dangling = np.where(S == 0)[0]
+    x = p
+    for _ in range(max_iter):
+        xlast = x
+        x = alpha * (x @ A + sum(x[is_dangling]) * p) + (1 - alpha) * p
+        if np.absolute(x - xlast).sum() < n * tol:
+            break
+    return (x - x.min()) / (x.ptp() + 1e-9)
 
 class EvidenceGraph:
-    def __init__(self, docs_texts: List[str]):
-        self.docs_texts = docs_texts
-        self._tokens = [tokenize(t) for t in docs_texts]
-        self._shingles = [shingles(tok, n=3) for tok in self._tokens]
+    """Jaccard graph over 3-gram shingles of the candidate documents.
+
+    Shingles are hashed into a sparse binary doc x shingle matrix. mode='exact'
+    gets all pairwise intersection counts from one sparse product and derives
+    Jaccard from row sums. mode='minhash' builds MinHash signatures from the
+    hashed shingles and uses LSH banding to compare only candidate pairs likely
+    to reach `lsh_threshold`; edge weights are the estimated Jaccard (fraction
+    of agreeing signature slots). Centralities run on the thresholded CSR
+    adjacency; networkx is only needed for `to_networkx`.
+
+    `from_hashes` and `extend_hashes` take the shingle hashes stored in the
+    corpus store (`CorpusStore.get_shingles`) instead of texts.
+    """
+
+    def __init__(self, docs_texts: List[str], mode: str = 'exact', num_perm: int = 128,
+                 lsh_threshold: float = 0.05, seed: int = 1):
+        if mode not in ('exact', 'minhash'):
+            raise ValueError(f"Unknown graph mode: {mode}")
+        self.mode = mode
+        self.docs_texts: List[str] = []
+        self._hashes: List[np.ndarray] = []
+        # compared pairs i < j and their (estimated) Jaccard, one array per extend()
+        self._i: List[np.ndarray] = []
+        self._j: List[np.ndarray] = []
+        self._w: List[np.ndarray] = []
+        self.pairs_compared = 0
+        if mode == 'minhash':
+            rng = np.random.default_rng(seed)
+            self._perm_a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+            self._perm_b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+            self.bands, self.rows = lsh_params(lsh_threshold, num_perm)
+            self._sigs = np.zeros((0, num_perm), dtype=np.uint64)
+        self.extend(docs_texts)
+
+    @classmethod
+    def from_hashes(cls, hashes: List[np.ndarray], **kwargs) -> 'EvidenceGraph':
+        eg = cls([], **kwargs)
+        eg.extend_hashes(hashes)
+        return eg
+
+    @property
+    def n_docs(self) -> int:
+        return len(self._hashes)
+
+    def extend(self, docs_texts: List[str]):
+        """Append documents; only pairs involving a new document are compared."""
+        self.docs_texts.extend(docs_texts)
+        self.extend_hashes([shingle_hashes(tokenize(t), n=3) for t in docs_texts])
+
+    def extend_hashes(self, hashes: List[np.ndarray]):
+        """`extend` with the documents' sorted shingle hashes instead of their texts."""
+        start = len(self._hashes)
+        self._hashes.extend(hashes)
+        if start == len(self._hashes):
+            return
+        if self.mode == 'minhash':
+            self._extend_minhash(start)
+        else:
+            self._extend_exact(start)
+
+    def _add_pairs(self, i: np.ndarray, j: np.ndarray, w: np.ndarray):
+        self._i.append(i)
+        self._j.append(j)
+        self._w.append(w)
+
+    def _extend_exact(self, start: int):
+        A = shingle_matrix(self._hashes)
+        sizes = np.diff(A.indptr)
+        inter = (A[start:] @ A.T).tocoo()
+        j = inter.row.astype(np.int64) + start
+        i = inter.col.astype(np.int64)
+        keep = i < j
+        i, j, c = i[keep], j[keep], inter.data[keep]
+        n_new = A.shape[0] - start
+        self.pairs_compared += n_new * start + n_new * (n_new - 1) // 2
+        self._add_pairs(i, j, c / ((sizes[i] + sizes[j] - c) + 1e-9))
+
+    def _signature(self, h: np.ndarray) -> np.ndarray:
+        if h.size == 0:
+            return np.full(len(self._perm_a), _MAX_HASH, dtype=np.uint64)
+        # universal hashing a*x+b mod 2^64, one row per permutation
+        return (self._perm_a[:, None] * h[None, :] + self._perm_b[:, None]).min(axis=1)
+
+    def _extend_minhash(self, start: int):
+        new = [self._signature(h) for h in self._hashes[start:]]
+        self._sigs = np.vstack([self._sigs, np.array(new, dtype=np.uint64)])
+        n = len(self._sigs)
+        nonempty = np.flatnonzero([h.size > 0 for h in self._hashes])
+        pi, pj = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for band in range(self.bands):
+            block = self._sigs[nonempty, band*self.rows:(band+1)*self.rows]
+            key = np.zeros(len(nonempty), dtype=np.uint64)
+            for r in range(self.rows):
+                key = _splitmix64(key ^ block[:, r])
+            order = np.argsort(key, kind='stable')
+            bounds = np.flatnonzero(np.diff(key[order])) + 1
+            for members in np.split(nonempty[order], bounds):
+                # buckets without a new document only hold pairs compared earlier;
+                # members are ascending, so a < b
+                if len(members) > 1 and members[-1] >= start:
+                    a, b = np.triu_indices(len(members), k=1)
+                    a, b = members[a], members[b]
+                    fresh = b >= start
+                    pi.append(a[fresh])
+                    pj.append(b[fresh])
+        # pairs proposed by several bands are compared once, in (i, j) order
+        pair = np.unique(np.concatenate(pi) * n + np.concatenate(pj))
+        i, j = pair // n, pair % n
+        est = (self._sigs[i] == self._sigs[j]).mean(axis=1)
+        self.pairs_compared += len(i)
+        self._add_pairs(i, j, est)
 
     def jaccard(self, i: int, j: int) -> float:
-        a, b = self._shingles[i], self._shingles[j]
-        if not a or not b:
+        """Exact Jaccard of documents i and j."""
+        a, b = self._hashes[i], self._hashes[j]
+        if not a.size or not b.size:
             return 0.0
-        inter = len(a & b)
-        union = len(a | b) + 1e-9
+        inter = len(np.intersect1d(a, b, assume_unique=True))
+        union = (len(a) + len(b) - inter) + 1e-9
         return inter / union
 
+    def edges(self, threshold: float = 0.05) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(i, j, weight) arrays of edges with i < j and weight >= threshold."""
+        if not self._w:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0, dtype=float)
+        i, j, w = np.concatenate(self._i), np.concatenate(self._j), np.concatenate(self._w)
+        keep = w >= threshold
+        return i[keep], j[keep], w[keep]
+
+    def adjacency(self, threshold: float = 0.05) -> sp.csr_matrix:
+        """Symmetric weighted CSR adjacency of the thresholded graph."""
+        n = self.n_docs
+        i, j, w = self.edges(threshold)
+        W = sp.csr_matrix((np.concatenate([w, w]), (np.concatenate([i, j]), np.concatenate([j, i]))),
+                          shape=(n, n))
+        W.sort_indices()
+        return W
+
     def degree_centrality(self, threshold: float = 0.05):
-        n = len(self.docs_texts)
-        G = nx.Graph()
-        G.add_nodes_from(range(n))
-        for i in range(n):
-            for j in range(i+1, n):
-                w = self.jaccard(i, j)
-                if w >= threshold:
-                    G.add_edge(i, j, weight=w)
-        deg = np.array([val for (_, val) in G.degree(weight='weight')], dtype=float)
-        if deg.size == 0:
-            return np.zeros(n, dtype=float)
-        # normalize 0..1
-        return (deg - deg.min()) / (deg.ptp() + 1e-9)
+        return degree_from_adjacency(self.adjacency(threshold))
 
     def pagerank(self, threshold: float = 0.05, alpha: float = 0.85):
-        n = len(self.docs_texts)
+        return pagerank_from_adjacency(self.adjacency(threshold), alpha=alpha)
+
+    def to_networkx(self, threshold: float = 0.05):
+        """Export the thresholded graph for debugging (requires networkx)."""
+        import networkx as nx
         G = nx.Graph()
-        G.add_nodes_from(range(n))
-        for i in range(n):
-            for j in range(i+1, n):
-                w = self.jaccard(i, j)
-                if w >= threshold:
-                    G.add_edge(i, j, weight=w)
-        if G.number_of_edges() == 0:
-            return np.zeros(n, dtype=float)
-        pr = nx.pagerank(G, alpha=alpha, weight='weight')
-        vec = np.array([pr.get(i, 0.0) for i in range(n)], dtype=float)
-        return (vec - vec.min()) / (vec.ptp() + 1e-9)
+        G.add_nodes_from(range(self.n_docs))
+        for i, j, w in zip(*self.edges(threshold)):
+            G.add_edge(int(i), int(j), weight=float(w))
+        return G
+
+class CorpusGraph:
+    """Corpus-wide Jaccard graph precomputed at index time.
+
+    Stored as a symmetric CSR matrix holding every pair with weight >= the
+    build threshold. The query path slices the subgraph induced by the
+    candidate rows instead of tokenizing and comparing their texts.
+    """
+
+    def __init__(self, W: sp.csr_matrix, threshold: float):
+        self.W = W
+        self.threshold = threshold
+
+    @classmethod
+    def build(cls, hashes: List[np.ndarray], threshold: float = 0.05, mode: str = 'exact',
+              max_pairs: int = GRAPH_MAX_PAIRS, block: int = 2048, num_perm: int = 128,
+              seed: int = 1) -> 'CorpusGraph':
+        """Graph of every pair with Jaccard >= `threshold`.
+
+        mode='exact' takes all intersection counts from a blocked sparse product
+        A·Aᵀ. Its cost grows with the shingle co-occurrences, sum over shingles
+        of df·(df-1)/2, which reaches N²/2 when shingles are shared corpus-wide.
+        mode='minhash' compares only the LSH candidate pairs (as EvidenceGraph
+        mode='minhash') and weights them by exact Jaccard. Edges are a subset of
+        the exact graph, and cost grows with the number of candidates. Either
+        mode raises ValueError before doing more than `max_pairs` comparisons.
+        """
+        if mode not in ('exact', 'minhash'):
+            raise ValueError(f"Unknown graph mode: {mode}")
+        A = shingle_matrix(hashes)
+        n = len(hashes)
+        if mode == 'minhash':
+            i, j = cls._lsh_pairs(A, hashes, threshold, max_pairs, num_perm, seed)
+            sizes = np.diff(A.indptr)
+            w = np.zeros(len(i))
+            for s in range(0, len(i), block * 32):
+                a, b = i[s:s+block*32], j[s:s+block*32]
+                c = np.asarray(A[a].multiply(A[b]).sum(axis=1)).ravel()
+                w[s:s+block*32] = c / ((sizes[a] + sizes[b] - c) + 1e-9)
+            keep = w >= threshold
+            i, j, w = i[keep], j[keep], w[keep]
+            W = sp.csr_matrix((np.concatenate([w, w]), (np.concatenate([i, j]), np.concatenate([j, i]))),
+                              shape=(n, n))
+            W.sort_indices()
+            return cls(W, threshold)
+
+        df = np.bincount(A.indices, minlength=A.shape[1]).astype(np.int64)
+        products = int((df * (df - 1) // 2).sum())
+        if products > max_pairs:
+            raise ValueError(f"Exact corpus graph needs {products:,} shingle co-occurrences "
+                             f"(max_pairs={max_pairs:,}): build it with mode='minhash' (--graph-mode minhash) "
+                             "or use the query-time graph (centrality_mode='query')")
+        At = A.T.tocsr()
+        sizes = np.diff(A.indptr)
+        rows, cols, vals = [], [], []
+        for s in range(0, A.shape[0], block):
+            inter = (A[s:s+block] @ At).tocoo()
+            i = inter.row.astype(np.int64) + s
+            j = inter.col.astype(np.int64)
+            c = inter.data
+            w = c / ((sizes[i] + sizes[j] - c) + 1e-9)
+            keep = (w >= threshold) & (i != j)
+            rows.append(i[keep]); cols.append(j[keep]); vals.append(w[keep])
+        W = sp.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(n, n))
+        W.sort_indices()
+        return cls(W, threshold)
+
+    @staticmethod
+    def _lsh_pairs(A: sp.csr_matrix, hashes: List[np.ndarray], threshold: float, max_pairs: int,
+                   num_perm: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Unique LSH candidate pairs i < j, checking their count against `max_pairs` first."""
+        eg = EvidenceGraph([], mode='minhash', num_perm=num_perm, lsh_threshold=threshold, seed=seed)
+        nonempty = np.flatnonzero(np.diff(A.indptr))
+        sigs = np.array([eg._signature(hashes[d]) for d in nonempty], dtype=np.uint64).reshape(-1, num_perm)
+        keys = []
+        for band in range(eg.bands):
+            key = np.zeros(len(nonempty), dtype=np.uint64)
+            for r in range(band*eg.rows, (band+1)*eg.rows):
+                key = _splitmix64(key ^ sigs[:, r])
+            keys.append(key)
+        # bucket sizes bound the candidates before any pair is materialized
+        pairs = sum(int((c * (c - 1) // 2).sum()) for c in (np.unique(k, return_counts=True)[1].astype(np.int64)
+                                                             for k in keys))
+        if pairs > max_pairs:
+            raise ValueError(f"MinHash corpus graph has {pairs:,} LSH candidate pairs (max_pairs={max_pairs:,}): "
+                             "raise the graph threshold or use the query-time graph (centrality_mode='query')")
+        n = len(hashes)
+        found = [np.zeros(0, dtype=np.int64)]
+        for key in keys:
+            order = np.argsort(key, kind='stable')
+            bounds = np.flatnonzero(np.diff(key[order])) + 1
+            for members in np.split(nonempty[order], bounds):
+                if len(members) > 1:
+                    a, b = np.triu_indices(len(members), k=1)
+                    found.append(members[a] * n + members[b])
+        pair = np.unique(np.concatenate(found))
+        return pair // n, pair % n
+
+    def subgraph(self, idx: np.ndarray, threshold: float = None) -> sp.csr_matrix:
+        """Adjacency among rows `idx` (in that order), optionally re-thresholded."""
+        threshold = self.threshold if threshold is None else threshold
+        if threshold < self.threshold:
+            raise ValueError(f"Edge threshold {threshold} is below the graph build threshold {self.threshold}")
+        sub = self.W[idx][:, idx].tocsr()
+        if threshold > self.threshold:
+            sub.data[sub.data < threshold] = 0.0
+            sub.eliminate_zeros()
+        sub.sort_indices()
+        return sub
+
+    def save(self, path):
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path/'indptr.npy', self.W.indptr)
+        np.save(path/'indices.npy', self.W.indices)
+        np.save(path/'data.npy', self.W.data)
+        (path/'params.json').write_text(json.dumps({'threshold': self.threshold, 'n': self.W.shape[0]}),
+                                        encoding='utf-8')
+
+    @classmethod
+    def load(cls, path) -> 'CorpusGraph':
+        params = json.loads((path/'params.json').read_text(encoding='utf-8'))
+        n = params['n']
+        W = sp.csr_matrix((np.load(path/'data.npy'), np.load(path/'indices.npy'), np.load(path/'indptr.npy')),
+                          shape=(n, n))
+        return cls(W, params['threshold'])
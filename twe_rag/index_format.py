@@ -0,0 +1,276 @@
+# twe_rag/index_format.py
+"""
+On-disk index format.
+
+An index directory holds flat .npy arrays that retrievers open memory-mapped
+(postings, vocabularies, IDF, SVD components, embeddings, ids, timestamps)
+and a manifest.json written last: format version, document count, build
+configuration and the size and checksum of every file. Nothing is pickled,
+so opening an index neither depends on corpus size nor on library versions.
+
+The TF-IDF and SVD models below reproduce a fitted `TfidfVectorizer`
+(default options) and `TruncatedSVD` bit for bit from those arrays;
+`QueryEncoder` folds both into one (V, d) table for query embeddings.
+"""
+import json
+import os
+import shutil
+from hashlib import blake2b
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+import scipy.sparse as sp
+from twe_rag.text_utils import tfidf_tokenize
+
+FORMAT = 'twe-rag-index'
+FORMAT_VERSION = 3
+MANIFEST = 'manifest.json'
+
+class TfidfModel:
+    """TF-IDF encoder over a sorted term array (column j is terms[j]) and its IDF."""
+
+    def __init__(self, terms: np.ndarray, idf: np.ndarray):
+        self.terms = terms
+        self.idf = idf
+        self.n_features = len(terms)
+
+    @classmethod
+    def from_vectorizer(cls, tfidf) -> 'TfidfModel':
+        """From a fitted `TfidfVectorizer` (build time only; loading needs no scikit-learn)."""
+        terms = np.empty(len(tfidf.vocabulary_), dtype=object)
+        for t, j in tfidf.vocabulary_.items():
+            terms[j] = t
+        terms = np.array(terms.tolist(), dtype=str)
+        if len(terms) > 1 and not (terms[:-1] < terms[1:]).all():
+            raise ValueError("TF-IDF vocabulary columns must be in term order")
+        return cls(terms, np.asarray(tfidf.idf_, dtype=np.float64))
+
+    def build_analyzer(self) -> Callable[[str], List[str]]:
+        return tfidf_tokenize
+
+    def term_ids(self, tokens: List[str]) -> np.ndarray:
+        """Column of every token, -1 outside the vocabulary."""
+        if not tokens or not self.n_features:
+            return np.full(len(tokens), -1, dtype=np.int64)
+        pos = np.searchsorted(self.terms, tokens)
+        hit = pos < self.n_features
+        hit[hit] = self.terms[pos[hit]] == np.asarray(tokens)[hit]
+        return np.where(hit, pos, -1)
+
+    @classmethod
+    def from_counts(cls, terms: List[str], tf: np.ndarray, df: np.ndarray, n_docs: int,
+                    max_features: int = None) -> 'TfidfModel':
+        """The model `TfidfVectorizer(max_features).fit` learns, from corpus-wide term counts.
+
+        `tf` and `df` are each term's total count and document frequency. Like
+        the vectorizer, only the `max_features` most frequent terms are kept
+        (ties broken by the same sort over the terms in sorted order).
+        """
+        order = np.argsort(np.asarray(terms, dtype=str), kind='stable')
+        sorted_terms = np.asarray(terms, dtype=str)[order]
+        tf, df = np.asarray(tf, dtype=np.int64)[order], np.asarray(df)[order]
+        keep = np.arange(len(order))
+        if max_features is not None and len(order) > max_features:
+            keep = np.sort((-tf).argsort()[:max_features])
+        idf = np.log((n_docs + 1) / (df[keep].astype(np.float64) + 1.0)) + 1.0  # smooth_idf
+        return cls(sorted_terms[keep], idf)
+
+    def weight(self, X: sp.csr_matrix) -> sp.csr_matrix:
+        """Term counts (columns in this model's order) to L2-normalized TF-IDF rows, in place."""
+        X.data = X.data.astype(np.float64, copy=False)
+        X.data *= self.idf[X.indices]
+        # row L2 normalization, summed in stored order like sklearn.preprocessing.normalize
+        sq = np.zeros(X.shape[0])
+        rows = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+        np.add.at(sq, rows, X.data * X.data)
+        norms = np.sqrt(sq)
+        norms[norms == 0] = 1.0
+        X.data /= norms[rows]
+        return X
+
+    def transform(self, texts: List[str]) -> sp.csr_matrix:
+        """(m, V) L2-normalized TF-IDF rows, equal to TfidfVectorizer.transform."""
+        indptr, indices, counts = [0], [], []
+        for text in texts:
+            j = self.term_ids(tfidf_tokenize(text))
+            j, c = np.unique(j[j >= 0], return_counts=True)
+            indices.append(j)
+            counts.append(c)
+            indptr.append(indptr[-1] + len(j))
+        X = sp.csr_matrix((np.concatenate(counts + [np.zeros(0)]).astype(np.float64),
+                           np.concatenate(indices + [np.zeros(0, dtype=np.int64)]).astype(np.int32),
+                           np.asarray(indptr, dtype=np.int32)), shape=(len(texts), self.n_features))
+        return self.weight(X)
+
+    def save(self, path: Path):
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path/'terms.npy', self.terms)
+        np.save(path/'idf.npy', self.idf)
+
+    @classmethod
+    def load(cls, path: Path) -> 'TfidfModel':
+        return cls(np.load(path/'terms.npy', mmap_mode='r'), np.load(path/'idf.npy', mmap_mode='r'))
+
+class SVDModel:
+    """Projection on the (d, V) right singular vectors of a fitted TruncatedSVD."""
+
+    def __init__(self, components: np.ndarray, singular_values: np.ndarray):
+        self.components = components
+        self.singular_values = singular_values
+        self.n_components = len(components)
+
+    @classmethod
+    def from_svd(cls, svd) -> 'SVDModel':
+        return cls(np.asarray(svd.components_), np.asarray(svd.singular_values_))
+
+    def transform(self, X) -> np.ndarray:
+        """(m, d) projections, equal to TruncatedSVD.transform."""
+        return X @ self.components.T
+
+    def save(self, path: Path):
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path/'components.npy', self.components)
+        np.save(path/'singular_values.npy', self.singular_values)
+
+    @classmethod
+    def load(cls, path: Path) -> 'SVDModel':
+        return cls(np.load(path/'components.npy', mmap_mode='r'), np.load(path/'singular_values.npy', mmap_mode='r'))
+
+class QueryEncoder:
+    """Unit query embeddings as the sum of per-token rows of a (V, d) term table.
+
+    Row j is idf[j] * components[:, j], the SVD projection of term j's TF-IDF
+    weight. The TF-IDF L2 norm only rescales the projection, so normalizing
+    the summed rows gives normalize(svd.transform(tfidf.transform([q])))
+    without building a sparse vector (equal up to float rounding, ~1e-16).
+    """
+
+    def __init__(self, tfidf: TfidfModel, table: np.ndarray):
+        self.tfidf = tfidf
+        self.table = table
+        self.dim = table.shape[1]
+
+    @classmethod
+    def build(cls, tfidf: TfidfModel, svd: SVDModel) -> 'QueryEncoder':
+        table = np.empty((tfidf.n_features, svd.n_components), dtype=np.float64)
+        for s in range(0, tfidf.n_features, 8192):
+            table[s:s+8192] = (svd.components[:, s:s+8192] * tfidf.idf[s:s+8192]).T
+        return cls(tfidf, table)
+
+    def embed(self, text: str) -> np.ndarray:
+        """(d,) unit embedding; zero when no token is in the vocabulary."""
+        j = self.tfidf.term_ids(tfidf_tokenize(text))
+        v = self.table[j[j >= 0]].sum(axis=0)
+        n = np.sqrt(v @ v)
+        return v / n if n > 0 else v
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        out = np.empty((len(texts), self.dim), dtype=np.float64)
+        for i, t in enumerate(texts):
+            out[i] = self.embed(t)
+        return out
+
+    def save(self, path: Path):
+        np.save(path, self.table)
+
+    @classmethod
+    def load(cls, tfidf: TfidfModel, path: Path) -> 'QueryEncoder':
+        return cls(tfidf, np.load(path, mmap_mode='r'))
+
+def _checksum(path: Path) -> str:
+    h = blake2b(digest_size=16)
+    with path.open('rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def _index_files(index_dir: Path) -> List[Path]:
+    # delta segments and tombstones change after the build; segments carry their own manifest
+    skip = {MANIFEST, 'segments', 'tombstones.npy'}
+    return sorted(p for p in index_dir.rglob('*')
+                  if p.is_file() and p.relative_to(index_dir).parts[0] not in skip)
+
+def begin_build(index_dir: Path):
+    """Invalidate `index_dir` until `write_manifest` marks the new build complete."""
+    index_dir.mkdir(parents=True, exist_ok=True)
+    # manifest, then the files of indices built before it existed
+    for name in (MANIFEST, 'meta.json', 'tfidf.joblib', 'svd.joblib'):
+        (index_dir/name).unlink(missing_ok=True)
+
+def write_manifest(index_dir: Path, n_docs: int, **fields) -> Dict:
+    """Record version, document count, `fields` and every file's size and checksum; written last."""
+    files = {p.relative_to(index_dir).as_posix(): {'bytes': p.stat().st_size, 'blake2b': _checksum(p)}
+             for p in _index_files(index_dir)}
+    manifest = {'format': FORMAT, 'version': FORMAT_VERSION, 'n_docs': n_docs, **fields, 'files': files}
+    (index_dir/MANIFEST).write_text(json.dumps(manifest, indent=1), encoding='utf-8')
+    return manifest
+
+def index_versions(index_dir: Path) -> List[Path]:
+    """Published versions `<name>.v1`, `<name>.v2`, ... next to `index_dir`, oldest first."""
+    found = [p for p in index_dir.parent.glob(index_dir.name + '.v*') if p.suffix[2:].isdigit() and p.is_dir()]
+    return sorted(found, key=lambda p: int(p.suffix[2:]))
+
+def _link(index_dir: Path, target: Path):
+    tmp = index_dir.with_name(index_dir.name + '.link')
+    tmp.unlink(missing_ok=True)
+    tmp.symlink_to(target.name, target_is_directory=True)
+    os.replace(tmp, index_dir)
+
+def publish_index(built: Path, index_dir: Path):
+    """Make the complete index in `built` the one at `index_dir`.
+
+    `index_dir` becomes a symlink to a versioned sibling directory and is
+    switched with one `os.replace`, so readers open either the old or the new
+    index. Only the first publish over a plain directory moves it aside first;
+    `recover_index` repairs a crash between those two renames (readers never
+    change the index, they report it).
+    """
+    versions = index_versions(index_dir)
+    n = int(versions[-1].suffix[2:]) + 1 if versions else 1
+    plain = index_dir.exists() and not index_dir.is_symlink()
+    target = index_dir.with_name(f'{index_dir.name}.v{n + plain}')
+    os.replace(built, target)
+    if plain:
+        os.replace(index_dir, index_dir.with_name(f'{index_dir.name}.v{n}'))
+    _link(index_dir, target)
+    for old in index_versions(index_dir):
+        if old != target:
+            shutil.rmtree(old, ignore_errors=True)
+
+def recover_index(index_dir: Path) -> bool:
+    """Point a missing `index_dir` at its newest published version; True if it did."""
+    if index_dir.exists() or index_dir.is_symlink():
+        return False
+    versions = index_versions(index_dir)
+    if not versions:
+        return False
+    _link(index_dir, versions[-1])
+    return True
+
+def read_manifest(index_dir: Path) -> Dict:
+    path = index_dir/MANIFEST
+    if not index_dir.exists() and index_versions(index_dir):
+        raise FileNotFoundError(f"Index not found: {index_dir}, but {index_versions(index_dir)[-1]} is published "
+                                "(interrupted compaction). Point it there with:\n"
+                                f"  python scripts/06_compact_index.py --index-dir {index_dir} --recover")
+    if not path.exists():
+        hint = ("It was built by an earlier version (meta.json and joblib pickles): rebuild it with\n"
+                if (index_dir/'meta.json').exists() else "Please run setup first:\n  python setup.py\n\nOr build indices manually:\n")
+        raise FileNotFoundError(f"Index manifest not found: {path}\n\n{hint}"
+                                "  python scripts/01_build_indices.py --svd-dim 128")
+    manifest = json.loads(path.read_text(encoding='utf-8'))
+    if manifest.get('format') != FORMAT or manifest.get('version') != FORMAT_VERSION:
+        raise ValueError(f"{path} is index format {manifest.get('format')} v{manifest.get('version')}, "
+                         f"this version reads {FORMAT} v{FORMAT_VERSION}: rebuild the index")
+    return manifest
+
+def verify_index(index_dir: Path) -> List[str]:
+    """Files that are missing or differ from the manifest (empty when the index is intact)."""
+    manifest = read_manifest(index_dir)
+    bad = []
+    for name, info in manifest['files'].items():
+        p = index_dir/name
+        if not p.exists() or p.stat().st_size != info['bytes'] or _checksum(p) != info['blake2b']:
+            bad.append(name)
+    return bad
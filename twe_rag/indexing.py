@@ -0,0 +1,298 @@
+# twe_rag/indexing.py
+import json
+import multiprocessing as mp
+import shutil
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.decomposition import TruncatedSVD
+
+from twe_rag.retrieval import BM25Index, IDX
+from twe_rag.ann import IVFIndex
+from twe_rag.quantization import build_quantized, save_quantized
+from twe_rag.graph import CorpusGraph
+from twe_rag.sharding import write_shards
+from twe_rag.index_format import QueryEncoder, SVDModel, TfidfModel, begin_build, write_manifest
+from twe_rag.io_utils import save_strings, write_corpus_store
+from twe_rag.text_utils import tfidf_tokenize, tokenize, shingle_hashes
+from twe_rag.time_decay import parse_epochs
+
+MAX_FEATURES = 50000
+
+DATA = Path('data/corpus.jsonl')
+
+def normalize_embeddings(Xs: np.ndarray, dtype: str = 'float32') -> np.ndarray:
+    """Unit-normalize rows once at build time (same formula the query path used to apply)."""
+    dv = Xs / (np.linalg.norm(Xs, axis=1, keepdims=True) + 1e-9)
+    return dv.astype(dtype, copy=False)
+
+def read_corpus(data_path: Path):
+    """(texts, ids, timestamps) of a corpus JSONL."""
+    docs, ids, times = [], [], []
+    with data_path.open('r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            obj = json.loads(line)
+            ids.append(obj['id'])
+            times.append(obj['timestamp'])
+            docs.append(obj['text'])
+    return docs, ids, times
+
+def check_timestamps(ids: List[str], times: List[str], allow_bad: bool = False, parsed=None):
+    """Epoch seconds of `times`; unparseable ones raise unless `allow_bad` (then NaN).
+
+    `parsed` is an already computed `parse_epochs(times)`.
+    """
+    epochs, bad = parse_epochs(times) if parsed is None else parsed
+    if bad:
+        listed = ', '.join(f"{ids[i]}={times[i]!r}" for i in bad[:10])
+        msg = f"{len(bad)} unparseable timestamp(s): {listed}{' ...' if len(bad) > 10 else ''}"
+        if not allow_bad:
+            raise ValueError(msg + "\n(use --allow-bad-timestamps to index them without decay credit)")
+        print(f"WARNING: {msg}")
+    return epochs, bad
+
+def corpus_ranges(data_path: Path, n: int) -> List[Tuple[int, int]]:
+    """About `n` line-aligned byte ranges covering a corpus JSONL."""
+    size = data_path.stat().st_size
+    bounds = [0]
+    with data_path.open('rb') as f:
+        for i in range(1, n):
+            pos = max(size * i // n, bounds[-1])
+            f.seek(pos)
+            if pos and f.read(1) != b'\n':
+                f.readline()
+            bounds.append(f.tell() if pos else 0)
+    bounds.append(size)
+    return [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+def _count_range(task) -> Dict:
+    """Parse, tokenize and count the documents of one byte range (process pool worker).
+
+    Terms are numbered by first appearance within the range; postings are
+    grouped per document in the order the serial builders emit them.
+    """
+    data_path, lo, hi, with_shingles = task
+    with open(data_path, 'rb') as f:
+        f.seek(lo)
+        lines = f.read(hi - lo).splitlines()
+    docs, ids, times = [], [], []
+    for line in lines:
+        if not line.strip():
+            continue
+        obj = json.loads(line)
+        ids.append(obj['id'])
+        times.append(obj['timestamp'])
+        docs.append(obj['text'])
+    analyze = tfidf_tokenize
+    out = {'docs': docs, 'ids': ids, 'times': times, 'parsed': parse_epochs(times), 'shingles': []}
+    for name in ('bm25', 'tfidf'):
+        out[name] = ({}, [], [], [])  # vocab, term ids, counts, distinct terms per doc
+    doc_len = []
+    for text in docs:
+        toks = tokenize(text)
+        doc_len.append(len(toks))
+        if with_shingles:
+            out['shingles'].append(shingle_hashes(toks, n=3))
+        for name, terms in (('bm25', toks), ('tfidf', analyze(text))):
+            vocab, tids, tfs, nnz = out[name]
+            freqs: Dict[int, int] = {}
+            for w in terms:
+                t = vocab.setdefault(w, len(vocab))
+                freqs[t] = freqs.get(t, 0) + 1
+            tids.extend(freqs)
+            tfs.extend(freqs.values())
+            nnz.append(len(freqs))
+    for name in ('bm25', 'tfidf'):
+        vocab, tids, tfs, nnz = out[name]
+        out[name] = (list(vocab), np.asarray(tids, dtype=np.int64), np.asarray(tfs, dtype=np.int32),
+                     np.asarray(nnz, dtype=np.int64))
+    out['doc_len'] = np.asarray(doc_len, dtype=np.int64)
+    return out
+
+def _merge_counts(parts: List[Tuple], order: np.ndarray):
+    """(terms, term ids, doc rows, posting permutation) of per-range counts.
+
+    Rows are renumbered by `order` (rows[i] is the i-th document); terms are
+    numbered by first appearance in that order, as a serial pass would.
+    """
+    vocab: Dict[str, int] = {}
+    uid = np.concatenate([np.array([vocab.setdefault(w, len(vocab)) for w in terms], dtype=np.int64)[tids]
+                          for terms, tids, _, _ in parts])
+    nnz = np.concatenate([p[3] for p in parts])
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    rows = rank[np.repeat(np.arange(len(nnz)), nnz)]
+    seq = np.argsort(rows, kind='stable')
+    uid = uid[seq]
+    first = np.unique(uid, return_index=True)[1]
+    by_first = np.argsort(first)
+    new_id = np.empty(len(vocab), dtype=np.int64)
+    new_id[by_first] = np.arange(len(vocab))
+    terms = list(vocab)
+    return [terms[u] for u in by_first], new_id[uid], rows[seq], seq
+
+def _tfidf_from_counts(parts: List[Tuple], order: np.ndarray, n_docs: int,
+                       max_features: int = MAX_FEATURES) -> Tuple[TfidfModel, sp.csr_matrix]:
+    """(model, TF-IDF matrix) equal to TfidfVectorizer(max_features).fit_transform.
+
+    Within a row, entries stay ordered by first appearance of the term in the
+    corpus, the layout the vectorizer's count matrix has after its columns are
+    renumbered in term order; the SVD then sums in the same order.
+    """
+    terms, tids, rows, seq = _merge_counts(parts, order)
+    tfs = np.concatenate([p[2] for p in parts])[seq]
+    tfidf = TfidfModel.from_counts(terms, np.bincount(tids, weights=tfs, minlength=len(terms)).astype(np.int64),
+                                   np.bincount(tids, minlength=len(terms)), n_docs, max_features)
+    col = tfidf.term_ids(terms)[tids]
+    seq = np.lexsort((tids, rows))
+    seq = seq[col[seq] >= 0]
+    idx_dtype = np.int64 if len(seq) > np.iinfo(np.int32).max else np.int32
+    indptr = np.zeros(n_docs + 1, dtype=idx_dtype)
+    np.cumsum(np.bincount(rows[seq], minlength=n_docs), out=indptr[1:])
+    X = sp.csr_matrix((tfs[seq].astype(np.float64), col[seq].astype(idx_dtype), indptr),
+                      shape=(n_docs, tfidf.n_features))
+    return tfidf, tfidf.weight(X)
+
+def count_corpus_parallel(data_path: Path, workers: int, with_shingles: bool = False) -> Dict:
+    """Parse/tokenize/count `data_path` in a process pool; ranges are merged in file order."""
+    tasks = [(str(data_path), lo, hi, with_shingles) for lo, hi in corpus_ranges(data_path, 4 * workers)]
+    with mp.get_context('spawn').Pool(workers) as pool:
+        parts = pool.map(_count_range, tasks, chunksize=1)
+    return {
+        'docs': [d for p in parts for d in p['docs']],
+        'ids': [i for p in parts for i in p['ids']],
+        'times': [t for p in parts for t in p['times']],
+        'parsed': (np.concatenate([p['parsed'][0] for p in parts]) if parts else np.zeros(0),
+                   [int(off) + i for off, p in zip(np.cumsum([0] + [len(p['ids']) for p in parts]), parts)
+                    for i in p['parsed'][1]]),
+        'shingles': [h for p in parts for h in p['shingles']],
+        'doc_len': np.concatenate([p['doc_len'] for p in parts]) if parts else np.zeros(0, dtype=np.int64),
+        'bm25': [p['bm25'] for p in parts],
+        'tfidf': [p['tfidf'] for p in parts],
+    }
+
+def time_partitions(epochs: np.ndarray, unit: str = 'month') -> List[dict]:
+    """Contiguous row ranges of ascending `epochs` per calendar `unit` ('month' or 'year').
+
+    Rows with unparseable timestamps (NaN, sorted last) form a final 'unknown' partition.
+    """
+    if unit not in ('month', 'year'):
+        raise ValueError(f"Unknown time partition unit: {unit}")
+    n_dated = int(np.count_nonzero(~np.isnan(epochs)))
+    keys = (epochs[:n_dated] * 1e6).astype('datetime64[us]').astype('datetime64[M]' if unit == 'month' else 'datetime64[Y]')
+    starts = np.concatenate([[0], np.flatnonzero(keys[1:] != keys[:-1]) + 1]) if n_dated else np.zeros(0, dtype=np.int64)
+    ends = np.append(starts[1:], n_dated)
+    parts = [{'key': str(keys[lo]), 'lo': int(lo), 'hi': int(hi),
+              'min_epoch': float(epochs[lo]), 'max_epoch': float(epochs[hi - 1])} for lo, hi in zip(starts, ends)]
+    if n_dated < len(epochs):
+        parts.append({'key': 'unknown', 'lo': n_dated, 'hi': len(epochs), 'min_epoch': None, 'max_epoch': None})
+    return parts
+
+def build_indices(data_path: Path = DATA, index_dir: Path = IDX, svd_dim: int = 128,
+                  dense_dtype: str = 'float32', graph_threshold: float = None, graph_mode: str = 'exact',
+                  allow_bad_timestamps: bool = False, shards: int = 1, time_partition: str = None,
+                  ann: bool = False, ann_lists: int = None, quantize: str = None, pq_m: int = 32,
+                  workers: int = 1) -> int:
+    """Build the BM25 postings, TF-IDF+SVD embeddings and metadata from a corpus JSONL.
+
+    Everything is written as flat arrays (see `twe_rag.index_format`), with
+    manifest.json last.
+
+    Embeddings are stored unit-normalized in `dense_dtype`; 'float64' reproduces
+    the scores of indices built before normalization moved to build time bit for bit.
+    With `graph_threshold` set, the corpus-wide evidence graph is precomputed too
+    (`graph_mode` 'exact' or 'minhash', see `CorpusGraph.build`).
+    Timestamps are parsed once into epoch seconds; unparseable ones fail the
+    build unless `allow_bad_timestamps`, which stores them as NaN (no decay credit).
+    With `shards` > 1 the BM25 postings are also split for `ShardedRetriever`.
+    With `time_partition` ('month' or 'year') rows are ordered by timestamp and
+    partitions.json records each period's row range, for date-range filters and
+    decay-aware pruning. With `ann` an IVF index of `ann_lists` lists (default
+    about 4*sqrt(N)) is trained on the embeddings for dense_mode='ivf'. `quantize`
+    ('int8' or 'pq' with `pq_m` sub-quantizers) adds compressed embeddings for
+    the dense modes of the same name. With `workers` > 1, parsing, tokenization
+    and term counting run in a process pool; the output is byte-identical.
+    """
+    begin_build(index_dir)
+    # a full build supersedes ingested segments and deletions
+    shutil.rmtree(index_dir/'segments', ignore_errors=True)
+    (index_dir/'tombstones.npy').unlink(missing_ok=True)
+
+    counted = None
+    if workers > 1:
+        counted = count_corpus_parallel(data_path, workers, with_shingles=True)
+        docs, ids, times = counted['docs'], counted['ids'], counted['times']
+    else:
+        docs, ids, times = read_corpus(data_path)
+    epochs, bad = check_timestamps(ids, times, allow_bad_timestamps,
+                                   None if counted is None else counted['parsed'])
+    order = np.arange(len(ids))
+    (index_dir/'partitions.json').unlink(missing_ok=True)
+    if time_partition is not None:
+        # oldest first, undated last; every partition becomes a contiguous row range
+        order = np.argsort(epochs, kind='stable')
+        docs, ids, times, epochs = [docs[i] for i in order], [ids[i] for i in order], [times[i] for i in order], epochs[order]
+        bad = np.flatnonzero(np.isnan(epochs)).tolist()
+        partitions = {'unit': time_partition, 'partitions': time_partitions(epochs, time_partition)}
+        (index_dir/'partitions.json').write_text(json.dumps(partitions), encoding='utf-8')
+    if counted is None:
+        tokenized = [tokenize(t) for t in docs]
+        hashes = [shingle_hashes(tok, n=3) for tok in tokenized]
+    else:
+        hashes = [counted['shingles'][i] for i in order]
+    np.save(index_dir/'timestamps.npy', epochs)
+    save_strings(index_dir/'ids.npy', ids)
+
+    write_corpus_store(index_dir/'corpus', docs, times, hashes)
+
+    # BM25 (CSR postings)
+    if counted is None:
+        bm25 = BM25Index.from_tokenized(tokenized)
+    else:
+        terms, tids, dids, seq = _merge_counts(counted['bm25'], order)
+        tfs = np.concatenate([p[2] for p in counted['bm25']])[seq]
+        bm25 = BM25Index._from_postings(terms, tids, dids, tfs, counted['doc_len'][order])
+    bm25.save(index_dir/'bm25')
+    shutil.rmtree(index_dir/'shards', ignore_errors=True)
+    if shards > 1:
+        write_shards(bm25, index_dir/'shards', shards)
+
+    # TF-IDF + SVD (dense-ish, 128D)
+    if counted is None:
+        tfidf = TfidfVectorizer(max_features=MAX_FEATURES)
+        X = tfidf.fit_transform(docs)
+    else:
+        tfidf, X = _tfidf_from_counts(counted['tfidf'], order, len(ids))
+    svd = TruncatedSVD(n_components=svd_dim, random_state=42)
+    Xs = svd.fit_transform(X)  # (N, d)
+
+    if counted is None:
+        tfidf = TfidfModel.from_vectorizer(tfidf)
+    svd = SVDModel.from_svd(svd)
+    tfidf.save(index_dir/'tfidf')
+    svd.save(index_dir/'svd')
+    QueryEncoder.build(tfidf, svd).save(index_dir/'svd'/'term_table.npy')
+    dv = normalize_embeddings(Xs, dense_dtype)
+    np.save(index_dir/'tfidf_svd.npy', dv)
+    shutil.rmtree(index_dir/'ann', ignore_errors=True)
+    if ann:
+        IVFIndex.build(dv, ann_lists).save(index_dir/'ann')
+    shutil.rmtree(index_dir/'quant', ignore_errors=True)
+    if quantize is not None:
+        save_quantized(build_quantized(dv, quantize, pq_m), index_dir/'quant')
+
+    shutil.rmtree(index_dir/'graph', ignore_errors=True)
+    if graph_threshold is not None:
+        CorpusGraph.build(hashes, threshold=graph_threshold, mode=graph_mode).save(index_dir/'graph')
+
+    build = {'svd_dim': svd_dim, 'dense_dtype': dense_dtype, 'graph_threshold': graph_threshold,
+             'graph_mode': graph_mode, 'shards': shards, 'time_partition': time_partition, 'ann': ann, 'ann_lists': ann_lists,
+             'quantize': quantize, 'pq_m': pq_m, 'streaming': None}
+    write_manifest(index_dir, len(ids), dense={'normalized': True, 'dtype': dense_dtype},
+                   bad_timestamps=[ids[i] for i in bad], build=build)
+    return len(ids)
@@ -1,39 +1,194 @@
 # twe_rag/io_utils.py
-import json
+import mmap
 from pathlib import Path
-from typing import Dict
+from typing import List
 
-DATA = Path('data/corpus.jsonl')
+import numpy as np
 
-class CorpusIO:
-    def __init__(self):
-        self._by_id: Dict[str, Dict] = {}
+from twe_rag.text_utils import shingle_hashes, tokenize
 
-        if not DATA.exists():
+class CorpusStoreWriter:
+    """Append-only writer of the row-indexed corpus store read by CorpusStore."""
+
+    def __init__(self, path: Path):
+        path.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._file = (path/'texts.bin').open('wb')
+        self._offsets = [0]
+        self._timestamps: List[bytes] = []
+        self._shingle_file = (path/'shingles.bin').open('wb')
+        self._shingle_offsets = [0]
+
+    def add(self, texts: List[str], timestamps: List[str], shingles: List[np.ndarray] = None):
+        """Append documents; `shingles` are their `shingle_hashes`, computed from the texts if None."""
+        if shingles is None:
+            shingles = [shingle_hashes(tokenize(t), n=3) for t in texts]
+        for t, ts, h in zip(texts, timestamps, shingles):
+            b = t.encode('utf-8')
+            self._file.write(b)
+            self._offsets.append(self._offsets[-1] + len(b))
+            self._timestamps.append(ts.encode('utf-8'))
+            self._shingle_file.write(np.ascontiguousarray(h, dtype=np.uint64).tobytes())
+            self._shingle_offsets.append(self._shingle_offsets[-1] + len(h))
+
+    def close(self):
+        self._file.close()
+        self._shingle_file.close()
+        np.save(self.path/'offsets.npy', np.array(self._offsets, dtype=np.int64))
+        np.save(self.path/'timestamps.npy', np.array(self._timestamps, dtype=bytes))
+        np.save(self.path/'shingle_offsets.npy', np.array(self._shingle_offsets, dtype=np.int64))
+
+def write_corpus_store(path: Path, texts: List[str], timestamps: List[str], shingles: List[np.ndarray] = None):
+    """Write the row-indexed corpus store read by CorpusStore."""
+    w = CorpusStoreWriter(path)
+    w.add(texts, timestamps, shingles)
+    w.close()
+
+class CorpusStore:
+    """Corpus texts, timestamps and shingle hashes addressed by index row.
+
+    Texts are one mmap'ed UTF-8 blob sliced through a byte-offset table and
+    timestamps a packed fixed-width array, so opening the store does not
+    depend on corpus size and lookups are O(1) slices. The sorted 3-gram
+    shingle hashes of every document (`text_utils.shingle_hashes`) are one
+    mmap'ed uint64 array with their own offset table, so the graph and
+    halting stages compare candidates without reading their text.
+    """
+
+    def __init__(self, path: Path = Path('index')/'corpus'):
+        if not (path/'offsets.npy').exists():
             raise FileNotFoundError(
-                f"Corpus file not found: {DATA}\n\n"
+                f"Corpus store not found: {path}\n\n"
                 "Please run setup first:\n"
                 "  python setup.py\n\n"
-                "Or prepare corpus manually:\n"
-                "  python scripts/00_prepare_corpus.py --jsonl data/sample_corpus.jsonl"
+                "Or build indices manually:\n"
+                "  python scripts/01_build_indices.py --svd-dim 128"
             )
+        self._offsets = np.load(path/'offsets.npy', mmap_mode='r')
+        self._timestamps = np.load(path/'timestamps.npy', mmap_mode='r')
+        self._file = (path/'texts.bin').open('rb')
+        # mmap cannot map an empty file
+        self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._offsets[-1] else b''
+        self._shingle_offsets = np.load(path/'shingle_offsets.npy', mmap_mode='r')
+        self._shingles = (np.memmap(path/'shingles.bin', dtype=np.uint64, mode='r') if self._shingle_offsets[-1]
+                          else np.zeros(0, dtype=np.uint64))
 
-        with DATA.open('r', encoding='utf-8') as f:
-            for line in f:
-                if not line.strip():
-                    continue
-                obj = json.loads(line)
-                self._by_id[obj['id']] = obj
-
-        if not self._by_id:
-            raise ValueError(
-                f"Corpus file is empty: {DATA}\n\n"
-                "Please run setup to generate sample data:\n"
-                "  python setup.py"
-            )
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def get_text(self, idx: int) -> str:
+        return self._blob[self._offsets[idx]:self._offsets[idx + 1]].decode('utf-8')
+
+    def get_timestamp(self, idx: int) -> str:
+        return self._timestamps[idx].decode('utf-8')
+
+    def get_shingles(self, idx: int) -> np.ndarray:
+        return self._shingles[self._shingle_offsets[idx]:self._shingle_offsets[idx + 1]]
+
+def save_strings(path: Path, strings: List[str]):
+    """Fixed-width UTF-8 array of `strings`, read back by `StringColumn.load`."""
+    np.save(path, np.array([x.encode('utf-8') for x in strings], dtype=bytes))
+
+class StringColumn:
+    """Read-only sequence of str over fixed-width UTF-8 arrays.
+
+    The arrays stay memory-mapped and entries are decoded on access, so
+    opening a column does not depend on its length. `parts` are concatenated
+    and `rows` optionally selects (and orders) the visible entries.
+    """
+
+    def __init__(self, parts: List[np.ndarray], rows: np.ndarray = None):
+        self.parts = parts
+        self._starts = np.cumsum([0] + [len(p) for p in parts])
+        self.rows = rows
+
+    @classmethod
+    def load(cls, path: Path) -> 'StringColumn':
+        return cls([np.load(path, mmap_mode='r')])
+
+    def concat(self, others: List['StringColumn']) -> 'StringColumn':
+        cols = [self] + others
+        if any(c.rows is not None for c in cols):
+            raise ValueError("Only unfiltered columns can be concatenated")
+        return StringColumn([p for c in cols for p in c.parts])
+
+    def take(self, rows: np.ndarray) -> 'StringColumn':
+        rows = np.asarray(rows, dtype=np.int64)
+        return StringColumn(self.parts, rows if self.rows is None else self.rows[rows])
+
+    def __len__(self) -> int:
+        return int(self._starts[-1]) if self.rows is None else len(self.rows)
+
+    def __getitem__(self, idx) -> str:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        r = int(self.rows[idx]) if self.rows is not None else int(idx)
+        if len(self.parts) == 1:
+            return self.parts[0][r].decode('utf-8')
+        k = int(np.searchsorted(self._starts, r, side='right')) - 1
+        return self.parts[k][r - int(self._starts[k])].decode('utf-8')
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other)
+
+    __hash__ = None
+
+    def tolist(self) -> List[str]:
+        return list(self)
+
+def segment_dirs(index_dir: Path) -> List[Path]:
+    """Delta segments appended by `segments.ingest_documents`, oldest first."""
+    root = index_dir/'segments'
+    if not root.exists():
+        return []
+    # segments are written under a temporary name and renamed when complete
+    return sorted(p for p in root.iterdir() if p.name.isdigit() and (p/'manifest.json').exists())
+
+def load_tombstones(index_dir: Path) -> np.ndarray:
+    """Deleted rows, numbered over base + segments in append order."""
+    path = index_dir/'tombstones.npy'
+    return np.load(path) if path.exists() else np.zeros(0, dtype=np.int64)
+
+class SegmentedCorpusStore:
+    """CorpusStore API over the base store and delta segments, skipping deleted rows.
+
+    `rows` maps each live row to its row in the base + segments concatenation.
+    """
+
+    def __init__(self, stores: List[CorpusStore], rows: np.ndarray = None):
+        self.stores = stores
+        self._starts = np.cumsum([0] + [len(s) for s in stores])
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return int(self._starts[-1]) if self.rows is None else len(self.rows)
+
+    def _locate(self, idx: int):
+        r = int(self.rows[idx]) if self.rows is not None else int(idx)
+        k = int(np.searchsorted(self._starts, r, side='right')) - 1
+        return self.stores[k], r - int(self._starts[k])
+
+    def get_text(self, idx: int) -> str:
+        store, i = self._locate(idx)
+        return store.get_text(i)
+
+    def get_timestamp(self, idx: int) -> str:
+        store, i = self._locate(idx)
+        return store.get_timestamp(i)
 
-    def get_text(self, doc_id: str) -> str:
-        return self._by_id[doc_id]['text']
+    def get_shingles(self, idx: int) -> np.ndarray:
+        store, i = self._locate(idx)
+        return store.get_shingles(i)
 
-    def get_timestamp(self, doc_id: str) -> str:
-        return self._by_id[doc_id]['timestamp']
+def open_corpus_store(index_dir: Path, rows: np.ndarray = None):
+    """The index's corpus store, including delta segments when there are any."""
+    base = CorpusStore(index_dir/'corpus')
+    segs = segment_dirs(index_dir)
+    if not segs and rows is None:
+        return base
+    return SegmentedCorpusStore([base] + [CorpusStore(d/'corpus') for d in segs], rows)
@@ -1,17 +1,25 @@
 # twe_rag/pipeline.py
-from dataclasses import dataclass
+import json
+import time
+from dataclasses import dataclass, asdict
+from hashlib import blake2b
 from datetime import datetime, timezone
+from pathlib import Path
 from typing import List, Dict
 
 import numpy as np
 
 from twe_rag.types import Retrieved, Document
 from twe_rag.retrieval import HybridRetriever
-from twe_rag.graph import EvidenceGraph
+from twe_rag.sharding import ShardedRetriever
+from twe_rag.graph import EvidenceGraph, CorpusGraph, degree_from_adjacency
 from twe_rag.time_decay import TimeDecay
-from twe_rag.budget import BudgetHalting
+from twe_rag.budget import BudgetHalting, StagePredictor, stage_features
 from twe_rag.scoring import combine_scores
-from twe_rag.io_utils import CorpusIO
+from twe_rag.io_utils import open_corpus_store
+from twe_rag.tracing import Trace, NULL_TRACE, Sink, emit
+from twe_rag.cache import QueryCache, CacheEntry, normalize_query
+from twe_rag.text_utils import shingle_hashes, tfidf_tokenize, tokenize
 
 @dataclass
 class PipelineConfig:
@@ -24,68 +32,338 @@ class PipelineConfig:
     base_delta: float = 2.5  # Weight for decay term
     min_tau: float = 90.0    # Min tau in days (for recency queries)
     max_tau: float = 730.0   # Max tau in days (for historical queries)
+    # Score the corpus once for max(K_stages) and grow the candidate set
+    # stage by stage instead of re-retrieving and rebuilding per stage
+    incremental: bool = True
+    # Evidence graph: 'exact' pairwise Jaccard or 'minhash' (MinHash/LSH estimate)
+    graph_mode: str = 'exact'
+    minhash_perm: int = 128
+    edge_threshold: float = 0.05
+    # 'query' builds the graph from candidate texts; 'precomputed' slices the
+    # corpus graph built by `01_build_indices.py --graph`
+    centrality_mode: str = 'query'
+    index_dir: str = 'index'
+    # Score the corpus in one process per shard (`01_build_indices.py --shards S`)
+    sharded: bool = False
+    # Return per-stage timings and counters in meta['trace']
+    trace: bool = False
+    # LRU cache of decay-free per-query state (0 disables); decay and halting
+    # are re-applied on every hit, so cached answers follow `now`
+    cache_size: int = 0
+    cache_max_mb: float = 64.0
+    # Decay-aware candidate retrieval on a time-partitioned index
+    # (`01_build_indices.py --time-partitions month`): partitions are scanned
+    # newest first and skipped once their best possible score cannot make the top-K
+    time_pruning: bool = False
+    # Dense scoring: 'exact' (all rows), 'ivf' (approximate, `01_build_indices.py --ann`)
+    # or 'int8'/'pq' (compressed embeddings, `--quantize`); nprobe IVF lists are
+    # scanned per query, more is slower with higher recall. 'maxscore' (also
+    # `--ann`) is exact for a normalization over the query's term matches and
+    # nprobe lists, and skips the lists that cannot reach the top K
+    dense_mode: str = 'exact'
+    nprobe: int = 16
+    # compressed modes re-score the best rescore*K candidates with float32 embeddings
+    rescore: int = 4
+    # Start the K_stages ladder at the stage predicted from pre-graph signals
+    # (`scripts/08_train_stage_predictor.py` writes index/stage_predictor.json);
+    # needs incremental retrieval
+    stage_predictor: bool = False
+    # Record those pre-graph signals in meta['features'] (training logs for the predictor)
+    log_stage_features: bool = False
+
+# config fields that do not change the cached state
+_UNCACHED_FIELDS = ('trace', 'cache_size', 'cache_max_mb', 'log_stage_features')
 
 class TWERAGPipeline:
-    def __init__(self, cfg: PipelineConfig):
+    def __init__(self, cfg: PipelineConfig, sinks: List[Sink] = None, cache: QueryCache = None):
         self.cfg = cfg
+        # callables receiving every query's trace dict, e.g. tracing.HistogramSink()
+        self.sinks = list(sinks or [])
+        # a cache may be shared between pipelines, keys include config and index version
+        self.cache = cache
+        if self.cache is None and self.cfg.cache_size > 0:
+            self.cache = QueryCache(self.cfg.cache_size, int(self.cfg.cache_max_mb * 2**20))
         if self.cfg.K_stages is None:
             self.cfg.K_stages = [30, 60, 100]
-        self.ret = HybridRetriever()
-        self.io = CorpusIO()
+        if self.cfg.sharded:
+            if self.cfg.dense_mode != 'exact':
+                raise ValueError("Sharded retrieval scores dense exactly: use dense_mode='exact'")
+            self.ret = ShardedRetriever(Path(self.cfg.index_dir))
+        else:
+            self.ret = HybridRetriever(Path(self.cfg.index_dir), dense_mode=self.cfg.dense_mode,
+                                       nprobe=self.cfg.nprobe, rescore=self.cfg.rescore)
+        self.io = open_corpus_store(Path(self.cfg.index_dir), self.ret.live_rows)
+        self.graph = None
+        if self.cfg.centrality_mode == 'precomputed':
+            gdir = Path(self.cfg.index_dir)/'graph'
+            if not (gdir/'params.json').exists():
+                raise FileNotFoundError(
+                    f"Precomputed graph not found: {gdir}\n\n"
+                    "Build it with:\n"
+                    "  python scripts/01_build_indices.py --graph"
+                )
+            self.graph = CorpusGraph.load(gdir)
+            if self.graph.W.shape[0] != len(self.ret.ids) or self.ret.live_rows is not None:
+                raise ValueError(f"Graph in {gdir} is stale: rebuild indices with --graph or compact the index")
+        elif self.cfg.centrality_mode != 'query':
+            raise ValueError(f"Unknown centrality mode: {self.cfg.centrality_mode}")
+        if self.cfg.time_pruning:
+            if self.cfg.sharded:
+                raise ValueError("time_pruning is not supported with sharded retrieval")
+            self.ret.time_window()  # raises unless the index is time-partitioned
         self.decay = TimeDecay(
             base_delta=self.cfg.base_delta,
             min_tau=self.cfg.min_tau,
             max_tau=self.cfg.max_tau
         )
         self.halt = BudgetHalting()
+        self.predictor = None
+        if (self.cfg.stage_predictor or self.cfg.log_stage_features) and not self.cfg.incremental:
+            raise ValueError("stage_predictor and log_stage_features need incremental=True")
+        if self.cfg.stage_predictor:
+            path = Path(self.cfg.index_dir)/'stage_predictor.json'
+            if not path.exists():
+                raise FileNotFoundError(
+                    f"Stage predictor not found: {path}\n\n"
+                    "Train it with:\n"
+                    "  python scripts/08_train_stage_predictor.py"
+                )
+            self.predictor = StagePredictor.load(path)
+            if self.predictor.K_stages != list(self.cfg.K_stages):
+                raise ValueError(f"{path} was trained for K_stages={self.predictor.K_stages}, "
+                                 f"got {self.cfg.K_stages}: retrain it")
+
+    def _new_trace(self):
+        # tracing is off unless requested, hooks are no-ops on NULL_TRACE
+        return Trace() if self.cfg.trace or self.sinks else NULL_TRACE
+
+    def _finish(self, out: Dict, trace) -> Dict:
+        if trace.enabled:
+            t = trace.as_dict()
+            if self.cfg.trace:
+                out['meta']['trace'] = t
+            emit(self.sinks, t)
+        return out
+
+    def _cache_key(self, query: str, since: datetime = None, until: datetime = None):
+        cfg = {k: v for k, v in asdict(self.cfg).items() if k not in _UNCACHED_FIELDS}
+        fp = blake2b(json.dumps(cfg, sort_keys=True).encode(), digest_size=8).hexdigest()
+        window = tuple(t.isoformat() if t is not None else None for t in (since, until))
+        return normalize_query(query), fp, self.ret.version, window
+
+    def _cache_lookup(self, query: str, trace, since: datetime = None, until: datetime = None):
+        # only the incremental path has a single retrieval worth caching; pruned
+        # retrieval depends on `now` through the decay bound
+        if self.cache is None or not self.cfg.incremental or self.cfg.time_pruning:
+            return None, None
+        key = self._cache_key(query, since, until)
+        entry = self.cache.get(key)
+        trace.incr('cache_hits' if entry is not None else 'cache_misses')
+        return key, entry
+
+    def _candidates(self, entry: CacheEntry) -> List[Dict]:
+        """Rebuild `retrieve` output from a cache entry."""
+        return [self.ret._candidate(i, b, d, c)
+                for i, b, d, c in zip(entry.idx.tolist(), entry.bm25.tolist(), entry.dense.tolist(),
+                                      entry.combo.tolist())]
+
+    def _retrieve(self, query: str, K: int, now: datetime, trace, since: datetime = None,
+                  until: datetime = None) -> List[Dict]:
+        window = {} if since is None and until is None else {'since': since, 'until': until}
+        if not self.cfg.time_pruning:
+            return self.ret.retrieve(query, K=K, alpha=self.cfg.alpha, beta=self.cfg.beta, trace=trace, **window)
+        dp = self.decay.params_for_query(query)
+        return self.ret.retrieve_recent(query, lambda ep: self.decay.decay_batch(ep, now, dp.tau_days), K=K,
+                                        alpha=self.cfg.alpha, beta=self.cfg.beta, gamma=self.cfg.gamma,
+                                        delta=dp.delta, trace=trace, **window)
+
+    def _cached_stages(self, query: str, now: datetime, ranked: List[Dict], trace, key, entry,
+                       window: Dict = None) -> Dict:
+        if key is None:
+            return self._run_stages(query, now, ranked, trace, window=window)
+        if entry is None:
+            entry = CacheEntry(idx=np.array([c['idx'] for c in ranked], dtype=np.int64),
+                               bm25=np.array([c['partial']['bm25'] for c in ranked]),
+                               dense=np.array([c['partial']['dense'] for c in ranked]),
+                               combo=np.array([c['combo'] for c in ranked]))
+        n_stages = len(entry.central)
+        out = self._run_stages(query, now, ranked, trace, entry.central, window)
+        if len(entry.central) != n_stages:
+            # new entry, or a later stage was reached for the first time
+            self.cache.put(key, entry)
+        return out
+
+    def run(self, query: str, now: datetime = None, since: datetime = None, until: datetime = None) -> Dict:
+        """Answer `query` as of `now`; `since`/`until` restrict it to documents dated in [since, until)."""
+        now = now or datetime.now(timezone.utc)
+        window = {'since': since, 'until': until}
+        trace = self._new_trace()
+        key, entry = self._cache_lookup(query, trace, since, until)
+        ranked = None
+        if entry is not None:
+            ranked = self._candidates(entry)
+        elif self.cfg.incremental:
+            ranked = self._retrieve(query, max(self.cfg.K_stages), now, trace, since, until)
+        return self._finish(self._cached_stages(query, now, ranked, trace, key, entry, window), trace)
+
+    def run_batch(self, queries: List[str], now: datetime = None, since: datetime = None,
+                  until: datetime = None) -> List[Dict]:
+        """`run` for many queries: retrieval is batched, the staged rerank runs per query.
 
-    def run(self, query: str, now: datetime = None) -> Dict:
+        With `incremental=False` every stage retrieves on its own, so there is no
+        shared retrieval to batch and each query goes through `run`.
+        """
         now = now or datetime.now(timezone.utc)
+        if not self.cfg.incremental:
+            return [self.run(q, now, since, until) for q in queries]
+        window = {'since': since, 'until': until}
+        traces = [self._new_trace() for _ in queries]
+        looked = [self._cache_lookup(q, t, since, until) for q, t in zip(queries, traces)]
+        ranked = [self._candidates(e) if e is not None else None for _, e in looked]
+        miss = [i for i, r in enumerate(ranked) if r is None]
+        if self.cfg.time_pruning:
+            # pruning bounds are per query, there is no shared GEMM to batch
+            for i in miss:
+                ranked[i] = self._retrieve(queries[i], max(self.cfg.K_stages), now, traces[i], since, until)
+        elif miss:
+            t0 = time.perf_counter()
+            kw = {} if since is None and until is None else window
+            fresh = self.ret.retrieve_batch([queries[i] for i in miss], K=max(self.cfg.K_stages),
+                                            alpha=self.cfg.alpha, beta=self.cfg.beta, **kw)
+            # batched retrieval is one pass, each query is charged an equal share
+            per_query = (time.perf_counter() - t0) / len(miss)
+            lo, hi = self.ret.time_window(since, until) if kw else (0, len(self.ret.ids))
+            for i, r in zip(miss, fresh):
+                ranked[i] = r
+                traces[i].add_time('retrieve', per_query)
+                if kw or self.ret.ann is None:  # IVF scores a per-query subset
+                    traces[i].incr('candidates_scored', hi - lo)
+        return [self._finish(self._cached_stages(q, now, r, t, key, e, window), t)
+                for q, r, t, (key, e) in zip(queries, ranked, traces, looked)]
+
+    def _stage_features(self, query: str, ranked: List[Dict], decays: np.ndarray, delta: float) -> Dict[str, float]:
+        tfidf = self.ret.encoder.tfidf
+        ids = tfidf.term_ids(tfidf_tokenize(query))
+        return stage_features(np.array([c['combo'] for c in ranked]),
+                              np.array([c['partial']['bm25'] for c in ranked]),
+                              np.array([c['partial']['dense'] for c in ranked]),
+                              decays, delta, self.cfg.K_stages, len(tokenize(query)),
+                              float(tfidf.idf[ids[ids >= 0]].sum()), self.decay.recency_need(query))
+
+    def _run_stages(self, query: str, now: datetime, ranked: List[Dict] = None, trace=NULL_TRACE,
+                    central_cache: Dict[int, np.ndarray] = None, window: Dict = None) -> Dict:
+        # `ranked` is the max-K retrieval to grow stages from; None re-retrieves per stage
+        # (within the `window` {'since', 'until'} of `run`).
+        # `central_cache` maps stage K to its centrality and is read and filled in place.
         # get decay params from query
         dp = self.decay.params_for_query(query)
 
         best_stage = None
         stage_results: List[Retrieved] = []
 
-        for K in self.cfg.K_stages:
-            cand = self.ret.retrieve(query, K=K, alpha=self.cfg.alpha, beta=self.cfg.beta)
-            # load texts for candidates
-            texts = [self.io.get_text(c['doc'].id) if c['doc'].text is None else c['doc'].text for c in cand]
-            # evidence graph centrality
-            eg = EvidenceGraph(texts)
-            central = eg.degree_centrality(threshold=0.05)
-            # decay per doc
-            decays = []
-            for c in cand:
-                ts = self.io.get_timestamp(c['doc'].id)
-                decays.append(self.decay.decay_value(ts, now=now, tau_days=dp.tau_days))
+        eg = None
+        texts: Dict[int, str] = {}
+        stamps, decays = [], []
+
+        def text_of(c):
+            if c['doc'].text is not None:
+                return c['doc'].text
+            if c['idx'] not in texts:
+                texts[c['idx']] = self.io.get_text(c['idx'])
+                trace.incr('texts_loaded')
+            return texts[c['idx']]
+
+        def shingles_of(c):
+            if c['doc'].text is not None:
+                return shingle_hashes(tokenize(c['doc'].text), n=3)
+            return self.io.get_shingles(c['idx'])
+
+        K_stages = self.cfg.K_stages
+        features = None
+        if ranked is not None and (self.predictor is not None or self.cfg.log_stage_features):
+            # the features need the decays of all max-K candidates up front
+            with trace.stage('decay'):
+                all_decays = self.decay.decay_batch(self.ret.epochs, now, dp.tau_days,
+                                                    idx=np.array([c['idx'] for c in ranked], dtype=np.int64))
+            features = self._stage_features(query, ranked, all_decays, dp.delta)
+            if self.predictor is not None:
+                start = self.predictor.start(features)
+                trace.incr('stages_skipped', start)
+                K_stages = K_stages[start:]
+
+        for K in K_stages:
+            trace.incr('stages_executed')
+            if ranked is not None:
+                cand = ranked[:K]
+            else:
+                cand = self._retrieve(query, K, now, trace, **(window or {}))
+            if ranked is None or len(cand) < len(stamps):
+                eg = None
+                stamps, decays = [], []
+            # load timestamps and decays for candidates new to this stage
+            new = cand[len(stamps):]
+            new_idx = np.array([c['idx'] for c in new], dtype=np.int64)
+            with trace.stage('fetch'):
+                stamps.extend(self.io.get_timestamp(i) for i in new_idx)
+            trace.incr('candidates_processed', len(cand))
+            with trace.stage('decay'):
+                if features is not None:
+                    decays.extend(all_decays[len(decays):len(cand)].tolist())
+                else:
+                    decays.extend(self.decay.decay_batch(self.ret.epochs, now, dp.tau_days, idx=new_idx).tolist())
+            with trace.stage('graph'):
+                central = central_cache.get(K) if central_cache is not None else None
+                if central is None:
+                    if self.graph is not None:
+                        # induced subgraph of the precomputed corpus graph, no text needed
+                        W = self.graph.subgraph(np.array([c['idx'] for c in cand]), self.cfg.edge_threshold)
+                    else:
+                        # evidence graph grown across stages (only pairs with a new document
+                        # are compared) from the stored shingle hashes; stages served from
+                        # the cache may have been skipped
+                        compared = eg.pairs_compared if eg is not None else 0
+                        new_hashes = [shingles_of(c) for c in cand[eg.n_docs if eg is not None else 0:]]
+                        if eg is None:
+                            eg = EvidenceGraph.from_hashes(new_hashes, mode=self.cfg.graph_mode,
+                                                           num_perm=self.cfg.minhash_perm,
+                                                           lsh_threshold=self.cfg.edge_threshold)
+                        else:
+                            eg.extend_hashes(new_hashes)
+                        trace.incr('pairs_compared', eg.pairs_compared - compared)
+                        W = eg.adjacency(self.cfg.edge_threshold)
+                    trace.incr('edges_created', W.nnz // 2)
+                    central = degree_from_adjacency(W)
+                    if central_cache is not None:
+                        central_cache[K] = central
             # final scores
-            results: List[Retrieved] = []
-            scores = []
-            for i, c in enumerate(cand):
-                parts = {
-                    'bm25': c['partial']['bm25'],
-                    'dense': c['partial']['dense'],
-                    'centrality': float(central[i]),
-                    'decay': float(decays[i]),
-                }
-                score = combine_scores(parts, weights={
-                    'bm25': self.cfg.alpha,
-                    'dense': self.cfg.beta,
-                    'centrality': self.cfg.gamma,
-                    'decay': dp.delta,
-                })
-                results.append(Retrieved(doc=Document(id=c['doc'].id, text=texts[i], timestamp=self.io.get_timestamp(c['doc'].id)),
-                                         score_parts=parts, score=score))
-                scores.append(score)
-
-            # sort
-            order = np.argsort([-r.score for r in results])
-            results = [results[i] for i in order]
-            scores = [results[i].score for i in range(min(len(results), 5))]
-            top_texts = [results[i].doc.text for i in range(min(len(results), 5))]
-
-            dec = self.halt.decide([r.score for r in results[:5]], top_texts)
+            with trace.stage('score'):
+                results: List[Retrieved] = []
+                scores = []
+                for i, c in enumerate(cand):
+                    parts = {
+                        'bm25': c['partial']['bm25'],
+                        'dense': c['partial']['dense'],
+                        'centrality': float(central[i]),
+                        'decay': float(decays[i]),
+                    }
+                    score = combine_scores(parts, weights={
+                        'bm25': self.cfg.alpha,
+                        'dense': self.cfg.beta,
+                        'centrality': self.cfg.gamma,
+                        'decay': dp.delta,
+                    })
+                    results.append(Retrieved(doc=Document(id=c['doc'].id, text=None, timestamp=stamps[i]),
+                                             score_parts=parts, score=score))
+                    scores.append(score)
+
+                # sort
+                order = np.argsort([-r.score for r in results])
+                results = [results[i] for i in order]
+                snippet_cands = [cand[i] for i in order[:10]]
+                top_shingles = [shingles_of(cand[i]) for i in order[:5]]
+
+            with trace.stage('halting'):
+                dec = self.halt.decide([r.score for r in results[:5]], top_shingles=top_shingles)
             stage_results = results
             best_stage = {
                 'K': K,
@@ -93,9 +371,15 @@ class TWERAGPipeline:
                 'reason': dec.reason,
                 'decay_params': dp.__dict__,
             }
+            if self.cfg.log_stage_features:
+                best_stage['features'] = features
             if dec.halt:
                 break
 
+        # texts are only needed for the returned snippets
+        with trace.stage('fetch'):
+            for r, c in zip(stage_results, snippet_cands):
+                r.doc.text = text_of(c)
         return {
             'query': query,
             'meta': best_stage,
@@ -0,0 +1,129 @@
+# twe_rag/quantization.py
+"""
+Compressed copies of the unit-normalized embeddings for fast approximate scans.
+
+- int8: per-dimension scaled codes, x ~ codes * scale (4x smaller than float32).
+- pq:   product quantization, each of m sub-vectors replaced by the nearest of
+        256 centroids (m bytes per document), scored with asymmetric distance
+        tables: the query is kept exact and dotted with every centroid once.
+
+Retrievers scan the codes, then re-score the best candidates exactly against
+the float32 embeddings, which stay memory-mapped.
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+
+class Int8Embeddings:
+    kind = 'int8'
+
+    def __init__(self, codes: np.ndarray, scale: np.ndarray):
+        self.codes = codes  # (N, d) int8
+        self.scale = scale  # (d,) float32
+        self.n_docs = len(codes)
+
+    @classmethod
+    def build(cls, dv: np.ndarray) -> 'Int8Embeddings':
+        scale = (np.abs(dv).max(axis=0) / 127.0).astype(np.float32)
+        scale[scale == 0] = 1.0
+        return cls(np.round(dv / scale).astype(np.int8), scale)
+
+    def scores(self, qv: np.ndarray, chunk: int = 1024) -> np.ndarray:
+        """Approximate dv @ qv; codes are widened a cache-sized block at a time."""
+        w = (self.scale * qv).astype(np.float32)
+        out = np.empty(len(self.codes), dtype=np.float32)
+        buf = np.empty((chunk, self.codes.shape[1]), dtype=np.float32)
+        for s in range(0, len(self.codes), chunk):
+            c = self.codes[s:s+chunk]
+            b = buf[:len(c)]
+            np.copyto(b, c, casting='unsafe')
+            np.dot(b, w, out=out[s:s+len(c)])
+        return out
+
+    def save(self, path: Path):
+        np.save(path/'codes.npy', self.codes)
+        np.save(path/'scale.npy', self.scale)
+
+    @classmethod
+    def load(cls, path: Path) -> 'Int8Embeddings':
+        return cls(np.load(path/'codes.npy'), np.load(path/'scale.npy'))
+
+def _kmeans(X: np.ndarray, k: int, n_iter: int, rng: np.random.Generator) -> np.ndarray:
+    """(k, d) Euclidean k-means centroids (Lloyd iterations)."""
+    C = X[np.sort(rng.choice(len(X), size=k, replace=False))].copy()
+    for _ in range(n_iter):
+        assign = _nearest(X, C)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.stack([np.bincount(assign, weights=X[:, t], minlength=k) for t in range(X.shape[1])], axis=1)
+        empty = counts == 0
+        C = (sums / np.maximum(counts, 1)[:, None]).astype(np.float32)
+        # restart empty centroids from random rows
+        C[empty] = X[rng.choice(len(X), size=int(empty.sum()), replace=False)]
+    return C
+
+def _nearest(X: np.ndarray, C: np.ndarray) -> np.ndarray:
+    # argmin |x-c|^2 = argmax x.c - |c|^2/2
+    return np.argmax(X @ C.T - 0.5 * (C * C).sum(axis=1), axis=1)
+
+class PQEmbeddings:
+    kind = 'pq'
+
+    def __init__(self, codebooks: np.ndarray, codes: np.ndarray):
+        self.codebooks = codebooks  # (m, 256, d/m) float32
+        self.codes = codes          # (m, N) uint8, one contiguous row per sub-quantizer
+        self.m = len(codebooks)
+        self.n_docs = codes.shape[1]
+
+    @classmethod
+    def build(cls, dv: np.ndarray, m: int = 32, n_iter: int = 10, max_train: int = 65536,
+              seed: int = 42) -> 'PQEmbeddings':
+        n, d = dv.shape
+        if d % m:
+            raise ValueError(f"PQ sub-quantizers must divide the embedding size {d}, got {m}")
+        rng = np.random.default_rng(seed)
+        train = dv if n <= max_train else dv[np.sort(rng.choice(n, size=max_train, replace=False))]
+        ds, k = d // m, min(256, len(train))
+        codebooks = np.zeros((m, 256, ds), dtype=np.float32)
+        codes = np.empty((m, n), dtype=np.uint8)
+        for j in range(m):
+            sub = slice(j * ds, (j + 1) * ds)
+            codebooks[j, :k] = _kmeans(np.asarray(train[:, sub], dtype=np.float32), k, n_iter, rng)
+            for s in range(0, n, 65536):
+                codes[j, s:s+65536] = _nearest(np.asarray(dv[s:s+65536, sub], dtype=np.float32), codebooks[j, :k])
+        return cls(codebooks, codes)
+
+    def scores(self, qv: np.ndarray) -> np.ndarray:
+        """Approximate dv @ qv from one (m, 256) table of sub-vector dot products."""
+        table = np.einsum('mkd,md->mk', self.codebooks, qv.reshape(self.m, -1).astype(np.float32))
+        out = table[0][self.codes[0]]
+        for j in range(1, self.m):
+            out += table[j][self.codes[j]]
+        return out
+
+    def save(self, path: Path):
+        np.save(path/'codebooks.npy', self.codebooks)
+        np.save(path/'codes.npy', self.codes)
+
+    @classmethod
+    def load(cls, path: Path) -> 'PQEmbeddings':
+        return cls(np.load(path/'codebooks.npy'), np.load(path/'codes.npy'))
+
+QUANTIZERS = {c.kind: c for c in (Int8Embeddings, PQEmbeddings)}
+
+def build_quantized(dv: np.ndarray, kind: str, pq_m: int = 32):
+    if kind == 'int8':
+        return Int8Embeddings.build(dv)
+    if kind == 'pq':
+        return PQEmbeddings.build(dv, m=pq_m)
+    raise ValueError(f"Unknown embedding quantization: {kind}")
+
+def save_quantized(q, path: Path):
+    path.mkdir(parents=True, exist_ok=True)
+    q.save(path)
+    params = {'kind': q.kind, 'm': q.m} if q.kind == 'pq' else {'kind': q.kind}
+    (path/'params.json').write_text(json.dumps(params), encoding='utf-8')
+
+def load_quantized(path: Path):
+    kind = json.loads((path/'params.json').read_text(encoding='utf-8'))['kind']
+    return QUANTIZERS[kind].load(path)
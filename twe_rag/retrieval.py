@@ -1,30 +1,318 @@
 # twe_rag/retrieval.py
 import json
+import math
+import threading
+from hashlib import blake2b
 from pathlib import Path
-from typing import List, Tuple, Dict
+from datetime import datetime, timezone
+from typing import Callable, List, Tuple, Dict
 import numpy as np
-from joblib import load
-from rank_bm25 import BM25Okapi
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.decomposition import TruncatedSVD
-from sklearn.preprocessing import normalize
 
 from twe_rag.types import Document
 from twe_rag.text_utils import tokenize
+from twe_rag.tracing import NULL_TRACE
+from twe_rag.io_utils import StringColumn, segment_dirs, load_tombstones
+from twe_rag.index_format import MANIFEST, QueryEncoder, TfidfModel, read_manifest
+from twe_rag.ann import IVFIndex
+from twe_rag.quantization import QUANTIZERS, load_quantized
 
 IDX = Path('index')
 
+
+class BM25Index:
+    """Okapi BM25 over CSR-style postings.
+
+    Term t's postings live in doc_ids[indptr[t]:indptr[t+1]] (ascending doc ids)
+    with matching term frequencies in tfs. IDF and the per-document length
+    norm k1*(1-b+b*|d|/avgdl) are precomputed, so a query only touches the
+    postings of its own terms. Scores are identical to rank_bm25.BM25Okapi.
+    Terms are looked up by binary search in a sorted copy of the vocabulary,
+    so a loaded index can keep every array memory-mapped.
+    """
+
+    def __init__(self, terms: List[str], indptr: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray,
+                 doc_len: np.ndarray, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25,
+                 idf: np.ndarray = None, norm: np.ndarray = None, lookup: Tuple[np.ndarray, np.ndarray] = None):
+        self.terms = terms if isinstance(terms, np.ndarray) else list(terms)
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.n_docs = len(doc_len)
+        self.avgdl = int(doc_len.sum()) / max(self.n_docs, 1)
+        self._lookup = lookup  # (sorted terms, their term ids), built on first use
+        self.idf = self._calc_idf() if idf is None else idf
+        if norm is None:
+            norm = self.k1 * (1 - self.b + self.b * doc_len / self.avgdl)
+        self.norm = norm
+
+    @classmethod
+    def from_tokenized(cls, tokenized: List[List[str]], **params) -> 'BM25Index':
+        vocab: Dict[str, int] = {}
+        tids, dids, tfs = [], [], []
+        doc_len = np.zeros(len(tokenized), dtype=np.int64)
+        for d, toks in enumerate(tokenized):
+            doc_len[d] = len(toks)
+            freqs: Dict[str, int] = {}
+            for w in toks:
+                freqs[w] = freqs.get(w, 0) + 1
+            for w, f in freqs.items():
+                tids.append(vocab.setdefault(w, len(vocab)))
+                dids.append(d)
+                tfs.append(f)
+        return cls._from_postings(list(vocab), np.asarray(tids, dtype=np.int64), np.asarray(dids, dtype=np.int64),
+                                  np.asarray(tfs, dtype=np.int32), doc_len, **params)
+
+    @classmethod
+    def _from_postings(cls, terms: List[str], tids: np.ndarray, dids: np.ndarray, tfs: np.ndarray,
+                       doc_len: np.ndarray, **params) -> 'BM25Index':
+        # postings grouped by term, doc ids ascending inside every list
+        order = np.lexsort((dids, tids))
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tids, minlength=len(terms)), out=indptr[1:])
+        return cls(terms, indptr, dids[order].astype(np.int32), tfs[order].astype(np.int32), doc_len, **params)
+
+    def _params(self) -> Dict[str, float]:
+        return {'k1': self.k1, 'b': self.b, 'epsilon': self.epsilon}
+
+    def _term_of_posting(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self.terms)), np.diff(self.indptr))
+
+    @classmethod
+    def concat(cls, parts: List['BM25Index']) -> 'BM25Index':
+        """The documents of `parts` in order, as if indexed together (IDF and norms recomputed)."""
+        vocab: Dict[str, int] = {}
+        tids, dids, off = [], [], 0
+        for p in parts:
+            remap = np.array([vocab.setdefault(t, len(vocab)) for t in p.terms], dtype=np.int64)
+            tids.append(remap[p._term_of_posting()])
+            dids.append(p.doc_ids.astype(np.int64) + off)
+            off += p.n_docs
+        return cls._from_postings(list(vocab), np.concatenate(tids), np.concatenate(dids),
+                                  np.concatenate([p.tfs for p in parts]),
+                                  np.concatenate([p.doc_len for p in parts]), **parts[0]._params())
+
+    def select(self, rows: np.ndarray) -> 'BM25Index':
+        """Only documents `rows` (ascending), renumbered from 0, as if indexed without the others."""
+        new_id = np.full(self.n_docs, -1, dtype=np.int64)
+        new_id[rows] = np.arange(len(rows))
+        keep = new_id[self.doc_ids] >= 0
+        tids = self._term_of_posting()[keep]
+        # terms left without documents are dropped; the rest keep their order, so
+        # IDF matches a fresh build up to the summation order of the epsilon floor
+        live = np.unique(tids)
+        remap = np.zeros(len(self.terms), dtype=np.int64)
+        remap[live] = np.arange(len(live))
+        return self._from_postings([self.terms[t] for t in live], remap[tids], new_id[self.doc_ids[keep]],
+                                   self.tfs[keep], self.doc_len[rows], **self._params())
+
+    def _calc_idf(self) -> np.ndarray:
+        # Same arithmetic and summation order as BM25Okapi._calc_idf (terms are
+        # kept in first-appearance order), so scores match bit for bit.
+        df = np.diff(self.indptr).tolist()
+        idf = [math.log(self.n_docs - f + 0.5) - math.log(f + 0.5) for f in df]
+        idf_sum = 0
+        for v in idf:
+            idf_sum += v
+        eps = self.epsilon * (idf_sum / max(len(idf), 1))
+        return np.array([eps if v < 0 else v for v in idf], dtype=np.float64)
+
+    def _sorted_terms(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._lookup is None:
+            terms = np.array(self.terms, dtype=str)
+            order = np.argsort(terms, kind='stable')
+            self._lookup = (terms[order], order)
+        return self._lookup
+
+    def term_id(self, term: str) -> int:
+        """Row of `term` in the postings, -1 if it is not indexed."""
+        terms, ids = self._sorted_terms()
+        i = int(np.searchsorted(terms, term))
+        return int(ids[i]) if i < len(terms) and terms[i] == term else -1
+
+    def postings(self, term: str):
+        t = self.term_id(term)
+        if t < 0:
+            return None, None, 0.0
+        lo, hi = self.indptr[t], self.indptr[t + 1]
+        return self.doc_ids[lo:hi], self.tfs[lo:hi], float(self.idf[t])
+
+    def get_scores(self, query: List[str], lo: int = 0, hi: int = None) -> np.ndarray:
+        """Scores of documents lo..hi-1; equal to the full scores' [lo:hi] bit for bit."""
+        if lo == 0 and hi is None:
+            scores = np.zeros(self.n_docs)
+            for q in query:
+                docs, tf, idf = self.postings(q)
+                if docs is None:
+                    continue
+                tf = tf.astype(np.float64)
+                scores[docs] += idf * (tf * (self.k1 + 1) / (tf + self.norm[docs]))
+            return scores
+        hi = self.n_docs if hi is None else hi
+        scores = np.zeros(hi - lo)
+        for q in query:
+            docs, tf, idf = self.postings(q)
+            if docs is None:
+                continue
+            # posting lists are sorted by doc id, the range is a slice
+            s, e = np.searchsorted(docs, [lo, hi])
+            docs, tf = docs[s:e], tf[s:e].astype(np.float64)
+            scores[docs - lo] += idf * (tf * (self.k1 + 1) / (tf + self.norm[docs]))
+        return scores
+
+    def shard(self, lo: int, hi: int) -> 'BM25Index':
+        """Postings of documents lo..hi-1 (renumbered from 0) with corpus-wide IDF and length norms.
+
+        Scores of the shard equal get_scores(query)[lo:hi] bit for bit.
+        """
+        term_of = self._term_of_posting()
+        keep = (self.doc_ids >= lo) & (self.doc_ids < hi)
+        counts = np.bincount(term_of[keep], minlength=len(self.terms))
+        live = np.flatnonzero(counts)
+        indptr = np.zeros(len(live) + 1, dtype=np.int64)
+        np.cumsum(counts[live], out=indptr[1:])
+        return BM25Index([self.terms[t] for t in live], indptr,
+                         (self.doc_ids[keep] - lo).astype(self.doc_ids.dtype), self.tfs[keep],
+                         self.doc_len[lo:hi], k1=self.k1, b=self.b, epsilon=self.epsilon,
+                         idf=self.idf[live], norm=self.norm[lo:hi])
+
+    def save(self, path: Path):
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path/'terms.npy', np.array(self.terms, dtype=str))
+        sorted_terms, sorted_ids = self._sorted_terms()
+        np.save(path/'sorted_terms.npy', sorted_terms)
+        np.save(path/'sorted_ids.npy', sorted_ids)
+        np.save(path/'indptr.npy', self.indptr)
+        np.save(path/'doc_ids.npy', self.doc_ids)
+        np.save(path/'tfs.npy', self.tfs)
+        np.save(path/'doc_len.npy', self.doc_len)
+        np.save(path/'idf.npy', self.idf)
+        np.save(path/'norm.npy', self.norm)
+        (path/'params.json').write_text(json.dumps(self._params()), encoding='utf-8')
+
+    @classmethod
+    def load(cls, path: Path) -> 'BM25Index':
+        params = json.loads((path/'params.json').read_text(encoding='utf-8'))
+        def arr(name):
+            return np.load(path/f'{name}.npy', mmap_mode='r')
+        return cls(arr('terms'), arr('indptr'), arr('doc_ids'), arr('tfs'), arr('doc_len'),
+                   idf=arr('idf'), norm=arr('norm'), lookup=(arr('sorted_terms'), arr('sorted_ids')),
+                   **params)
+
+def top_k(scores: np.ndarray, K: int) -> np.ndarray:
+    """Indices of the K highest scores, descending, ties broken by lower index.
+
+    Deterministic tie-breaking makes the top-K a prefix of the top-K' for K < K'.
+    """
+    K = min(K, len(scores))
+    if K <= 0:
+        return np.zeros(0, dtype=np.int64)
+    kth = np.partition(scores, len(scores) - K)[len(scores) - K]
+    above = np.flatnonzero(scores > kth)
+    ties = np.flatnonzero(scores == kth)[:K - len(above)]
+    top = np.concatenate([above, ties])
+    return top[np.lexsort((top, -scores[top]))]
+
+def top_k_rows(scores: np.ndarray, K: int) -> np.ndarray:
+    """Row-wise `top_k` for a (m, N) score matrix, same tie-breaking; returns (m, K)."""
+    m, n = scores.shape
+    K = min(K, n)
+    if K <= 0:
+        return np.zeros((m, 0), dtype=np.int64)
+    kth = np.partition(scores, n - K, axis=1)[:, n - K][:, None]
+    above = scores > kth
+    ties = scores == kth
+    need = K - above.sum(axis=1, keepdims=True)
+    sel = above | (ties & (np.cumsum(ties, axis=1) <= need))
+    rows, cols = np.nonzero(sel)
+    vals = scores[rows, cols]
+    order = np.lexsort((cols, -vals, rows))
+    return cols[order].reshape(m, K)
+
+def _epoch(t: datetime) -> float:
+    return (t if t.tzinfo is not None else t.replace(tzinfo=timezone.utc)).timestamp()
+
+def index_version(files: List[Path]) -> str:
+    """Fingerprint of the files' sizes and mtimes; changes whenever the index is rebuilt."""
+    h = blake2b(digest_size=8)
+    for f in files:
+        st = f.stat()
+        h.update(f'{f.name}:{st.st_size}:{st.st_mtime_ns};'.encode())
+    return h.hexdigest()
+
 class HybridRetriever:
-    def __init__(self):
-        # Check if indices exist
-        required_files = [
-            IDX/'bm25.joblib',
-            IDX/'tfidf.joblib',
-            IDX/'svd.joblib',
-            IDX/'tfidf_svd.npy',
-            IDX/'meta.json'
-        ]
+    """BM25 + dense hybrid retrieval.
+
+    `dense_mode='ivf'` scores the dense side with the IVF index built by
+    `01_build_indices.py --ann`, probing `nprobe` lists per query. 'int8' and
+    'pq' scan the compressed embeddings of `--quantize` and re-score the best
+    `rescore`*K candidates exactly. 'maxscore' returns the exact top-K of a
+    candidate-set normalization and skips the IVF lists whose score bound
+    rules them out (see `_retrieve_maxscore`).
+    """
+
+    def __init__(self, index_dir: Path = IDX, dense_mode: str = 'exact', nprobe: int = 16, rescore: int = 4):
+        self._load_shared(index_dir)
+        self.bm25 = BM25Index.load(index_dir/'bm25')
+        self.dense_mode, self.nprobe, self.rescore = dense_mode, nprobe, rescore
+        if dense_mode in QUANTIZERS:
+            self.quant = self._load_quantized(index_dir, dense_mode)
+        # (N,d) unit-normalized embeddings; indices built before build-time
+        # normalization store raw SVD output, normalize those once here.
+        # They stay memory-mapped: pages are read on first use (compressed modes
+        # only touch the rows they re-score).
+        dv = np.load(index_dir/'tfidf_svd.npy', mmap_mode='r')
+        if not self.dense_normalized:
+            dv = dv / (np.linalg.norm(dv, axis=1, keepdims=True) + 1e-9)
+        if self.segments:
+            # delta segments: BM25 statistics are recomputed over all documents,
+            # embeddings were projected with the base TF-IDF/SVD at ingest
+            self.bm25 = BM25Index.concat([self.bm25] + [BM25Index.load(d/'bm25') for d in self.segments])
+            dv = np.concatenate([dv] + [np.load(d/'tfidf_svd.npy').astype(dv.dtype) for d in self.segments])
+        if self.live_rows is not None and len(self.live_rows) < len(dv):
+            self.bm25 = self.bm25.select(self.live_rows)
+            dv = dv[self.live_rows]
+        self.dv = np.ascontiguousarray(dv)
+        self._scratch = threading.local()  # per-thread (N,) dense score buffer, see _dense_scores
+        if dense_mode in ('ivf', 'maxscore'):
+            adir = index_dir/'ann'
+            if not (adir/'params.json').exists():
+                raise FileNotFoundError(
+                    f"ANN index not found: {adir}\n\n"
+                    "Build it with:\n"
+                    "  python scripts/01_build_indices.py --ann"
+                )
+            self.ann = IVFIndex.load(adir)
+            if self.ann.n_docs != len(self.ids) or self.live_rows is not None:
+                raise ValueError(f"ANN index in {adir} is stale: rebuild indices with --ann or compact the index")
+            if dense_mode == 'maxscore' and (self.ann.radius is None or not self.dense_normalized):
+                raise ValueError(f"ANN index in {adir} has no list bounds: rebuild indices with --ann")
+        elif dense_mode != 'exact' and self.quant is None:
+            raise ValueError(f"Unknown dense mode: {dense_mode}")
+
+    def _load_quantized(self, index_dir: Path, kind: str):
+        qdir = index_dir/'quant'
+        if not (qdir/'params.json').exists():
+            raise FileNotFoundError(
+                f"Compressed embeddings not found: {qdir}\n\n"
+                "Build them with:\n"
+                f"  python scripts/01_build_indices.py --quantize {kind}"
+            )
+        quant = load_quantized(qdir)
+        if quant.kind != kind:
+            raise ValueError(f"{qdir} holds {quant.kind} codes, not {kind}: rebuild indices with --quantize {kind}")
+        if quant.n_docs != len(self.ids) or self.live_rows is not None or not self.dense_normalized:
+            raise ValueError(f"Compressed embeddings in {qdir} are stale: rebuild indices or compact the index")
+        return quant
 
+    def _load_shared(self, index_dir: Path):
+        """Query encoder and per-document metadata, common to all retriever layouts."""
+        manifest = read_manifest(index_dir)
+        required_files = [index_dir/MANIFEST] + [index_dir/f for f in (
+            'bm25/params.json', 'tfidf/terms.npy', 'svd/term_table.npy', 'tfidf_svd.npy', 'ids.npy')]
         missing = [f for f in required_files if not f.exists()]
         if missing:
             raise FileNotFoundError(
@@ -35,43 +323,342 @@ class HybridRetriever:
                 "  python scripts/01_build_indices.py --svd-dim 128"
             )
 
-        self.bm25: BM25Okapi = load(IDX/'bm25.joblib')
-        self.tfidf: TfidfVectorizer = load(IDX/'tfidf.joblib')
-        self.svd: TruncatedSVD = load(IDX/'svd.joblib')
-        self.Xs = np.load(IDX/'tfidf_svd.npy')  # (N,d)
-        meta = json.loads((IDX/'meta.json').read_text(encoding='utf-8'))
-        self.ids = meta['ids']
-        self.times = meta['timestamps']
+        self.index_dir = index_dir
+        # approximate dense scoring, see HybridRetriever
+        self.ann = None
+        self.quant = None
+        self.segments = segment_dirs(index_dir)
+        deleted = load_tombstones(index_dir)
+        updates = [d/MANIFEST for d in self.segments]
+        if len(deleted):
+            updates.append(index_dir/'tombstones.npy')
+        self.version = index_version([index_dir/MANIFEST] + updates)
+        self.encoder = QueryEncoder.load(TfidfModel.load(index_dir/'tfidf'), index_dir/'svd'/'term_table.npy')
+        # ids and raw timestamps stay memory-mapped, decoded per candidate
+        self.ids = StringColumn.load(index_dir/'ids.npy')
+        self.times = StringColumn.load(index_dir/'corpus'/'timestamps.npy')
+        self.epochs = np.load(index_dir/'timestamps.npy', mmap_mode='r')  # (N,) epoch seconds
+        self.dense_normalized = manifest['dense']['normalized']
+        # time partitions (row ranges, oldest first); row order no longer matches once updated
+        self.partitions = None
+        if (index_dir/'partitions.json').exists() and not updates:
+            self.partitions = json.loads((index_dir/'partitions.json').read_text(encoding='utf-8'))['partitions']
+        # live rows over base + segments; None when the index has no updates
+        self.live_rows = None
+        if updates:
+            self.ids = self.ids.concat([StringColumn.load(d/'ids.npy') for d in self.segments])
+            self.times = self.times.concat([StringColumn.load(d/'corpus'/'timestamps.npy') for d in self.segments])
+            self.epochs = np.concatenate([self.epochs] + [np.load(d/'timestamps.npy') for d in self.segments])
+            alive = np.ones(len(self.ids), dtype=bool)
+            alive[deleted] = False
+            self.live_rows = np.flatnonzero(alive)
+            self.ids = self.ids.take(self.live_rows)
+            self.times = self.times.take(self.live_rows)
+            self.epochs = self.epochs[self.live_rows]
 
     def _dense_embed(self, text: str) -> np.ndarray:
-        vec = self.tfidf.transform([text])  # (1, V)
-        sv = self.svd.transform(vec)        # (1, d)
-        return normalize(sv)[0]             # (d,)
+        return self.encoder.embed(text)  # (d,)
+
+    def _dense_embed_batch(self, texts: List[str]) -> np.ndarray:
+        return self.encoder.embed_batch(texts)  # (m, d)
+
+    def _candidate(self, i: int, b: float, d: float, combo: float) -> Dict:
+        return {
+            'doc': Document(id=self.ids[i], text=None, timestamp=self.times[i]),
+            'idx': int(i),
+            'partial': {'bm25': float(b), 'dense': float(d)},
+            'combo': float(combo)
+        }
+
+    def _results(self, top: np.ndarray, b: np.ndarray, d: np.ndarray, combo: np.ndarray,
+                 rows: np.ndarray = None) -> List[Dict]:
+        # `rows` maps positions of the score arrays to index rows when only some were scored
+        if rows is None:
+            return [self._candidate(i, b[i], d[i], combo[i]) for i in top]
+        return [self._candidate(rows[i], b[i], d[i], combo[i]) for i in top]
+
+    def _dated_rows(self) -> int:
+        last = self.partitions[-1] if self.partitions else None
+        return last['lo'] if last is not None and last['key'] == 'unknown' else len(self.ids)
+
+    def time_window(self, since: datetime = None, until: datetime = None) -> Tuple[int, int]:
+        """Row range lo..hi-1 of documents dated in [since, until) on a time-partitioned index.
 
-    def retrieve(self, query: str, K: int = 100, alpha: float = 1.0, beta: float = 1.0) -> List[Dict]:
+        Documents without a parseable timestamp fall outside every window.
+        """
+        if self.partitions is None:
+            raise ValueError(
+                f"{self.index_dir} is not time-partitioned: rebuild indices with --time-partitions month "
+                "(or compact an index with ingested documents)")
+        n = self._dated_rows()
+        lo = 0 if since is None else int(np.searchsorted(self.epochs[:n], _epoch(since), side='left'))
+        hi = n if until is None else int(np.searchsorted(self.epochs[:n], _epoch(until), side='left'))
+        return lo, max(lo, hi)
+
+    def _recent_ranges(self, since: datetime = None, until: datetime = None) -> List[Tuple[int, int]]:
+        """Partition row ranges newest first (undated last), clipped to the window."""
+        windowed = since is not None or until is not None
+        lo, hi = self.time_window(since, until)
+        out = []
+        for p in reversed(self.partitions):
+            if p['key'] == 'unknown':
+                continue
+            a, b = max(p['lo'], lo), min(p['hi'], hi)
+            if a < b:
+                out.append((a, b))
+        if not windowed and self._dated_rows() < len(self.ids):
+            out.append((self._dated_rows(), len(self.ids)))
+        return out
+
+    def retrieve_batch(self, queries: List[str], K: int = 100, alpha: float = 1.0, beta: float = 1.0,
+                       batch_size: int = 256, since: datetime = None, until: datetime = None) -> List[List[Dict]]:
+        """`retrieve` for many queries: one TF-IDF/SVD transform and one GEMM per batch.
+
+        Rankings match `retrieve` up to GEMM-vs-GEMV floating-point rounding.
+        """
+        lo, hi = (0, None) if since is None and until is None else self.time_window(since, until)
+        if self._approximate() and hi is None:
+            # candidate sets differ per query, there is no shared GEMM
+            out = []
+            for s in range(0, len(queries), batch_size):
+                chunk = queries[s:s+batch_size]
+                Q = self._dense_embed_batch(chunk).astype(self.dv.dtype)
+                out.extend(self._retrieve_approx(tokenize(q), qv, K, alpha, beta) for q, qv in zip(chunk, Q))
+            return out
+        dv = self.dv if hi is None else self.dv[lo:hi]
+        rows = np.arange(lo, lo + len(dv)) if lo else None
+        if len(dv) == 0:
+            return [[] for _ in queries]
+        out: List[List[Dict]] = []
+        for s in range(0, len(queries), batch_size):
+            chunk = queries[s:s+batch_size]
+            Q = self._dense_embed_batch(chunk).astype(self.dv.dtype)  # (m, d)
+            dense_scores = Q @ dv.T                                    # (m, N)
+            bm25_scores = np.stack([self.bm25.get_scores(tokenize(q), lo, hi) for q in chunk])
+            b = (bm25_scores - bm25_scores.min(axis=1, keepdims=True)) / (bm25_scores.ptp(axis=1)[:, None] + 1e-9)
+            d = (dense_scores - dense_scores.min(axis=1, keepdims=True)) / (dense_scores.ptp(axis=1)[:, None] + 1e-9)
+            combo = alpha*b + beta*d
+            top = top_k_rows(combo, K)
+            out.extend(self._results(top[r], b[r], d[r], combo[r], rows) for r in range(len(chunk)))
+        return out
+
+    def _dense_scores(self, qv: np.ndarray) -> np.ndarray:
+        """dv @ qv in a buffer reused by the calling thread (valid until its next call)."""
+        buf = getattr(self._scratch, 'dense', None)
+        if buf is None:
+            buf = self._scratch.dense = np.empty(len(self.dv), dtype=self.dv.dtype)
+        return np.dot(self.dv, qv, out=buf)
+
+    def retrieve(self, query: str, K: int = 100, alpha: float = 1.0, beta: float = 1.0,
+                 trace=NULL_TRACE, since: datetime = None, until: datetime = None) -> List[Dict]:
+        """Top-K by alpha*bm25 + beta*dense, both min-max normalized over the scored documents.
+
+        With `since`/`until` only documents dated in that window are scored (and
+        normalized over); this needs a time-partitioned index. Windows are
+        scored exactly in every dense mode.
+        """
+        lo, hi = (0, None) if since is None and until is None else self.time_window(since, until)
+        if self._approximate() and hi is None:
+            with trace.stage('dense'):
+                qv = self._dense_embed(query).astype(self.dv.dtype)
+            return self._retrieve_approx(tokenize(query), qv, K, alpha, beta, trace)
         # Sparse scores
-        q_tok = tokenize(query)
-        bm25_scores = self.bm25.get_scores(q_tok)  # (N,)
+        with trace.stage('bm25'):
+            q_tok = tokenize(query)
+            bm25_scores = self.bm25.get_scores(q_tok, lo, hi)  # (N,)
         # Dense scores (cosine)
-        qv = self._dense_embed(query)              # (d,)
-        dv = self.Xs / (np.linalg.norm(self.Xs, axis=1, keepdims=True) + 1e-9)
-        dense_scores = dv @ qv                     # (N,)
-
-        # Combine (pre-normalize to comparable ranges)
-        b = (bm25_scores - bm25_scores.min()) / (bm25_scores.ptp() + 1e-9)
-        d = (dense_scores - dense_scores.min()) / (dense_scores.ptp() + 1e-9)
-        combo = alpha*b + beta*d
-        # Handle case where K > number of documents
-        K_actual = min(K, len(combo))
-        top = np.argpartition(-combo, K_actual-1)[:K_actual]
-        top = top[np.argsort(-combo[top])]
-
-        results = []
-        for i in top:
-            results.append({
-                'doc': Document(id=self.ids[i], text=None, timestamp=self.times[i]),
-                'idx': int(i),
-                'partial': {'bm25': float(b[i]), 'dense': float(d[i])},
-                'combo': float(combo[i])
-            })
+        with trace.stage('dense'):
+            qv = self._dense_embed(query).astype(self.dv.dtype)  # (d,)
+            if hi is None:
+                dense_scores = self._dense_scores(qv)  # (N,)
+            else:
+                dense_scores = np.dot(self.dv[lo:hi], qv)
+        if len(bm25_scores) == 0:
+            return []
+
+        with trace.stage('topk'):
+            # Combine (pre-normalize to comparable ranges)
+            b = (bm25_scores - bm25_scores.min()) / (bm25_scores.ptp() + 1e-9)
+            d = (dense_scores - dense_scores.min()) / (dense_scores.ptp() + 1e-9)
+            combo = alpha*b + beta*d
+            top = top_k(combo, K)
+            results = self._results(top, b, d, combo, rows=np.arange(lo, lo + len(combo)) if lo else None)
+        trace.incr('candidates_scored', len(combo))
         return results
+
+    def _approximate(self) -> bool:
+        return self.ann is not None or self.quant is not None
+
+    def _retrieve_approx(self, q_tok: List[str], qv: np.ndarray, K: int, alpha: float, beta: float,
+                         trace=NULL_TRACE) -> List[Dict]:
+        if self.dense_mode == 'maxscore':
+            return self._retrieve_maxscore(q_tok, qv, K, alpha, beta, trace)
+        if self.ann is not None:
+            return self._retrieve_ann(q_tok, qv, K, alpha, beta, trace)
+        return self._retrieve_quantized(q_tok, qv, K, alpha, beta, trace)
+
+    def _retrieve_quantized(self, q_tok: List[str], qv: np.ndarray, K: int, alpha: float, beta: float,
+                            trace=NULL_TRACE) -> List[Dict]:
+        """`retrieve` over compressed embeddings: rank by approximate dense scores,
+        then re-score the best `rescore`*K candidates exactly.
+
+        The dense min-max range comes from exact scores of the candidates and of
+        the rows with the highest and lowest approximate score.
+        """
+        with trace.stage('bm25'):
+            bm25_scores = self.bm25.get_scores(q_tok)
+        with trace.stage('dense'):
+            approx = self.quant.scores(qv)
+        with trace.stage('topk'):
+            b = (bm25_scores - bm25_scores.min()) / (bm25_scores.ptp() + 1e-9)
+            a_min, a_max = float(approx.min()), float(approx.max())
+            cand = np.sort(top_k(alpha*b + beta*(approx - a_min) / (a_max - a_min + 1e-9), self.rescore * K))
+            extremes = np.array(sorted({int(approx.argmin()), int(approx.argmax())}))
+        with trace.stage('rescore'):
+            dense = self.dv[cand] @ qv
+            ext = self.dv[extremes] @ qv
+        with trace.stage('topk'):
+            d_min, d_max = min(float(ext.min()), float(dense.min())), max(float(ext.max()), float(dense.max()))
+            d = (dense - d_min) / (d_max - d_min + 1e-9)
+            combo = alpha*b[cand] + beta*d
+            top = top_k(combo, K)
+            results = self._results(top, b[cand], d, combo, rows=cand)
+        trace.incr('candidates_scored', len(bm25_scores))
+        trace.incr('candidates_rescored', len(cand))
+        return results
+
+    def _retrieve_ann(self, q_tok: List[str], qv: np.ndarray, K: int, alpha: float, beta: float,
+                      trace=NULL_TRACE) -> List[Dict]:
+        """`retrieve` with IVF dense search, ranking the rows of the probed lists and the BM25 top-K.
+
+        BM25 candidates outside the probed lists get exact dense scores too. The
+        corpus-wide dense minimum used for min-max normalization is estimated
+        from the lists farthest from the query.
+        """
+        with trace.stage('bm25'):
+            bm25_scores = self.bm25.get_scores(q_tok)
+        with trace.stage('dense'):
+            rows, dense = self.ann.search(self.dv, qv, self.nprobe)
+            extra = np.setdiff1d(top_k(bm25_scores, K), rows)
+            if len(extra):
+                rows = np.concatenate([rows, extra])
+                order = np.argsort(rows, kind='stable')
+                rows, dense = rows[order], np.concatenate([dense, self.dv[extra] @ qv])[order]
+            d_min = min(float(dense.min()), self.ann.min_score(self.dv, qv, self.nprobe))
+        with trace.stage('topk'):
+            b = (bm25_scores[rows] - bm25_scores.min()) / (bm25_scores.ptp() + 1e-9)
+            d = (dense - d_min) / (dense.max() - d_min + 1e-9)
+            combo = alpha*b + beta*d
+            top = top_k(combo, K)
+            results = self._results(top, b, d, combo, rows=rows)
+        trace.incr('candidates_scored', len(rows))
+        return results
+
+    def _retrieve_maxscore(self, q_tok: List[str], qv: np.ndarray, K: int, alpha: float, beta: float,
+                           trace=NULL_TRACE) -> List[Dict]:
+        """Exact top-K of alpha*bm25 + beta*dense, min-max normalized over a guaranteed candidate set.
+
+        The set is every document sharing a term with the query plus the rows
+        of the `nprobe` IVF lists nearest to it; both are known before any
+        dense score. Every other document has bm25 0, so its score is bounded
+        by its list's dense bound (`IVFIndex.upper_bounds`): lists whose bound
+        is below the K-th score of the set are skipped, the rest are scored.
+        Results equal ranking all N documents under the same normalization
+        (up to dot-product rounding), and K-prefixes agree as in `retrieve`.
+        """
+        with trace.stage('bm25'):
+            bm25_scores = self.bm25.get_scores(q_tok)
+        with trace.stage('dense'):
+            rows = np.union1d(np.flatnonzero(bm25_scores), self.ann.probe(qv, self.nprobe))
+            if not len(rows):  # no query term indexed and the probed lists are empty
+                rows = np.arange(len(self.ids))
+            full = None
+            if 4 * len(rows) > len(self.dv):
+                # a contiguous pass beats gathering a large share of the rows
+                full = self._dense_scores(qv)
+                dense = full[rows]
+            else:
+                dense = self.dv[rows] @ qv
+        with trace.stage('topk'):
+            bs = bm25_scores[rows]
+            b_min, b_rng = bs.min(), bs.ptp() + 1e-9
+            d_min, d_rng = dense.min(), dense.ptp() + 1e-9
+            b = (bs - b_min) / b_rng
+            d = (dense - d_min) / d_rng
+            combo = alpha*b + beta*d
+            kth = combo[top_k(combo, K)[-1]] if 0 < K <= len(combo) else -np.inf
+            bound = alpha*((0.0 - b_min) / b_rng) + beta*((self.ann.upper_bounds(qv) - d_min) / d_rng)
+            extra = np.setdiff1d(self.ann.list_rows(np.flatnonzero(bound >= kth)), rows, assume_unique=True)
+        if len(extra):
+            with trace.stage('dense'):
+                rows = np.concatenate([rows, extra])
+                order = np.argsort(rows, kind='stable')
+                if full is None and 4 * len(rows) > len(self.dv):
+                    full = self._dense_scores(qv)
+                extra_dense = full[extra] if full is not None else self.dv[extra] @ qv
+                rows, dense = rows[order], np.concatenate([dense, extra_dense])[order]
+            with trace.stage('topk'):
+                b = (bm25_scores[rows] - b_min) / b_rng
+                d = (dense - d_min) / d_rng
+                combo = alpha*b + beta*d
+        with trace.stage('topk'):
+            top = top_k(combo, K)
+            results = self._results(top, b, d, combo, rows=rows)
+        trace.incr('candidates_scored', len(rows))
+        return results
+
+    def retrieve_recent(self, query: str, decay_fn: Callable[[np.ndarray], np.ndarray], K: int = 100,
+                        alpha: float = 1.0, beta: float = 1.0, gamma: float = 0.0, delta: float = 0.0,
+                        trace=NULL_TRACE, since: datetime = None, until: datetime = None) -> List[Dict]:
+        """Top-K by alpha*bm25 + beta*dense + delta*decay, scanning time partitions newest first.
+
+        `decay_fn` maps epoch seconds to decay (non-decreasing in time, NaN -> 0).
+        Partitions are scored in chunks that double the scored documents; scanning
+        stops once the best final score any older document could reach,
+        alpha + beta + gamma (centrality) + delta*decay of its newest timestamp,
+        is below the K-th score so far. bm25 and dense are min-max normalized over
+        the documents scored, so when partitions were pruned `combo` values differ
+        from `retrieve`'s. Needs a time-partitioned index.
+        """
+        ranges = self._recent_ranges(since, until)
+        with trace.stage('bm25'):
+            q_tok = tokenize(query)
+        with trace.stage('dense'):
+            qv = self._dense_embed(query).astype(self.dv.dtype)
+        scored = []  # (lo, hi, bm25, dense) per scored row range
+        n_scored, n_ranges, top = 0, 0, np.zeros(0, dtype=np.int64)
+        while n_ranges < len(ranges):
+            take = []
+            while n_ranges < len(ranges) and (not take or sum(h - l for l, h in take) < max(n_scored, K)):
+                lo, hi = ranges[n_ranges]
+                if take and take[-1][0] == hi:
+                    take[-1] = (lo, take[-1][1])  # the next older partition is adjacent
+                else:
+                    take.append((lo, hi))
+                n_ranges += 1
+            for lo, hi in take:
+                with trace.stage('bm25'):
+                    b = self.bm25.get_scores(q_tok, lo, hi)
+                with trace.stage('dense'):
+                    scored.append((lo, hi, b, np.dot(self.dv[lo:hi], qv)))
+                n_scored += hi - lo
+            with trace.stage('topk'):
+                # in row order, so ties go to the lower row as in `retrieve`
+                scored.sort(key=lambda r: r[0])
+                bs, ds = np.concatenate([r[2] for r in scored]), np.concatenate([r[3] for r in scored])
+                rs = np.concatenate([np.arange(r[0], r[1]) for r in scored])
+                b = (bs - bs.min()) / (bs.ptp() + 1e-9)
+                d = (ds - ds.min()) / (ds.ptp() + 1e-9)
+                combo = alpha*b + beta*d
+                final = combo + delta * decay_fn(self.epochs[rs])
+                top = top_k(final, K)
+            if n_ranges < len(ranges) and len(top) == K:
+                newest = self.epochs[ranges[n_ranges][1] - 1]
+                bound = alpha + beta + gamma + delta * float(decay_fn(np.array([newest]))[0])
+                if bound < final[top[-1]]:
+                    break
+        trace.incr('candidates_scored', n_scored)
+        trace.incr('partitions_pruned', len(ranges) - n_ranges)
+        if not n_scored:
+            return []
+        return self._results(top, b, d, combo, rows=rs)
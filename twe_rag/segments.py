@@ -0,0 +1,192 @@
+# twe_rag/segments.py
+"""
+Incremental index updates.
+
+New documents are appended as delta segments under index/segments/: their
+BM25 postings plus embeddings projected with the base index's fitted TF-IDF
+and SVD (`transform`, no refit). Deleted documents are tombstoned rows, and
+re-ingesting an existing id replaces it. Retrievers merge base and segments
+at load with BM25 statistics recomputed over the live documents, so BM25
+scores equal a full rebuild and only the dense model goes stale;
+`drift_report` says when a full refit (`compact_index`) is worth it.
+"""
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+from twe_rag.indexing import build_indices, check_timestamps, normalize_embeddings, read_corpus
+from twe_rag.index_format import SVDModel, TfidfModel, publish_index, read_manifest, recover_index, write_manifest
+from twe_rag.io_utils import (StringColumn, open_corpus_store, segment_dirs, load_tombstones, save_strings,
+                              write_corpus_store)
+from twe_rag.retrieval import BM25Index, IDX
+from twe_rag.streaming import build_indices_streaming
+from twe_rag.text_utils import tokenize
+
+def _all_ids(index_dir: Path) -> List[str]:
+    """Document ids of base + segments in append order (deleted rows included)."""
+    ids = StringColumn.load(index_dir/'ids.npy').tolist()
+    for d in segment_dirs(index_dir):
+        ids += StringColumn.load(d/'ids.npy').tolist()
+    return ids
+
+def _live_ids(index_dir: Path) -> Dict[str, int]:
+    deleted = set(load_tombstones(index_dir).tolist())
+    return {doc_id: row for row, doc_id in enumerate(_all_ids(index_dir)) if row not in deleted}
+
+def _add_tombstones(index_dir: Path, rows: List[int]):
+    rows = np.union1d(load_tombstones(index_dir), np.asarray(rows, dtype=np.int64))
+    tmp = index_dir/'tombstones.tmp.npy'
+    np.save(tmp, rows)
+    os.replace(tmp, index_dir/'tombstones.npy')
+
+def embedding_stats(tfidf, svd, texts: List[str]) -> Dict[str, float]:
+    """Token and projection totals behind the drift metrics.
+
+    oov_tokens counts analyzer tokens outside the fitted TF-IDF vocabulary;
+    retention_sum adds up, per document, the norm of its unit TF-IDF vector
+    kept by the SVD projection (1 = fully inside the fitted subspace).
+    """
+    analyze = tfidf.build_analyzer()
+    tokens = oov = 0
+    for t in texts:
+        toks = analyze(t)
+        tokens += len(toks)
+        oov += int((tfidf.term_ids(toks) < 0).sum())
+    X = tfidf.transform(texts)
+    nonempty = np.flatnonzero(X.getnnz(axis=1))
+    kept = np.linalg.norm(svd.transform(X[nonempty]), axis=1) if len(nonempty) else np.zeros(0)
+    return {'tokens': tokens, 'oov_tokens': oov, 'docs_embedded': len(nonempty), 'retention_sum': float(kept.sum())}
+
+def ingest_documents(data_path: Path, index_dir: Path = IDX, allow_bad_timestamps: bool = False) -> int:
+    """Append the documents of a JSONL file as a new delta segment; returns how many.
+
+    Documents whose id is already indexed replace the old version.
+    """
+    base = read_manifest(index_dir)
+    docs, ids, times = read_corpus(data_path)
+    if not ids:
+        return 0
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"Duplicate document ids in {data_path}")
+    epochs, bad = check_timestamps(ids, times, allow_bad_timestamps)
+    live = _live_ids(index_dir)
+    replaced = [live[i] for i in ids if i in live]
+
+    tfidf = TfidfModel.load(index_dir/'tfidf')
+    svd = SVDModel.load(index_dir/'svd')
+    segs = segment_dirs(index_dir)
+    n = int(segs[-1].name) + 1 if segs else 1
+    final = index_dir/'segments'/f'{n:06d}'
+    tmp = final.with_name(final.name + '.tmp')
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    BM25Index.from_tokenized([tokenize(t) for t in docs]).save(tmp/'bm25')
+    Xs = svd.transform(tfidf.transform(docs))
+    np.save(tmp/'tfidf_svd.npy', normalize_embeddings(Xs, base['dense']['dtype']))
+    np.save(tmp/'timestamps.npy', epochs)
+    save_strings(tmp/'ids.npy', ids)
+    write_corpus_store(tmp/'corpus', docs, times)
+    write_manifest(tmp, len(ids), bad_timestamps=[ids[i] for i in bad], drift=embedding_stats(tfidf, svd, docs))
+    os.replace(tmp, final)
+    if replaced:
+        _add_tombstones(index_dir, replaced)
+    return len(ids)
+
+def delete_documents(ids: List[str], index_dir: Path = IDX) -> int:
+    """Tombstone the live documents with these ids; returns how many were found."""
+    live = _live_ids(index_dir)
+    rows = [live[i] for i in ids if i in live]
+    if rows:
+        _add_tombstones(index_dir, rows)
+    return len(rows)
+
+def drift_report(index_dir: Path = IDX, sample: int = 1000, max_delta_fraction: float = 0.2,
+                 max_deleted_fraction: float = 0.2, max_oov_increase: float = 0.05,
+                 max_retention_drop: float = 0.05) -> Dict:
+    """How far the base TF-IDF/SVD fit is from the live corpus, and whether to refit.
+
+    Compares delta documents against an evenly spaced sample of base documents:
+    the share of their tokens outside the fitted vocabulary and the share of
+    their TF-IDF norm the SVD subspace retains. Any threshold exceeded
+    recommends `compact_index`.
+    """
+    n_base = read_manifest(index_dir)['n_docs']
+    delta = {'tokens': 0, 'oov_tokens': 0, 'docs_embedded': 0, 'retention_sum': 0.0}
+    n_delta = 0
+    for d in segment_dirs(index_dir):
+        seg = read_manifest(d)
+        n_delta += seg['n_docs']
+        for k in delta:
+            delta[k] += seg['drift'][k]
+    n_deleted = len(load_tombstones(index_dir))
+    n_live = n_base + n_delta - n_deleted
+
+    tfidf = TfidfModel.load(index_dir/'tfidf')
+    svd = SVDModel.load(index_dir/'svd')
+    store = open_corpus_store(index_dir)
+    rows = np.unique(np.linspace(0, n_base - 1, min(sample, n_base)).astype(np.int64))
+    base = embedding_stats(tfidf, svd, [store.get_text(int(i)) for i in rows])
+
+    def rate(s, num, den):
+        return s[num] / s[den] if s[den] else None
+
+    report = {
+        'base_docs': n_base, 'delta_docs': n_delta, 'deleted_docs': n_deleted, 'live_docs': n_live,
+        'delta_fraction': n_delta / max(n_live, 1),
+        'deleted_fraction': n_deleted / max(n_base + n_delta, 1),
+        'oov_rate': {'base': rate(base, 'oov_tokens', 'tokens'), 'delta': rate(delta, 'oov_tokens', 'tokens')},
+        'retention': {'base': rate(base, 'retention_sum', 'docs_embedded'),
+                      'delta': rate(delta, 'retention_sum', 'docs_embedded')},
+    }
+    reasons = []
+    if report['delta_fraction'] > max_delta_fraction:
+        reasons.append(f"delta segments hold {report['delta_fraction']:.0%} of live documents")
+    if report['deleted_fraction'] > max_deleted_fraction:
+        reasons.append(f"{report['deleted_fraction']:.0%} of rows are deleted")
+    oov, ret = report['oov_rate'], report['retention']
+    if oov['delta'] is not None and oov['base'] is not None and oov['delta'] - oov['base'] > max_oov_increase:
+        reasons.append(f"out-of-vocabulary tokens {oov['base']:.1%} -> {oov['delta']:.1%}")
+    if ret['delta'] is not None and ret['base'] is not None and ret['base'] - ret['delta'] > max_retention_drop:
+        reasons.append(f"SVD norm retention {ret['base']:.3f} -> {ret['delta']:.3f}")
+    report['refit_recommended'] = bool(reasons)
+    report['reasons'] = reasons
+    return report
+
+def compact_index(index_dir: Path = IDX, allow_bad_timestamps: bool = False) -> int:
+    """Full rebuild (TF-IDF/SVD refit) from the live documents, published in place of `index_dir`.
+
+    Build options (SVD size, embedding dtype, graph, shards, time partitions, ANN, quantization, streaming) are kept.
+    The new index is swapped in atomically (`publish_index`); processes that already loaded the old index keep
+    serving it until they reload. An index left unlinked by an interrupted compaction is recovered first.
+    """
+    recover_index(index_dir)
+    build = dict(read_manifest(index_dir)['build'])
+    ids = _all_ids(index_dir)
+    alive = np.ones(len(ids), dtype=bool)
+    alive[load_tombstones(index_dir)] = False
+    store = open_corpus_store(index_dir)
+
+    work = index_dir.with_name(index_dir.name + '.compact')
+    shutil.rmtree(work, ignore_errors=True)
+    work.mkdir(parents=True)
+    corpus = work/'corpus.jsonl'
+    with corpus.open('w', encoding='utf-8') as f:
+        for row in np.flatnonzero(alive):
+            doc = {'id': ids[row], 'timestamp': store.get_timestamp(int(row)), 'text': store.get_text(int(row))}
+            f.write(json.dumps(doc, ensure_ascii=False) + '\n')
+
+    build['ann_lists'] = None  # list count follows the new corpus size
+    streaming = build.pop('streaming')
+    if streaming is not None:
+        n = build_indices_streaming(corpus, work/'index', memory_mb=streaming['memory_mb'], progress=False,
+                                    allow_bad_timestamps=allow_bad_timestamps, **build)
+    else:
+        n = build_indices(corpus, work/'index', allow_bad_timestamps=allow_bad_timestamps, **build)
+
+    publish_index(work/'index', index_dir)
+    shutil.rmtree(work, ignore_errors=True)
+    return n
@@ -0,0 +1,272 @@
+# twe_rag/server.py
+"""
+Asyncio JSON query service (stdlib only).
+
+Indices are loaded once. Concurrent requests arriving within `batch_window_ms`
+are coalesced into one `TWERAGPipeline.run_batch` call (a single retrieval GEMM)
+executed on a worker thread, so the event loop keeps accepting requests while
+a batch runs.
+
+  POST /query  {"query": "...", "now": "2025-01-01T00:00:00Z"?, "since": ...?, "until": ...?}
+               -> same dict as run(); bodies over MAX_BODY_BYTES get 413
+  GET  /query?q=...&now=...&since=...&until=...
+  GET  /healthz
+  GET  /metrics   Prometheus text format
+"""
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+from twe_rag.pipeline import TWERAGPipeline
+from twe_rag.tracing import HistogramSink
+
+class Overloaded(Exception):
+    """Too many requests in flight (HTTP 503)."""
+
+class QueueTimeout(Exception):
+    """Request waited longer than `queue_timeout_s` before its batch started (HTTP 504)."""
+
+class RequestTooLarge(Exception):
+    """Request body over `MAX_BODY_BYTES` (HTTP 413)."""
+
+MAX_BODY_BYTES = 1 << 20
+
+@dataclass
+class _Pending:
+    query: str
+    now: Optional[datetime]
+    since: Optional[datetime]
+    until: Optional[datetime]
+    enqueued: float
+    future: asyncio.Future
+
+class QueryService:
+    """Micro-batching front of a pipeline, with bounded in-flight requests."""
+
+    def __init__(self, pipe: TWERAGPipeline, max_batch: int = 64, batch_window_ms: float = 2.0,
+                 max_inflight: int = 512, queue_timeout_s: float = 2.0, workers: int = 1):
+        self.pipe = pipe
+        self.max_batch = max_batch
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_inflight = max_inflight
+        self.queue_timeout = queue_timeout_s
+        self.workers = workers
+        self.sink = HistogramSink()
+        self.counts = {'requests': 0, 'rejected': 0, 'timed_out': 0, 'batches': 0, 'batched_queries': 0}
+        self._inflight = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='twe-rag')
+        self._batcher: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._batcher = asyncio.create_task(self._batch_loop())
+
+    async def stop(self):
+        if self._batcher is not None:
+            self._batcher.cancel()
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, query: str, now: datetime = None, since: datetime = None,
+                     until: datetime = None) -> Dict:
+        if self._inflight >= self.max_inflight:
+            self.counts['rejected'] += 1
+            raise Overloaded(f'{self._inflight} requests in flight')
+        self.counts['requests'] += 1
+        self._inflight += 1
+        try:
+            fut = asyncio.get_running_loop().create_future()
+            self._queue.put_nowait(_Pending(query, now, since, until, time.monotonic(), fut))
+            return await fut
+        finally:
+            self._inflight -= 1
+
+    async def _batch_loop(self):
+        while True:
+            batch = [await self._queue.get()]
+            # let concurrent requests arrive, then take what is queued
+            if self.batch_window > 0:
+                await asyncio.sleep(self.batch_window)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            # batching continues while up to `workers` batches execute
+            await self._slots.acquire()
+            asyncio.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch: List[_Pending]):
+        try:
+            live = []
+            now_mono = time.monotonic()
+            for p in batch:
+                if p.future.done():
+                    continue
+                if now_mono - p.enqueued > self.queue_timeout:
+                    self.counts['timed_out'] += 1
+                    p.future.set_exception(QueueTimeout(f'queued for {now_mono - p.enqueued:.3f}s'))
+                else:
+                    live.append(p)
+            if not live:
+                return
+            self.counts['batches'] += 1
+            self.counts['batched_queries'] += len(live)
+            try:
+                outs = await asyncio.get_running_loop().run_in_executor(self._executor, self._run, live)
+            except Exception as e:
+                for p in live:
+                    if not p.future.done():
+                        p.future.set_exception(e)
+                return
+            for p, out in zip(live, outs):
+                if not p.future.done():
+                    p.future.set_result(out)
+        finally:
+            self._slots.release()
+
+    def _run(self, batch: List[_Pending]) -> List[Dict]:
+        # one run_batch per distinct `now` and date range; requests without a
+        # `now` share the batch clock
+        clock = datetime.now(timezone.utc)
+        groups: Dict[Tuple, List[int]] = {}
+        for i, p in enumerate(batch):
+            groups.setdefault((p.now or clock, p.since, p.until), []).append(i)
+        outs: List[Dict] = [None] * len(batch)
+        for (now, since, until), rows in groups.items():
+            queries = [batch[i].query for i in rows]
+            for i, out in zip(rows, self.pipe.run_batch(queries, now=now, since=since, until=until)):
+                outs[i] = out
+        return outs
+
+    def metrics_text(self) -> str:
+        lines = [self.sink.prometheus_text().rstrip('\n')]
+        for k, v in self.counts.items():
+            lines.append(f'# TYPE twe_rag_service_{k}_total counter')
+            lines.append(f'twe_rag_service_{k}_total {v}')
+        lines.append('# TYPE twe_rag_service_inflight gauge')
+        lines.append(f'twe_rag_service_inflight {self._inflight}')
+        if self.pipe.cache is not None:
+            for k, v in self.pipe.cache.stats().items():
+                lines.append(f'twe_rag_cache_{k} {v}')
+        return '\n'.join(lines) + '\n'
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+def _parse_now(value) -> Optional[datetime]:
+    if value is None:
+        return None
+    now = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    return now if now.tzinfo is not None else now.replace(tzinfo=timezone.utc)
+
+async def _read_request(reader: asyncio.StreamReader,
+                        max_body: int = MAX_BODY_BYTES) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    method, target, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        h = await reader.readline()
+        if h in (b'\r\n', b'\n', b''):
+            break
+        k, _, v = h.decode('latin-1').partition(':')
+        headers[k.strip().lower()] = v.strip()
+    size = int(headers.get('content-length', 0) or 0)
+    if size > max_body:
+        raise RequestTooLarge(f'body of {size} bytes, at most {max_body} accepted')
+    body = await reader.readexactly(size)
+    return method, target, headers, body
+
+class QueryServer:
+    """Minimal HTTP/1.1 (keep-alive) front end for a `QueryService`."""
+
+    def __init__(self, service: QueryService):
+        self.service = service
+
+    async def handle(self, method: str, target: str, body: bytes) -> Tuple[int, str, bytes]:
+        url = urlsplit(target)
+        if url.path == '/healthz':
+            return 200, 'text/plain', b'ok\n'
+        if url.path == '/metrics':
+            return 200, 'text/plain; version=0.0.4', self.service.metrics_text().encode()
+        if url.path != '/query':
+            return 404, 'application/json', b'{"error": "not found"}'
+        try:
+            if method == 'POST':
+                req = json.loads(body or b'{}')
+                query = req['query']
+                now, since, until = (_parse_now(req.get(k)) for k in ('now', 'since', 'until'))
+            elif method == 'GET':
+                qs = parse_qs(url.query)
+                query = qs['q'][0]
+                now, since, until = (_parse_now(qs.get(k, [None])[0]) for k in ('now', 'since', 'until'))
+            else:
+                return 405, 'application/json', b'{"error": "use GET or POST"}'
+            if not isinstance(query, str) or not query.strip():
+                raise ValueError('empty query')
+        except (KeyError, ValueError, TypeError) as e:
+            return 400, 'application/json', json.dumps({'error': f'bad request: {e}'}).encode()
+        try:
+            out = await self.service.submit(query, now, since, until)
+        except Overloaded as e:
+            return 503, 'application/json', json.dumps({'error': f'overloaded: {e}'}).encode()
+        except QueueTimeout as e:
+            return 504, 'application/json', json.dumps({'error': f'queue timeout: {e}'}).encode()
+        except ValueError as e:
+            # e.g. a date range on an index that is not time-partitioned
+            return 400, 'application/json', json.dumps({'error': f'bad request: {e}'}).encode()
+        except Exception as e:
+            return 500, 'application/json', json.dumps({'error': repr(e)}).encode()
+        return 200, 'application/json', json.dumps(out, ensure_ascii=False).encode('utf-8')
+
+    async def _connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    req = await _read_request(reader)
+                except RequestTooLarge as e:
+                    # the body stays unread, so the connection cannot be reused
+                    keep_alive = False
+                    status, ctype, payload = 413, 'application/json', json.dumps({'error': str(e)}).encode()
+                except (ValueError, asyncio.IncompleteReadError):
+                    break
+                else:
+                    if req is None:
+                        break
+                    method, target, headers, body = req
+                    status, ctype, payload = await self.handle(method, target, body)
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                head = (f'HTTP/1.1 {status} {_REASONS[status]}\r\n'
+                        f'Content-Type: {ctype}\r\nContent-Length: {len(payload)}\r\n'
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n")
+                if status == 503:
+                    head += 'Retry-After: 1\r\n'
+                writer.write(head.encode('latin-1') + b'\r\n' + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8000):
+        await self.service.start()
+        server = await asyncio.start_server(self._connection, host, port, backlog=1024)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.service.stop()
+
+def serve(pipe: TWERAGPipeline, host: str = '127.0.0.1', port: int = 8000, **service_kwargs):
+    """Blocking entry point; `service_kwargs` go to `QueryService`."""
+    service = QueryService(pipe, **service_kwargs)
+    pipe.sinks.append(service.sink)
+    asyncio.run(QueryServer(service).serve(host, port))
@@ -0,0 +1,163 @@
+# twe_rag/sharding.py
+"""
+Sharded retrieval across processes.
+
+The corpus is split into S contiguous row ranges. Each shard process holds the
+BM25 postings of its rows (with corpus-wide IDF and length norms) and a view of
+the memory-mapped embedding matrix, so shards share the page cache instead of
+copying embeddings. Queries run in two phases to keep min-max normalization
+global: shards report the min/max of their raw BM25 and dense scores, then
+normalize with the global values and return their local top-K, which the
+coordinator merges. Rankings are those of `HybridRetriever`.
+"""
+import json
+import multiprocessing as mp
+import threading
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from twe_rag.retrieval import BM25Index, HybridRetriever, IDX, top_k_rows
+from twe_rag.text_utils import tokenize
+from twe_rag.tracing import NULL_TRACE
+
+def shard_bounds(n_docs: int, n_shards: int) -> np.ndarray:
+    return np.linspace(0, n_docs, n_shards + 1).round().astype(np.int64)
+
+def write_shards(bm25: BM25Index, path: Path, n_shards: int):
+    if not 1 <= n_shards <= bm25.n_docs:
+        raise ValueError(f"Need 1 <= shards <= {bm25.n_docs} documents, got {n_shards}")
+    bounds = shard_bounds(bm25.n_docs, n_shards)
+    for s in range(n_shards):
+        bm25.shard(int(bounds[s]), int(bounds[s + 1])).save(path/f'{s:03d}')
+    (path/'params.json').write_text(json.dumps({'bounds': bounds.tolist()}), encoding='utf-8')
+
+def _serve_shard(conn, shard_dir: str, dense_path: str, lo: int, hi: int):
+    """Shard process loop: ('score', tokens, Q) then ('top', ...) per query batch."""
+    bm25 = BM25Index.load(Path(shard_dir))
+    dv = np.load(dense_path, mmap_mode='r')[lo:hi]
+    B = D = None
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        if msg[0] == 'score':
+            _, tokens, Q = msg
+            B = np.stack([bm25.get_scores(t) for t in tokens])  # (m, n)
+            # a single query uses the same GEMV as HybridRetriever.retrieve
+            D = np.dot(dv, Q[0])[None, :] if len(Q) == 1 else Q @ dv.T
+            conn.send((B.min(axis=1), B.max(axis=1), D.min(axis=1), D.max(axis=1)))
+        else:
+            _, b_min, b_ptp, d_min, d_ptp, alpha, beta, K = msg
+            b = (B - b_min[:, None]) / (b_ptp[:, None] + 1e-9)
+            d = (D - d_min[:, None]) / (d_ptp[:, None] + 1e-9)
+            combo = alpha*b + beta*d
+            top = top_k_rows(combo, K)
+            rows = np.arange(len(top))[:, None]
+            conn.send((top + lo, b[rows, top], d[rows, top], combo[rows, top]))
+    conn.close()
+
+class ShardedRetriever(HybridRetriever):
+    """`HybridRetriever` whose scoring runs in one process per shard.
+
+    Build the shards with `01_build_indices.py --shards S`; call `close()` to
+    stop the shard processes.
+    """
+
+    def __init__(self, index_dir: Path = IDX):
+        self._load_shared(index_dir)
+        sdir = index_dir/'shards'
+        if not (sdir/'params.json').exists():
+            raise FileNotFoundError(
+                f"Index shards not found: {sdir}\n\n"
+                "Build them with:\n"
+                "  python scripts/01_build_indices.py --shards 4"
+            )
+        if not self.dense_normalized:
+            raise ValueError(f"Embeddings in {index_dir} are not normalized at build time: rebuild indices")
+        if self.live_rows is not None:
+            raise ValueError(f"{index_dir} has ingested or deleted documents: "
+                             "compact it (scripts/06_compact_index.py) before sharded retrieval")
+        bounds = json.loads((sdir/'params.json').read_text(encoding='utf-8'))['bounds']
+        if bounds[-1] != len(self.ids):
+            raise ValueError(f"Shards in {sdir} are stale: rebuild indices with --shards")
+        dense_path = index_dir/'tfidf_svd.npy'
+        self.dv = np.load(dense_path, mmap_mode='r')
+        ctx = mp.get_context('spawn')
+        self._conns, self._procs = [], []
+        for s in range(len(bounds) - 1):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=_serve_shard, daemon=True,
+                               args=(child, str(sdir/f'{s:03d}'), str(dense_path), bounds[s], bounds[s + 1]))
+            proc.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(proc)
+        # one two-phase exchange at a time
+        self._lock = threading.Lock()
+
+    def close(self):
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for proc in self._procs:
+            proc.join(timeout=5)
+        self._conns, self._procs = [], []
+
+    def _scatter(self, tokens: List[List[str]], Q: np.ndarray, K: int, alpha: float, beta: float,
+                 trace=NULL_TRACE) -> List[List[Dict]]:
+        try:
+            parts = self._exchange(tokens, Q, K, alpha, beta, trace)
+        except (EOFError, OSError) as e:
+            dead = [i for i, p in enumerate(self._procs) if not p.is_alive()]
+            raise RuntimeError(f"Shard process(es) {dead} exited; recreate the retriever") from e
+        with trace.stage('topk'):
+            idx, b, d, combo = (np.concatenate([p[k] for p in parts], axis=1) for k in range(4))
+            out = []
+            for r in range(len(tokens)):
+                # same order as top_k: descending score, ties to the lower row
+                order = np.lexsort((idx[r], -combo[r]))[:K]
+                out.append([self._candidate(idx[r, o], b[r, o], d[r, o], combo[r, o]) for o in order])
+        return out
+
+    def _exchange(self, tokens, Q, K, alpha, beta, trace):
+        with self._lock:
+            with trace.stage('shards'):
+                for conn in self._conns:
+                    conn.send(('score', tokens, Q))
+                stats = [conn.recv() for conn in self._conns]
+            with trace.stage('topk'):
+                b_min = np.min([s[0] for s in stats], axis=0)
+                b_ptp = np.max([s[1] for s in stats], axis=0) - b_min
+                d_min = np.min([s[2] for s in stats], axis=0)
+                d_ptp = np.max([s[3] for s in stats], axis=0) - d_min
+                for conn in self._conns:
+                    conn.send(('top', b_min, b_ptp, d_min, d_ptp, alpha, beta, K))
+                return [conn.recv() for conn in self._conns]
+
+    def retrieve(self, query: str, K: int = 100, alpha: float = 1.0, beta: float = 1.0,
+                 trace=NULL_TRACE, since=None, until=None) -> List[Dict]:
+        if since is not None or until is not None:
+            raise ValueError("Date-range filters are not supported by sharded retrieval")
+        with trace.stage('dense'):
+            Q = self._dense_embed(query).astype(self.dv.dtype)[None, :]
+        trace.incr('candidates_scored', len(self.ids))
+        return self._scatter([tokenize(query)], Q, K, alpha, beta, trace)[0]
+
+    def retrieve_recent(self, *args, **kwargs):
+        raise ValueError("Time pruning is not supported by sharded retrieval")
+
+    def retrieve_batch(self, queries: List[str], K: int = 100, alpha: float = 1.0, beta: float = 1.0,
+                       batch_size: int = 256, since=None, until=None) -> List[List[Dict]]:
+        """Like `HybridRetriever.retrieve_batch`, one GEMM per shard and batch."""
+        if since is not None or until is not None:
+            raise ValueError("Date-range filters are not supported by sharded retrieval")
+        out: List[List[Dict]] = []
+        for s in range(0, len(queries), batch_size):
+            chunk = queries[s:s+batch_size]
+            Q = self._dense_embed_batch(chunk).astype(self.dv.dtype)
+            out.extend(self._scatter([tokenize(q) for q in chunk], Q, K, alpha, beta))
+        return out
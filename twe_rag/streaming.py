@@ -0,0 +1,231 @@
+# twe_rag/streaming.py
+"""
+Streaming index build for corpora that do not fit in memory.
+
+The corpus JSONL is read in chunks of about `memory_mb`/16 MB of raw text
+(`memory_mb` sets the chunk size, it does not cap the process's memory):
+
+- pass 1 writes the corpus store, spills each chunk's BM25 postings to disk
+  and counts TF-IDF term frequencies and document frequencies;
+- the TF-IDF vocabulary (50,000 most frequent terms) and IDF are derived from
+  those counts exactly as `TfidfVectorizer.fit` would (`TfidfModel.from_counts`);
+- pass 2 writes the TF-IDF rows of each chunk to disk;
+- the SVD is fitted by randomized subspace iteration over the on-disk rows,
+  one chunk at a time, and a last pass writes the normalized embeddings.
+
+BM25 postings and the TF-IDF model equal those of `build_indices`; the SVD is
+a different randomized solver, so embeddings agree up to approximation error
+of the trailing components.
+"""
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from scipy import linalg
+from tqdm import tqdm
+
+from twe_rag.ann import IVFIndex
+from twe_rag.indexing import MAX_FEATURES, check_timestamps, normalize_embeddings
+from twe_rag.index_format import QueryEncoder, SVDModel, TfidfModel, begin_build, write_manifest
+from twe_rag.io_utils import CorpusStoreWriter, save_strings
+from twe_rag.quantization import build_quantized, save_quantized
+from twe_rag.retrieval import BM25Index
+from twe_rag.sharding import write_shards
+from twe_rag.text_utils import shingle_hashes, tfidf_tokenize, tokenize
+
+def read_corpus_chunks(data_path: Path, chunk_bytes: int) -> Iterator[Tuple[List[str], List[str], List[str], int]]:
+    """(texts, ids, timestamps, bytes read) of consecutive chunks of a corpus JSONL."""
+    docs, ids, times, size = [], [], [], 0
+    with data_path.open('rb') as f:
+        for line in f:
+            size += len(line)
+            if line.strip():
+                obj = json.loads(line)
+                ids.append(obj['id'])
+                times.append(obj['timestamp'])
+                docs.append(obj['text'])
+            if size >= chunk_bytes:
+                yield docs, ids, times, size
+                docs, ids, times, size = [], [], [], 0
+    if docs or size:
+        yield docs, ids, times, size
+
+def _chunk_matrices(paths: List[Path], desc: str, progress: bool) -> Iterator[sp.csr_matrix]:
+    for p in tqdm(paths, desc=desc, unit='chunk', disable=not progress):
+        yield sp.load_npz(p)
+
+def fit_svd_streaming(paths: List[Path], n_features: int, n_components: int, n_oversamples: int = 10,
+                      n_iter: int = 5, seed: int = 42, progress: bool = True) -> SVDModel:
+    """Truncated SVD of the row-stacked sparse matrices in `paths` by randomized subspace iteration.
+
+    Only (n_features, n_components + n_oversamples) blocks are kept in memory;
+    every iteration is one pass over the chunks.
+    """
+    if n_components > n_features:
+        raise ValueError(f"n_components({n_components}) must be <= n_features({n_features}).")
+    size = min(n_components + n_oversamples, n_features)
+    Q = np.random.RandomState(seed).normal(size=(n_features, size))
+    for it in range(n_iter):
+        W = np.zeros_like(Q)
+        for A in _chunk_matrices(paths, f'svd pass {it + 1}/{n_iter + 1}', progress):
+            W += A.T @ (A @ Q)
+        Q, _ = linalg.lu(W, permute_l=True)
+    # Y = A Q without storing it: G = Y'Y and W = A'Y give Q_y' A for an orthonormal basis Q_y of Y
+    G, W = np.zeros((size, size)), np.zeros_like(Q)
+    for A in _chunk_matrices(paths, f'svd pass {n_iter + 1}/{n_iter + 1}', progress):
+        Y = A @ Q
+        G += Y.T @ Y
+        W += A.T @ Y
+    lam, V = linalg.eigh(G)
+    keep = lam > lam[-1] * 1e-12
+    B = (V[:, keep] / np.sqrt(lam[keep])).T @ W.T
+    _, s, Vt = linalg.svd(B, full_matrices=False)
+    Vt = Vt[:n_components]
+    # same sign convention as TruncatedSVD (svd_flip, u_based_decision=False)
+    Vt *= np.sign(Vt[np.arange(len(Vt)), np.argmax(np.abs(Vt), axis=1)])[:, None]
+
+    return SVDModel(Vt, s[:n_components])
+
+def build_indices_streaming(data_path: Path, index_dir: Path, svd_dim: int = 128,
+                            dense_dtype: str = 'float32', graph_threshold: float = None,
+                            graph_mode: str = 'exact', allow_bad_timestamps: bool = False, shards: int = 1,
+                            time_partition: str = None, ann: bool = False, ann_lists: int = None,
+                            quantize: str = None, pq_m: int = 32, memory_mb: float = 1024,
+                            progress: bool = True) -> int:
+    """`build_indices` in chunked passes over `data_path`, reading about `memory_mb`/16 MB of text per chunk.
+
+    Document-level state (ids, timestamps, lengths), the vocabularies with
+    their counts and the BM25 posting offsets stay in memory and grow with the
+    corpus; postings, TF-IDF rows and embeddings go through disk. The corpus
+    graph and time partitions need the whole corpus in memory and are not
+    supported here.
+    """
+    if graph_threshold is not None or time_partition is not None:
+        raise ValueError("Streaming builds support neither the corpus graph nor time partitions; "
+                         "use build_indices for those")
+    if memory_mb <= 0:
+        raise ValueError(f"memory_mb must be positive, got {memory_mb}")
+    chunk_bytes = max(1, int(memory_mb * 2**20 / 16))
+    total = data_path.stat().st_size
+    begin_build(index_dir)
+    shutil.rmtree(index_dir/'segments', ignore_errors=True)
+    (index_dir/'tombstones.npy').unlink(missing_ok=True)
+    (index_dir/'partitions.json').unlink(missing_ok=True)
+    shutil.rmtree(index_dir/'graph', ignore_errors=True)
+
+    with tempfile.TemporaryDirectory(prefix='twe_rag_build_', dir=index_dir) as tmp:
+        tmp = Path(tmp)
+        # pass 1: corpus store, BM25 postings, TF-IDF counts
+        ids, times, doc_len = [], [], []
+        vocab: Dict[str, int] = {}
+        tf_vocab: Dict[str, int] = {}
+        tf_tot, tf_df = [], []
+        store = CorpusStoreWriter(index_dir/'corpus')
+        analyze = tfidf_tokenize
+        bm25_parts = []
+        with tqdm(total=total, unit='B', unit_scale=True, desc='pass 1/2', disable=not progress) as bar:
+            for c, (docs, c_ids, c_times, size) in enumerate(read_corpus_chunks(data_path, chunk_bytes)):
+                tids, dids, tfs, shingles = [], [], [], []
+                for d, text in enumerate(docs, start=len(ids)):
+                    toks = tokenize(text)
+                    doc_len.append(len(toks))
+                    shingles.append(shingle_hashes(toks, n=3))
+                    freqs: Dict[str, int] = {}
+                    for w in toks:
+                        freqs[w] = freqs.get(w, 0) + 1
+                    for w, f in freqs.items():
+                        tids.append(vocab.setdefault(w, len(vocab)))
+                        dids.append(d)
+                        tfs.append(f)
+                    freqs = {}
+                    for w in analyze(text):
+                        freqs[w] = freqs.get(w, 0) + 1
+                    for w, f in freqs.items():
+                        t = tf_vocab.setdefault(w, len(tf_vocab))
+                        if t == len(tf_tot):
+                            tf_tot.append(0)
+                            tf_df.append(0)
+                        tf_tot[t] += f
+                        tf_df[t] += 1
+                store.add(docs, c_times, shingles)
+                part = tmp/f'bm25_{c:05d}.npz'
+                np.savez(part, tids=np.asarray(tids, dtype=np.int64), dids=np.asarray(dids, dtype=np.int32),
+                         tfs=np.asarray(tfs, dtype=np.int32))
+                bm25_parts.append(part)
+                ids += c_ids
+                times += c_times
+                bar.update(size)
+        store.close()
+        epochs, bad = check_timestamps(ids, times, allow_bad_timestamps)
+        np.save(index_dir/'timestamps.npy', epochs)
+        save_strings(index_dir/'ids.npy', ids)
+
+        # BM25: counting sort of the spilled postings into term-major CSR
+        terms = list(vocab)
+        counts = np.zeros(len(terms), dtype=np.int64)
+        for part in bm25_parts:
+            counts += np.bincount(np.load(part)['tids'], minlength=len(terms))
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        doc_ids = np.lib.format.open_memmap(tmp/'doc_ids.npy', mode='w+', dtype=np.int32, shape=(int(indptr[-1]),))
+        tfs = np.lib.format.open_memmap(tmp/'tfs.npy', mode='w+', dtype=np.int32, shape=(int(indptr[-1]),))
+        fill = indptr[:-1].copy()
+        for part in bm25_parts:
+            p = np.load(part)
+            order = np.argsort(p['tids'], kind='stable')  # chunks and their docs come in row order
+            t = p['tids'][order]
+            uniq, start, cnt = np.unique(t, return_index=True, return_counts=True)
+            pos = fill[t] + np.arange(len(t)) - np.repeat(start, cnt)
+            doc_ids[pos] = p['dids'][order]
+            tfs[pos] = p['tfs'][order]
+            fill[uniq] += cnt
+        bm25 = BM25Index(terms, indptr, doc_ids, tfs, np.asarray(doc_len, dtype=np.int64))
+        bm25.save(index_dir/'bm25')
+        shutil.rmtree(index_dir/'shards', ignore_errors=True)
+        if shards > 1:
+            write_shards(bm25, index_dir/'shards', shards)
+        del bm25, doc_ids, tfs
+
+        # pass 2: TF-IDF rows
+        tfidf = TfidfModel.from_counts(list(tf_vocab), np.asarray(tf_tot), np.asarray(tf_df), len(ids), MAX_FEATURES)
+        rows = []
+        with tqdm(total=total, unit='B', unit_scale=True, desc='pass 2/2', disable=not progress) as bar:
+            for c, (docs, _, _, size) in enumerate(read_corpus_chunks(data_path, chunk_bytes)):
+                rows.append(tmp/f'tfidf_{c:05d}.npz')
+                sp.save_npz(rows[-1], tfidf.transform(docs), compressed=False)
+                bar.update(size)
+        tfidf.save(index_dir/'tfidf')
+
+        # SVD and embeddings
+        n_features = tfidf.n_features
+        svd = fit_svd_streaming(rows, n_features, svd_dim, progress=progress)
+        dv = np.lib.format.open_memmap(index_dir/'tfidf_svd.npy', mode='w+', dtype=dense_dtype,
+                                       shape=(len(ids), svd_dim))
+        lo = 0
+        for A in _chunk_matrices(rows, 'embeddings', progress):
+            Xs = svd.transform(A)
+            dv[lo:lo + len(Xs)] = normalize_embeddings(Xs, dense_dtype)
+            lo += len(Xs)
+        dv.flush()
+        del dv
+        svd.save(index_dir/'svd')
+        QueryEncoder.build(tfidf, svd).save(index_dir/'svd'/'term_table.npy')
+
+    dv = np.load(index_dir/'tfidf_svd.npy', mmap_mode='r')
+    shutil.rmtree(index_dir/'ann', ignore_errors=True)
+    if ann:
+        IVFIndex.build(dv, ann_lists).save(index_dir/'ann')
+    shutil.rmtree(index_dir/'quant', ignore_errors=True)
+    if quantize is not None:
+        save_quantized(build_quantized(dv, quantize, pq_m), index_dir/'quant')
+
+    build = {'svd_dim': svd_dim, 'dense_dtype': dense_dtype, 'graph_threshold': None, 'graph_mode': graph_mode,
+             'shards': shards, 'time_partition': None, 'ann': ann, 'ann_lists': ann_lists, 'quantize': quantize,
+             'pq_m': pq_m, 'streaming': {'memory_mb': memory_mb}}
+    write_manifest(index_dir, len(ids), dense={'normalized': True, 'dtype': dense_dtype},
+                   bad_timestamps=[ids[i] for i in bad], build=build)
+    return len(ids)
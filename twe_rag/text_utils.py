@@ -1,13 +1,51 @@
 # twe_rag/text_utils.py
 import re
-from typing import List, Set
+from hashlib import blake2b
+from typing import List, Set, Dict
+
+import numpy as np
 
 _word = re.compile(r"[A-Za-z0-9_]+")
 
 def tokenize(text: str) -> List[str]:
     return _word.findall(text.lower())
 
+_tfidf_word = re.compile(r"(?u)\b\w\w+\b")
+
+def tfidf_tokenize(text: str) -> List[str]:
+    """TfidfVectorizer's default analyzer: lowercased words of 2+ characters, Unicode-aware."""
+    return _tfidf_word.findall(text.lower())
+
 def shingles(tokens: List[str], n: int = 3) -> Set[str]:
     if len(tokens) < n:
         return set([' '.join(tokens)]) if tokens else set()
     return { ' '.join(tokens[i:i+n]) for i in range(len(tokens)-n+1) }
+
+_token_hashes: Dict[str, int] = {}
+
+def _splitmix64(x: np.ndarray) -> np.ndarray:
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def token_hashes(tokens: List[str]) -> np.ndarray:
+    """Stable 64-bit hash per token (cached, independent of PYTHONHASHSEED)."""
+    out = np.empty(len(tokens), dtype=np.uint64)
+    for i, t in enumerate(tokens):
+        h = _token_hashes.get(t)
+        if h is None:
+            h = _token_hashes[t] = int.from_bytes(blake2b(t.encode('utf-8'), digest_size=8).digest(), 'little')
+        out[i] = h
+    return out
+
+def shingle_hashes(tokens: List[str], n: int = 3) -> np.ndarray:
+    """Sorted unique uint64 hashes of `shingles(tokens, n)`, one per shingle."""
+    th = token_hashes(tokens)
+    k = min(n, len(th))
+    if k == 0:
+        return np.zeros(0, dtype=np.uint64)
+    h = np.full(len(th) - k + 1, k, dtype=np.uint64)
+    for i in range(k):
+        h = _splitmix64(h ^ th[i:len(th) - k + 1 + i])
+    return np.unique(h)
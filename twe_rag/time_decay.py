@@ -1,7 +1,10 @@
 # twe_rag/time_decay.py
 from dataclasses import dataclass
+import math
 import re
 from datetime import datetime, timezone
+from typing import List, Tuple
+import numpy as np
 from dateutil.parser import isoparse
 
 RECENCY_TERMS = [
@@ -10,6 +13,25 @@ RECENCY_TERMS = [
 ]
 REC_RE = re.compile(r"|".join(RECENCY_TERMS), re.IGNORECASE)
 
+def parse_epoch(doc_timestamp_iso: str) -> float:
+    """ISO timestamp -> epoch seconds (naive timestamps are taken as UTC)."""
+    dt = isoparse(doc_timestamp_iso)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+def parse_epochs(timestamps: List[str]) -> Tuple[np.ndarray, List[int]]:
+    """Epoch seconds for every timestamp; unparseable rows are NaN and returned as a list."""
+    epochs = np.empty(len(timestamps), dtype=np.float64)
+    bad = []
+    for i, ts in enumerate(timestamps):
+        try:
+            epochs[i] = parse_epoch(ts)
+        except (ValueError, OverflowError, TypeError):
+            epochs[i] = np.nan
+            bad.append(i)
+    return epochs, bad
+
 @dataclass
 class DecayParams:
     delta: float  # weight for decay term
@@ -51,5 +73,17 @@ class TimeDecay:
         if dt.tzinfo is None:
             dt = dt.replace(tzinfo=timezone.utc)
         age_days = (now - dt).total_seconds() / 86400.0
-        import math
         return float(math.exp(-age_days / max(tau_days, 1e-3)))
+
+    def decay_batch(self, epochs: np.ndarray, now: datetime, tau_days: float, idx: np.ndarray = None) -> np.ndarray:
+        """Decay for many documents at once from pre-parsed epoch seconds.
+
+        `idx` selects rows of `epochs`. Rows whose timestamp could not be parsed
+        at build time (NaN) get no recency credit (decay 0).
+        """
+        if now.tzinfo is None:
+            now = now.replace(tzinfo=timezone.utc)
+        ep = epochs if idx is None else epochs[idx]
+        age_days = (now.timestamp() - ep) / 86400.0
+        out = np.exp(-age_days / max(tau_days, 1e-3))
+        return np.nan_to_num(out, nan=0.0)
@@ -0,0 +1,126 @@
+# twe_rag/tracing.py
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List
+
+import numpy as np
+
+class Trace:
+    """Per-query stage timings (monotonic clock) and counters."""
+
+    enabled = True
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + (time.perf_counter() - t0)
+
+    def add_time(self, name: str, seconds: float):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def incr(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def as_dict(self) -> Dict:
+        return {
+            'timings_ms': {k: v * 1000.0 for k, v in self.timings.items()},
+            'counters': dict(self.counters),
+        }
+
+class NullTrace:
+    """Disabled trace: every hook is a no-op."""
+
+    enabled = False
+    _ctx = nullcontext()
+
+    def stage(self, name: str):
+        return self._ctx
+
+    def add_time(self, name: str, seconds: float):
+        pass
+
+    def incr(self, name: str, n: int = 1):
+        pass
+
+NULL_TRACE = NullTrace()
+
+# latency buckets in seconds (upper bounds), Prometheus-style
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class HistogramSink:
+    """In-process aggregator of trace dicts: per-stage latency histograms and counter totals.
+
+    Use as a pipeline sink; `prometheus_text()` renders the Prometheus text format.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix: str = 'twe_rag'):
+        self.buckets = np.asarray(buckets, dtype=float)
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counts: Dict[str, np.ndarray] = {}
+        self._sums: Dict[str, float] = {}
+        self._totals: Dict[str, int] = {}
+        self._n = 0
+
+    def __call__(self, trace: Dict):
+        with self._lock:
+            self._n += 1
+            for stage, ms in trace['timings_ms'].items():
+                s = ms / 1000.0
+                if stage not in self._counts:
+                    self._counts[stage] = np.zeros(len(self.buckets) + 1, dtype=np.int64)
+                    self._sums[stage] = 0.0
+                self._counts[stage][np.searchsorted(self.buckets, s)] += 1
+                self._sums[stage] += s
+            for k, v in trace['counters'].items():
+                self._totals[k] = self._totals.get(k, 0) + v
+
+    def percentile(self, stage: str, q: float) -> float:
+        """Bucket upper bound (seconds) below which `q` percent of `stage` samples fall."""
+        with self._lock:
+            counts = self._counts[stage].copy()
+        cum = np.cumsum(counts)
+        i = int(np.searchsorted(cum, q / 100.0 * cum[-1]))
+        return float(self.buckets[i]) if i < len(self.buckets) else float('inf')
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'queries': self._n,
+                'stages': {s: {'count': int(c.sum()), 'sum_s': self._sums[s], 'buckets': c.tolist()}
+                           for s, c in self._counts.items()},
+                'counters': dict(self._totals),
+            }
+
+    def prometheus_text(self) -> str:
+        name = f'{self.prefix}_stage_seconds'
+        lines = [f'# HELP {name} Pipeline stage latency.', f'# TYPE {name} histogram']
+        with self._lock:
+            for stage in sorted(self._counts):
+                cum = np.cumsum(self._counts[stage])
+                for le, c in zip(self.buckets, cum):
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{le:g}"}} {int(c)}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {int(cum[-1])}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {self._sums[stage]:.9f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {int(cum[-1])}')
+            lines.append(f'# TYPE {self.prefix}_queries_total counter')
+            lines.append(f'{self.prefix}_queries_total {self._n}')
+            for k in sorted(self._totals):
+                lines.append(f'# TYPE {self.prefix}_{k}_total counter')
+                lines.append(f'{self.prefix}_{k}_total {self._totals[k]}')
+        return '\n'.join(lines) + '\n'
+
+Sink = Callable[[Dict], None]
+
+def emit(sinks: List[Sink], trace: Dict):
+    for sink in sinks:
+        sink(trace)